@@ -0,0 +1,137 @@
+"""
+Measures how the frame decoder copes with multi-megabyte replies delivered
+by the socket in small segments, compared with the naive approach of
+concatenating bytes and slicing them.
+
+Usage:
+    python benchmarks/bench_framing.py [--size-mb N] [--segment-kb N]
+
+It only needs the python standard library, the framing and codec modules are
+imported straight from the engine package so no Qt or Toolkit is required.
+"""
+
+import os
+import sys
+import time
+import struct
+import argparse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python", "tk_harmony")
+)
+
+from codec import JSON_CODEC  # noqa: E402
+from framing import FrameDecoder, pack_frame  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+def recorded_stream(size_mb):
+    """
+    A stream as Harmony would send it: a handful of small replies around a
+    big GET_NODES_OF_TYPE one.
+    """
+    nodes = []
+    total = 0
+    while total < size_mb * 1024 * 1024:
+        node = "Top/Group_%03d/Drawing_%07d" % (len(nodes) % 50, len(nodes))
+        nodes.append(node)
+        total += len(node) + 4
+
+    messages = [
+        {"jsonrpc": "2.0", "result": "PONG", "id": 1},
+        {"jsonrpc": "2.0", "result": nodes, "id": 2},
+        {"jsonrpc": "2.0", "result": True, "id": 3},
+    ]
+    return b"".join(pack_frame(JSON_CODEC.encode(message)) for message in messages)
+
+
+def segments(stream, segment_size):
+    return [stream[i : i + segment_size] for i in range(0, len(stream), segment_size)]
+
+
+def naive_decode(chunks):
+    buffer = b""
+    payloads = []
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= 4:
+            size = struct.unpack(">i", buffer[:4])[0]
+            if len(buffer) < 4 + size:
+                break
+            payloads.append(len(buffer[4 : 4 + size]))
+            buffer = buffer[4 + size :]
+    return payloads
+
+
+def frame_decoder_decode(chunks):
+    decoder = FrameDecoder()
+    payloads = []
+    for chunk in chunks:
+        decoder.feed(chunk)
+        for payload in decoder.frames():
+            payloads.append(len(payload))
+    return payloads
+
+
+def measure(func, chunks):
+    if tracemalloc:
+        tracemalloc.start()
+
+    st = time.time()
+    result = func(chunks)
+    elapsed = time.time() - st
+
+    peak = None
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=8)
+    parser.add_argument("--segment-kb", type=int, default=64)
+    args = parser.parse_args()
+
+    stream = recorded_stream(args.size_mb)
+    chunks = segments(stream, args.segment_kb * 1024)
+    print(
+        "stream: %.1f MB in %d segments of %d KB"
+        % (len(stream) / 1024.0 / 1024.0, len(chunks), args.segment_kb)
+    )
+
+    print("%-16s %12s %16s" % ("decoder", "time ms", "peak alloc MB"))
+    results = []
+    for name, func in (("naive", naive_decode), ("FrameDecoder", frame_decoder_decode)):
+        result, elapsed, peak = measure(func, chunks)
+        results.append(result)
+        print(
+            "%-16s %12.2f %16s"
+            % (name, elapsed * 1000, "%.1f" % (peak / 1024.0 / 1024.0) if peak else "n/a")
+        )
+
+    assert results[0] == results[1], "Decoders disagree on the frames found."
+
+    # and the payload can be decoded straight from the buffer
+    decoder = FrameDecoder()
+    decoder.feed(stream)
+    st = time.time()
+    replies = [JSON_CODEC.decode(payload) for payload in decoder.frames()]
+    print(
+        "json decode of the %d replies from the buffer: %.2f ms"
+        % (len(replies), (time.time() - st) * 1000)
+    )
+
+
+if __name__ == "__main__":
+    main()
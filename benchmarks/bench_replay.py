@@ -0,0 +1,160 @@
+"""
+Replays the traffic captured in a real session against the python stand-in
+server and reports how the latency of the replies compares.
+
+Usage:
+    python benchmarks/bench_replay.py capture.tkhc [--flat-out] [--speed N]
+                                      [--output results.json]
+                                      [--compare baseline.json]
+                                      [--max-ratio R]
+
+Captures are recorded by the engine when SGTK_HARMONY_ENGINE_CAPTURE_PATH is
+set at launch time, see python/tk_harmony/capture.py. By default the
+original timing between frames is kept, --flat-out sends them as soon as the
+replies they depend on arrive.
+
+With --compare, the p50 and p99 latency of every method is compared with the
+ones of a previous replay and, if --max-ratio is given, the script exits
+with an error when any of them became slower than that, so it can run in CI.
+It only needs the python standard library.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "python", "tk_harmony"))
+
+from capture import Replayer  # noqa: E402
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT).strip()
+        status = subprocess.check_output(["git", "status", "--porcelain"], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.decode("utf-8"), bool(status)
+
+
+def start_server(args):
+    command = [
+        sys.executable,
+        os.path.join(ROOT, "python", "tk_harmony", "standin_server.py"),
+        "--nodes",
+        str(args.nodes),
+        "--latency",
+        str(args.latency),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+
+    # the server prints the environment the engine would get, then serves
+    environment = {}
+    while len(environment) < 2:
+        line = process.stdout.readline()
+        if not line:
+            sys.exit("The stand-in server did not start.")
+        name, _, value = line.strip().partition("=")
+        environment[name] = value
+    return process, environment
+
+
+def latencies(report):
+    """
+    Returns the p50 and p99 latency of every method replied to.
+    """
+    result = {}
+    for method, metrics in report["methods"].items():
+        latency = metrics["latency"]
+        if latency["count"]:
+            result[method] = (latency["p50_ms"], latency["p99_ms"])
+    return result
+
+
+def compare(current, previous):
+    """
+    Prints the ratio between the latencies given, method by method.
+
+    :returns: The biggest of the ratios.
+    """
+    print("%-32s %8s %12s %12s %8s" % ("method", "", "baseline", "current", "ratio"))
+    worst = 0
+    for method in sorted(current):
+        if method not in previous:
+            continue
+        for name, value, baseline in zip(("p50", "p99"), current[method], previous[method]):
+            ratio = value / baseline if baseline else 1.0
+            worst = max(worst, ratio)
+            print("%-32s %8s %12.3f %12.3f %8.2f" % (method, name, baseline, value, ratio))
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capture", help="Capture file recorded by the engine.")
+    parser.add_argument("--flat-out", action="store_true", help="Ignore the original timing.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed up the original timing.")
+    parser.add_argument("--timeout", type=int, default=10000, help="Milliseconds per reply.")
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0, help="Server ms per callback.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="JSON results of a previous replay to compare with.")
+    parser.add_argument("--max-ratio", type=float, help="Fail if any latency grew more.")
+    args = parser.parse_args()
+
+    replayer = Replayer(
+        args.capture, timing=not args.flat_out, speed=args.speed, timeout=args.timeout
+    )
+
+    process, environment = start_server(args)
+    try:
+        host = environment["SGTK_HARMONY_ENGINE_HOST"]
+        port = int(environment["SGTK_HARMONY_ENGINE_PORT"])
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        results = replayer.run(sock)
+        sock.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+    commit, dirty = git_revision()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server_latency_ms": args.latency,
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if results["missing_replies"]:
+        print("%s requests were not replied to." % results["missing_replies"])
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        worst = compare(latencies(results["replay"]), latencies(baseline["results"]["replay"]))
+        if args.max_ratio and worst > args.max_ratio:
+            sys.exit("Latency grew %.2f times, over the %.2f allowed." % (worst, args.max_ratio))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Measures the latency and throughput of the RPC calls between the engine and
+Harmony, driving the real client against the python stand-in server.
+
+Usage:
+    python benchmarks/bench_rpc.py [--transport tcp|local]
+                                   [--count N] [--output results.json]
+                                   [--compare baseline.json]
+
+It covers the call patterns the engine uses: send_and_receive_command,
+send_command, broadcast_event and batches of asynchronous requests, plus
+round trips with payloads from 100 bytes up to 10 MB. Results are written as
+JSON together with the commit they were measured on, so runs on different
+commits can be compared with --compare.
+
+Unlike the other benchmarks this one needs Toolkit (tk-core) and Qt, as the
+client is the one the engine uses. Outside of a Toolkit install both can be
+installed with pip, tk-core is published as sgtk::
+
+    pip install sgtk PySide2
+
+The stand-in server runs in its own process so it does not compete with the
+client for the GIL.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "python"))
+
+# the client needs a QApplication, no display is needed for it
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+try:
+    import sgtk
+except ImportError:
+    sys.exit("This benchmark needs tk-core in the PYTHONPATH, i.e. pip install sgtk PySide2")
+
+# outside of an engine nobody sets up the qt modules for toolkit
+import sgtk.platform.qt as qt  # noqa: E402
+
+__importer = sgtk.util.qt_importer.QtImporter()
+qt.QtCore = __importer.QtCore
+qt.QtGui = __importer.QtGui
+
+from tk_harmony.application import Application  # noqa: E402
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+SIZES = [100, 1000, 10 * 1000, 100 * 1000, 1000 * 1000, 10 * 1000 * 1000]
+
+
+class BenchmarkEngine(object):
+    """
+    The little of the engine the application needs.
+    """
+
+    logger = logging.getLogger("bench_rpc")
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT).strip()
+        status = subprocess.check_output(["git", "status", "--porcelain"], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.decode("utf-8"), bool(status)
+
+
+def start_server(args):
+    command = [
+        sys.executable,
+        os.path.join(ROOT, "python", "tk_harmony", "standin_server.py"),
+        "--nodes",
+        str(args.nodes),
+        "--latency",
+        str(args.latency),
+    ]
+    if args.transport == "local":
+        command += ["--socket-name", "tk-harmony-bench-%s" % os.getpid()]
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+
+    # the server prints the environment the engine would get, then serves
+    environment = {}
+    while len(environment) < 2:
+        line = process.stdout.readline()
+        if not line:
+            sys.exit("The stand-in server did not start.")
+        name, _, value = line.strip().partition("=")
+        environment[name] = value
+    return process, environment
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "count": count,
+        "mean_ms": sum(latencies) / count,
+        "p50_ms": latencies[count // 2],
+        "p90_ms": latencies[int(count * 0.9) - 1],
+        "p99_ms": latencies[max(int(count * 0.99) - 1, 0)],
+        "max_ms": latencies[-1],
+    }
+
+
+def measure_round_trips(app, method, count, **kwargs):
+    app.send_and_receive_command(method, **kwargs)
+
+    latencies = []
+    st = time.time()
+    for _ in range(count):
+        call_st = time.time()
+        app.send_and_receive_command(method, **kwargs)
+        latencies.append((time.time() - call_st) * 1000)
+    elapsed = time.time() - st
+
+    result = percentiles(latencies)
+    result["requests_per_second"] = count / elapsed
+    return result
+
+
+def measure_one_way(app, send, count):
+    # fire and forget calls are done once the server answers the next ping
+    st = time.time()
+    for _ in range(count):
+        send()
+    app.send_and_receive_command("PING")
+    elapsed = time.time() - st
+    return {"count": count, "requests_per_second": count / elapsed}
+
+
+def measure_batches(app, count, batch_size):
+    st = time.time()
+    for _ in range(count // batch_size):
+        with app.batch():
+            futures = [app.send_command_async("PING") for _ in range(batch_size)]
+        app.wait_for(futures)
+    elapsed = time.time() - st
+    return {
+        "count": count,
+        "batch_size": batch_size,
+        "requests_per_second": count / elapsed,
+    }
+
+
+def run(args, app):
+    results = {}
+
+    results["send_and_receive_command"] = measure_round_trips(app, "PING", args.count)
+
+    results["send_command"] = measure_one_way(
+        app, lambda: app.send_command("LOG_DEBUG", message="benchmark"), args.count
+    )
+
+    results["broadcast_event"] = measure_one_way(
+        app, lambda: app.broadcast_event("ENGINE_READY"), args.count
+    )
+
+    results["batch"] = measure_batches(app, args.count, 50)
+
+    results["get_nodes_of_type"] = measure_round_trips(
+        app, "GET_NODES_OF_TYPE", max(args.count // 100, 5), node_types=["READ"]
+    )
+
+    payloads = {}
+    for size in SIZES:
+        # fewer round trips as the payload grows, they take long enough
+        count = max(5, min(args.count, args.count * 1000 // size))
+        payloads[str(size)] = measure_round_trips(app, "ECHO", count, payload="x" * size)
+    results["echo_payload"] = payloads
+
+    return results
+
+
+def compare(results, baseline):
+    """
+    Prints how the results compare to the ones of a previous run.
+    """
+    print("%-40s %14s %14s %8s" % ("measure", "baseline", "current", "ratio"))
+
+    def walk(current, previous, prefix):
+        for key in sorted(current):
+            value = current[key]
+            if isinstance(value, dict):
+                walk(value, previous.get(key) or {}, prefix + key + ".")
+            elif key in ("p50_ms", "p99_ms", "requests_per_second") and previous.get(key):
+                print(
+                    "%-40s %14.3f %14.3f %8.2f"
+                    % (prefix + key, previous[key], value, value / previous[key])
+                )
+
+    walk(results["results"], baseline.get("results") or {}, "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--transport", default="tcp", choices=["tcp", "local"])
+    parser.add_argument("--compression-threshold", type=int, default=0)
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0, help="Server ms per callback.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with.")
+    args = parser.parse_args()
+
+    qt_app = qt.QtGui.QApplication.instance() or qt.QtGui.QApplication(sys.argv)  # noqa: F841
+
+    process, environment = start_server(args)
+    try:
+        app = Application(
+            BenchmarkEngine(),
+            host=environment.get("SGTK_HARMONY_ENGINE_HOST", "127.0.0.1"),
+            port=int(environment.get("SGTK_HARMONY_ENGINE_PORT", 0)),
+            compression_threshold=args.compression_threshold,
+            transport=args.transport,
+            socket_name=environment.get("SGTK_HARMONY_ENGINE_SOCKET_NAME"),
+        )
+        app.register_callback("PING", lambda **kwargs: True)
+        app.connect_to_host()
+
+        results = run(args, app)
+        app.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+    commit, dirty = git_revision()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "transport": args.transport,
+        "compression_threshold": args.compression_threshold,
+        "server_latency_ms": args.latency,
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Measures the overhead per message of tracing the requests sent to Harmony,
+with tracing disabled and enabled, compared to formatting the debug message
+eagerly as the client used to.
+
+Usage:
+    python benchmarks/bench_trace.py [--count N] [--limit N]
+
+Messages go to a logger that drops them, so only the cost of deciding
+whether to log and of formatting is measured. It only needs the python
+standard library.
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python", "tk_harmony")
+)
+
+from trace import Tracer  # noqa: E402
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+def make_request(size):
+    return {
+        "jsonrpc": "2.0",
+        "method": "GET_NODES_OF_TYPE",
+        "params": {"node_types": ["READ"], "payload": "x" * size},
+        "request_return": True,
+        "id": "5f0e3c1a2b6d4e7f8a9b0c1d2e3f4a5b",
+    }
+
+
+def measure(function, count):
+    st = time.time()
+    for _ in range(count):
+        function()
+    return (time.time() - st) / count * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=256)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench_trace")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    print("%-10s %-10s %-28s %12s" % ("payload", "debug", "method", "ns/message"))
+    for size in (100, 10 * 1000, 100 * 1000):
+        request = make_request(size)
+        count = max(100, args.count * 100 // size)
+
+        for enabled in (False, True):
+            logger.setLevel(logging.DEBUG if enabled else logging.INFO)
+            trace = Tracer(logger, limit=args.limit, enabled=enabled)
+
+            def nothing():
+                pass
+
+            def eager():
+                logger.debug("Sent request in %s secs: %s" % (0.001, request))
+
+            def traced():
+                trace("Sent request in %s secs: %s", 0.001, request)
+
+            def guarded():
+                if trace.enabled:
+                    trace("Sent request in %s secs: %s", 0.001, request)
+
+            for name, function in (
+                ("no logging", nothing),
+                ("eager logger.debug", eager),
+                ("tracer", traced),
+                ("tracer, guarded", guarded),
+            ):
+                print(
+                    "%-10s %-10s %-28s %12.1f"
+                    % (size, "on" if enabled else "off", name, measure(function, count))
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Compares the round trip latency of framed messages over a TCP loopback
+connection and over a unix domain socket, the two transports the engine can
+use to talk to Harmony.
+
+Usage:
+    python benchmarks/bench_transport.py [--count N]
+
+An echo server runs in a thread and sends back every frame it receives. It
+only needs the python standard library. Unix domain sockets are not
+available on Windows, where only TCP is measured.
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python", "tk_harmony")
+)
+
+from framing import FrameDecoder, pack_frame  # noqa: E402
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+SIZES = [64, 1024, 64 * 1024, 1024 * 1024]
+
+
+def echo(connection):
+    decoder = FrameDecoder()
+    while True:
+        data = connection.recv(1024 * 1024)
+        if not data:
+            break
+        decoder.feed(data)
+        for payload in decoder.frames():
+            connection.sendall(pack_frame(payload.tobytes()))
+    connection.close()
+
+
+def serve(server):
+    connection, _ = server.accept()
+    echo(connection)
+    server.close()
+
+
+def round_trip(client, decoder, frame):
+    client.sendall(frame)
+    while True:
+        for payload in decoder.frames():
+            return payload
+        decoder.feed(client.recv(1024 * 1024))
+
+
+def measure(family, address, count):
+    server = socket.socket(family, socket.SOCK_STREAM)
+    server.bind(address)
+    server.listen(1)
+    thread = threading.Thread(target=serve, args=(server,))
+    thread.daemon = True
+    thread.start()
+
+    client = socket.socket(family, socket.SOCK_STREAM)
+    client.connect(server.getsockname())
+    if family == socket.AF_INET:
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    decoder = FrameDecoder()
+    results = []
+    for size in SIZES:
+        frame = pack_frame(b"x" * size)
+        # fewer round trips for the big payloads, they take long enough
+        repeat = max(10, count * 1024 // max(size, 1024))
+
+        round_trip(client, decoder, frame)
+        latencies = []
+        for _ in range(repeat):
+            st = time.time()
+            round_trip(client, decoder, frame)
+            latencies.append((time.time() - st) * 1000000)
+
+        latencies.sort()
+        results.append(
+            (size, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1])
+        )
+
+    client.close()
+    thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000)
+    args = parser.parse_args()
+
+    transports = [("tcp", socket.AF_INET, ("127.0.0.1", 0))]
+    if hasattr(socket, "AF_UNIX"):
+        path = os.path.join(tempfile.mkdtemp(), "bench.sock")
+        transports.append(("local", socket.AF_UNIX, path))
+
+    print("%-8s %12s %12s %12s" % ("transport", "bytes", "p50 us", "p99 us"))
+    for name, family, address in transports:
+        for size, p50, p99 in measure(family, address, args.count):
+            print("%-8s %12d %12.1f %12.1f" % (name, size, p50, p99))
+
+        if family != socket.AF_INET:
+            os.remove(address)
+            os.rmdir(os.path.dirname(address))
+
+
+if __name__ == "__main__":
+    main()
@@ -39,6 +39,17 @@ SHOW_COMP_DLG = "SGTK_COMPATIBILITY_DIALOG_SHOWN"
 
 MIN_DCC_VERSION = 16.0
 
+# formatters for the toolkit log records, built once instead of per record:
+#     Shotgun <basename>: <message>
+# where "basename" is the leaf part of the logging record name,
+# for example "tk-multi-shotgunpanel" or "qt_importer".
+DEBUG_LOG_FORMATTER = logging.Formatter("Debug: Shotgun %(basename)s: %(message)s")
+LOG_FORMATTER = logging.Formatter("Shotgun %(basename)s: %(message)s")
+
+# milliseconds Harmony has to stop sending project opened/created events
+# before the engine refreshes, a burst of them only refreshes once.
+PROJECT_EVENT_DELAY = 250
+
 # logging functionality
 def display_error(msg):
     t = time.asctime(time.localtime())
@@ -70,6 +81,8 @@ def display_debug(msg):
 def refresh_engine(scene_name, prev_context):
     """
     refresh the current engine
+
+    :returns: True if the engine was refreshed.
     """
 
     engine = tank.platform.current_engine()
@@ -78,7 +91,7 @@ def refresh_engine(scene_name, prev_context):
         # If we don't have an engine for some reason then we don't have
         # anything to do.
         sys.stdout.write("refresh_engine | no engine!\n")
-        return
+        return False
 
     # This is a File->New call, so we just leave the engine in the current
     # context and move on.
@@ -89,7 +102,7 @@ def refresh_engine(scene_name, prev_context):
         # shotgun menu may have been removed, so add it back in if its not
         # already there.
         engine.create_shotgun_menu()
-        return
+        return True
 
     # determine the tk instance and ctx to use:
     tk = engine.sgtk
@@ -101,8 +114,7 @@ def refresh_engine(scene_name, prev_context):
     # API instance.
     try:
         # and construct the new context for this path:
-        tk = tank.tank_from_path(new_path)
-        ctx = tk.context_from_path(new_path, prev_context)
+        ctx = engine.context_from_path(new_path, prev_context)
     except tank.TankError as e:
         try:
             # could not detect context from path, will use the project context
@@ -130,7 +142,7 @@ def refresh_engine(scene_name, prev_context):
             # disabled menu, could not get project context
             engine.create_shotgun_menu(disabled=True)
             engine.show_error(message)
-            return
+            return False
 
     if ctx != engine.context:
         engine.change_context(ctx)
@@ -138,6 +150,7 @@ def refresh_engine(scene_name, prev_context):
     # shotgun menu may have been removed,
     # so add it back in if its not already there.
     engine.create_shotgun_menu()
+    return True
 
 
 class HarmonyEngine(Engine):
@@ -153,6 +166,20 @@ class HarmonyEngine(Engine):
         self._dcc_app = None
         self._menu_generator = None
 
+        # log messages are displayed in batches once the engine modules are
+        # loaded, see _emit_log_message
+        self._log_buffer = None
+
+        # last project event in a burst, and what the last refresh was for,
+        # see _queue_project_event
+        self._project_event = None
+        self._project_event_timer = None
+        self._refreshed_project = None
+
+        # contexts resolved for the folders work files are opened from, see
+        # context_from_path
+        self._context_cache = None
+
         Engine.__init__(self, *args, **kwargs)
 
     @property
@@ -267,6 +294,65 @@ class HarmonyEngine(Engine):
                 },
             )
 
+    def __rpc_metrics_path(self):
+        """
+        Returns where the RPC metrics of this session are dumped.
+        """
+        path = os.environ.get("SGTK_HARMONY_ENGINE_METRICS_PATH")
+        if path:
+            return path
+
+        started = time.strftime("%Y%m%d_%H%M%S", time.localtime(self._dcc_app.metrics.started))
+        filename = "tk-harmony_rpc_metrics_%s_%s.json" % (started, os.getpid())
+        return os.path.join(LogManager().log_folder, filename)
+
+    def dump_rpc_metrics(self):
+        """
+        Writes the metrics of the calls made to Harmony so far as JSON.
+
+        :returns: The path to the file written, or None if it failed.
+        """
+        if not self._dcc_app:
+            return None
+
+        path = self.__rpc_metrics_path()
+        try:
+            self._dcc_app.metrics.dump(path)
+        except (IOError, OSError) as e:
+            self.logger.error("Could not write RPC metrics to %s: %s" % (path, e))
+            return None
+        return path
+
+    def __show_rpc_metrics(self):
+        """
+        Logs the RPC metrics of this session and dumps them to disk.
+        """
+        if not self._dcc_app:
+            return
+
+        self.logger.info("RPC metrics:\n%s" % self._dcc_app.metrics.summary())
+        self.logger.info("RPC write queue: %s" % self._dcc_app.write_queue_stats())
+        self.logger.info("RPC pending requests: %s" % self._dcc_app.pending_stats())
+        self.logger.info("RPC cached results: %s" % self._dcc_app.cache_stats())
+        path = self.dump_rpc_metrics()
+        if path:
+            self.logger.info("RPC metrics written to '%s'" % path)
+
+    def __register_rpc_metrics_command(self):
+        """
+        Registers a command to inspect the metrics of the calls made to
+        Harmony, so we can tell which operations artists wait for.
+        """
+        self.register_command(
+            "Show RPC Metrics",
+            self.__show_rpc_metrics,
+            {
+                "short_name": "rpc_metrics",
+                "description": "Logs how long the calls to Harmony took and dumps them as JSON.",
+                "type": "context_menu",
+            },
+        )
+
     def __register_reload_command(self):
         """
         Registers a "Reload and Restart" command with the engine if any
@@ -410,20 +496,39 @@ class HarmonyEngine(Engine):
         self.logger.debug("Initializing engine... %s", self)
 
         self.tk_harmony = self.import_module("tk_harmony")
+        self._log_buffer = self.tk_harmony.LogBuffer()
 
         self.init_qt_app()
 
         port = os.environ.get("SGTK_HARMONY_ENGINE_PORT")
         host = os.environ.get("SGTK_HARMONY_ENGINE_HOST", "127.0.0.1")
+        transport = os.environ.get("SGTK_HARMONY_ENGINE_TRANSPORT", "tcp")
+        socket_name = os.environ.get("SGTK_HARMONY_ENGINE_SOCKET_NAME")
+
+        # record the traffic with harmony so the session can be replayed
+        capture_path = os.environ.get("SGTK_HARMONY_ENGINE_CAPTURE_PATH")
 
         self.logger.debug("host: %s", host)
         self.logger.debug("port: %s", port)
+        self.logger.debug("transport: %s", transport)
+        self.logger.debug("socket name: %s", socket_name)
+        self.logger.debug("capture path: %s", capture_path)
 
         application_client_class = self.tk_harmony.application.Application
         self.logger.debug("  application_client_class: %s " % application_client_class)
 
         self._dcc_app = application_client_class(
-            self, parent=self._qt_app_central_widget, host=host, port=int(port)
+            self,
+            parent=self._qt_app_central_widget,
+            host=host,
+            port=int(port),
+            compression_threshold=self.get_setting("compression_threshold", 0),
+            transport=transport,
+            socket_name=socket_name,
+            capture_path=capture_path,
+            trace=LogManager().global_debug,
+            trace_limit=self.get_setting("trace_payload_limit", 256),
+            write_high_water=self.get_setting("write_high_water", 4194304),
         )
         self.logger.debug("  self._dcc_app: %s " % self._dcc_app)
 
@@ -516,6 +621,7 @@ class HarmonyEngine(Engine):
 
         # for some reason this engine command get's lost so we add it back
         self.__register_reload_command()
+        self.__register_rpc_metrics_command()
 
         # Run a series of app instance commands at startup.
         self._run_app_instance_commands()
@@ -526,29 +632,32 @@ class HarmonyEngine(Engine):
         # make sure we setup this engine as the current engine for the platform
         tank.platform.engine.set_current_engine(self)
 
-        # wait until we connected to the dcc app, we do it at this stage as
-        # harmony might have already finished loading.
+        # connect to the dcc app, we do it at this stage as harmony might
+        # have already finished loading. The engine carries on as soon as the
+        # connection is ready, meanwhile the qt loop keeps running.
         self.logger.debug("Connecting with dcc application...")
-        self._dcc_app.connect()
+        self._dcc_app.connection_ready.connect(self._on_dcc_app_connected)
+        self._dcc_app.connection_failed.connect(self._on_dcc_app_connection_failed)
+        self._dcc_app.connect_to_harmony(timeout=self.get_setting("startup_timeout", 300) * 1000)
+
+        # initalize qt loop
+        self._qt_app.exec_()
+
+    def _on_dcc_app_connected(self):
         self.logger.debug("    Connected.")
 
         # Let the app know we are ready for action!
         self._dcc_app.broadcast_event("ENGINE_READY")
-        # from sgtk.platform.qt5 import QtCore
-        # QtCore.QTimer.singleShot(5000, partial(self._dcc_app.broadcast_event, "ENGINE_READY"))
-
-        commands = self._dcc_app.send_and_receive_command("DIR")
-
-        if commands:
-            self.logger.debug("Commands: %s" % commands)
 
         # emit an engine started event
         self.sgtk.execute_core_hook(TANK_ENGINE_INIT_HOOK_NAME, engine=self)
 
         self.logger.debug("Engine ready.")
 
-        # initalize qt loop
-        self._qt_app.exec_()
+    def _on_dcc_app_connection_failed(self, message):
+        self.logger.error("Harmony did not start in time, quitting. %s" % message)
+        self.destroy_engine()
+        self._qt_app.quit()
 
     def post_context_change(self, old_context, new_context):
         """
@@ -564,6 +673,7 @@ class HarmonyEngine(Engine):
         # a context is changed
         self.__register_open_log_folder_command()
         self.__register_reload_command()
+        self.__register_rpc_metrics_command()
 
         if self.get_setting("automatic_context_switch", True):
             # finally create the menu with the new context if needed
@@ -651,6 +761,103 @@ class HarmonyEngine(Engine):
         """
         self.logger.debug("%s: Destroying...", self)
 
+        if self._project_event_timer:
+            self._project_event_timer.stop()
+
+        path = self.dump_rpc_metrics()
+        if path:
+            self.logger.debug("RPC metrics written to '%s'" % path)
+
+        if self._dcc_app:
+            self._dcc_app.flush_log()
+            path = self._dcc_app.stop_capture()
+            if path:
+                self.logger.debug("Traffic with Harmony captured to '%s'" % path)
+
+    def _get_context_cache(self):
+        """
+        Returns the cache of the contexts resolved, loading it from disk the
+        first time. None if it is disabled.
+        """
+        if self._context_cache is None:
+            capacity = self.get_setting("context_cache_size", 200)
+            if not capacity:
+                return None
+
+            path = os.path.join(self.cache_location, "context_cache.json")
+            self._context_cache = self.tk_harmony.ContextCache(capacity=capacity, path=path)
+            if self._context_cache.load():
+                self.logger.debug(
+                    "Loaded %s cached contexts from %s" % (len(self._context_cache), path)
+                )
+        return self._context_cache
+
+    def _get_context_files(self, tk):
+        """
+        Returns the files the contexts of the tk instance given are resolved
+        from, the cached ones are stale once any of them changes.
+        """
+        pipeline_configuration = tk.pipeline_configuration
+        config_location = pipeline_configuration.get_config_location()
+        files = [
+            os.path.join(config_location, "core", "templates.yml"),
+            os.path.join(config_location, "core", "roots.yml"),
+            # the path cache synced from shotgun lives next to our own cache
+            os.path.join(os.path.dirname(self.cache_location), "path_cache.db"),
+        ]
+        if hasattr(pipeline_configuration, "get_path_cache_location"):
+            files.append(pipeline_configuration.get_path_cache_location())
+        return files
+
+    def context_from_path(self, path, prev_context=None):
+        """
+        Returns the context of the path given, like `tk.context_from_path`
+        does, reusing the context resolved for other files in the same
+        folder as long as the configuration and the path cache did not
+        change since.
+        """
+        cache = self._get_context_cache()
+        if cache is None:
+            tk = tank.tank_from_path(path)
+            return tk.context_from_path(path, prev_context)
+
+        # the previous context is used to fill in the task when the path does
+        # not tell it
+        prev = None
+        if prev_context:
+            prev = [
+                [entity.get("type"), entity.get("id")] if entity else None
+                for entity in (prev_context.entity, prev_context.step, prev_context.task)
+            ]
+        key = self.tk_harmony.cache_key(path, prev)
+
+        st = time.time()
+        data = cache.get(key)
+        if data is not None:
+            try:
+                ctx = tank.Context.from_dict(self.sgtk, data)
+                self.logger.debug(
+                    "Context of %s cached, took %s secs: %s" % (path, time.time() - st, ctx)
+                )
+                return ctx
+            except tank.TankError as e:
+                self.logger.debug("Could not restore cached context of %s: %s" % (path, e))
+
+        tk = tank.tank_from_path(path)
+        ctx = tk.context_from_path(path, prev_context)
+        self.logger.debug("Context of %s resolved in %s secs: %s" % (path, time.time() - st, ctx))
+
+        # only the contexts of our own configuration can be restored without
+        # creating a new tk instance
+        if tk.pipeline_configuration.get_path() == self.sgtk.pipeline_configuration.get_path():
+            cache.put(key, ctx.to_dict(), self._get_context_files(tk))
+            try:
+                cache.save()
+            except (IOError, OSError) as e:
+                self.logger.debug("Could not save context cache to %s: %s" % (cache.path, e))
+
+        return ctx
+
     def _get_dialog_parent(self):
         """
         Get the QWidget parent for all dialogs created through
@@ -677,16 +884,10 @@ class HarmonyEngine(Engine):
         :param record: Standard python logging record.
         :type record: :class:`~python.logging.LogRecord`
         """
-        # Give a standard format to the message:
-        #     Shotgun <basename>: <message>
-        # where "basename" is the leaf part of the logging record name,
-        # for example "tk-multi-shotgunpanel" or "qt_importer".
         if record.levelno < logging.INFO:
-            formatter = logging.Formatter("Debug: Shotgun %(basename)s: %(message)s")
+            msg = DEBUG_LOG_FORMATTER.format(record)
         else:
-            formatter = logging.Formatter("Shotgun %(basename)s: %(message)s")
-
-        msg = formatter.format(record)
+            msg = LOG_FORMATTER.format(record)
 
         # Select Harmony display function to use according to the logging
         # record level.
@@ -699,8 +900,24 @@ class HarmonyEngine(Engine):
         else:
             fct = display_debug
 
-        # Display the message in Harmony script editor in a thread safe manner.
-        self.async_execute_in_main_thread(fct, msg)
+        # Display the message in a thread safe manner. Messages are gathered
+        # until the main thread gets to display them, all in one go, the
+        # first one in the buffer asks for them to be displayed.
+        if self._log_buffer is None:
+            self.async_execute_in_main_thread(fct, msg)
+        elif self._log_buffer.append(fct, msg) == 1:
+            self.async_execute_in_main_thread(self._flush_log_messages)
+
+    def _flush_log_messages(self):
+        """
+        Displays the log messages gathered by :meth:`_emit_log_message`.
+        """
+        messages, dropped = self._log_buffer.drain()
+        if dropped:
+            display_warning("%s log messages were dropped, too many to display." % dropped)
+
+        for fct, msg in messages:
+            fct(msg)
 
     def close_windows(self):
         """
@@ -752,7 +969,7 @@ class HarmonyEngine(Engine):
         path = kwargs.get("path")
         change_context = self.get_setting("change_context_on_new_project", False)
         if change_context:
-            refresh_engine(path, self.context)
+            self._queue_project_event(path)
         else:
             self.logger.info(
                 "change_context_on_new_project is off so context won't be changed."
@@ -760,7 +977,46 @@ class HarmonyEngine(Engine):
 
     def on_project_opened(self, **kwargs):
         path = kwargs.get("path")
-        refresh_engine(path, self.context)
+        self._queue_project_event(path)
+
+    def _queue_project_event(self, path):
+        """
+        Refreshes the engine for the path given once Harmony stops sending
+        project events for a little while. Only the last path of a burst of
+        events is refreshed.
+        """
+        from sgtk.platform.qt import QtCore
+
+        if self._project_event_timer is None:
+            self._project_event_timer = QtCore.QTimer()
+            self._project_event_timer.setSingleShot(True)
+            self._project_event_timer.timeout.connect(self._on_project_event)
+
+        if self._project_event is not None:
+            self.logger.debug(
+                "Coalescing project event for %s into %s" % (self._project_event, path)
+            )
+
+        self._project_event = path
+        delay = self.get_setting("project_event_delay", PROJECT_EVENT_DELAY)
+        self._project_event_timer.start(delay)
+
+    def _on_project_event(self):
+        path, self._project_event = self._project_event, None
+        if path is None:
+            return
+
+        # the same project again and nobody changed the context meanwhile
+        project = (os.path.abspath(path) if path else path, self.context)
+        if project == self._refreshed_project:
+            self.logger.debug("Project %s did not change, skipping refresh." % path)
+            return
+
+        # a failed refresh is tried again on the next event
+        if refresh_engine(path, self.context):
+            self._refreshed_project = (project[0], self.context)
+        else:
+            self._refreshed_project = None
 
     def on_app_quit(self, **kwargs):
         self.logger.info("Quitting app.")
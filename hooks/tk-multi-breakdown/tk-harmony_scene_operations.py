@@ -16,6 +16,19 @@ __author__ = "Diego Garcia Huerta"
 __contact__ = "https://www.linkedin.com/in/diegogh/"
 
 
+def future_result(future):
+    """
+    Returns the result of the request given, or None if Harmony did not
+    reply in time, so a slow scene is scanned as far as possible.
+    """
+    engine = sgtk.platform.current_engine()
+    try:
+        return future.result()
+    except engine.tk_harmony.RequestTimeoutError as e:
+        engine.log_warning(str(e))
+        return None
+
+
 class BreakdownSceneOperations(Hook):
     """
     Breakdown operations for Harmony.
@@ -54,9 +67,28 @@ class BreakdownSceneOperations(Hook):
 
         refs = []
 
-        read_nodes = dcc_app.get_nodes_of_type(["READ"]) or []
-        for read_node in read_nodes:
-            ref_path = dcc_app.get_node_metadata(read_node, attr_name)
+        # the whole scan takes two exchanges with Harmony no matter how many
+        # nodes there are, one to list them and one for all their metadata
+        with dcc_app.batch():
+            read_nodes_future = dcc_app.get_nodes_of_type_async(["READ"])
+            audio_columns_future = dcc_app.get_columns_of_type_async("SOUND")
+
+        read_nodes = future_result(read_nodes_future) or []
+        audio_columns = future_result(audio_columns_future) or []
+
+        with dcc_app.batch():
+            read_node_futures = [
+                (read_node, dcc_app.get_node_metadata_async(read_node, attr_name))
+                for read_node in read_nodes
+            ]
+            audio_column_futures = [
+                (audio_column, dcc_app.get_scene_metadata_async(audio_column + "." + attr_name))
+                for audio_column in audio_columns
+            ]
+        dcc_app.wait_for([future for _, future in read_node_futures + audio_column_futures])
+
+        for read_node, future in read_node_futures:
+            ref_path = future_result(future)
             if ref_path:
                 ref_path = sgtk.util.shotgun_path.ShotgunPath.from_current_os_path(ref_path)
 
@@ -71,11 +103,8 @@ class BreakdownSceneOperations(Hook):
 
         engine.log_debug("Found: %s" % refs)
 
-        audio_columns = dcc_app.get_columns_of_type("SOUND") or []
-        for audio_column in audio_columns:
-            audio_metadata_name = audio_column + "." + attr_name
-            ref_path = dcc_app.get_scene_metadata(audio_metadata_name)
-
+        for audio_column, future in audio_column_futures:
+            ref_path = future_result(future)
             if ref_path:
                 ref_path = sgtk.util.shotgun_path.ShotgunPath.from_current_os_path(ref_path)
 
@@ -1,2 +1,5 @@
-import application
+from . import application
+from .client import RequestTimeoutError
 from .menu_generation import MenuGenerator
+from .logbuffer import LogBuffer
+from .contextcache import ContextCache, cache_key
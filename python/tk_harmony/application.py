@@ -7,57 +7,251 @@ Module that encapsulates access to the actual application
 import os
 import glob
 import traceback
+from functools import wraps
 from itertools import chain
 
-from .client import QTcpSocketClient
-from .utils import copy_tree, normpath, Cached
+from sgtk.platform.qt import QtCore
+
+from .client import QTcpSocketClient, STARTUP_TIMEOUT
+from .logbuffer import LogBuffer
+from .memo import memoized, registry_of
+from .utils import copy_tree, normpath
 
 
 __author__ = "Diego Garcia Huerta"
 __contact__ = "https://www.linkedin.com/in/diegogh/"
 
 
+# opening or saving a big project can take minutes, these should not be
+# bound by the usual latency of the methods
+LONG_OPERATION_TIMEOUT = 10 * 60 * 1000
+
+# events Harmony pushes when the scene changes, see Application.subscribe
+SCENE_EVENTS = ("dirty", "saved", "project", "frame_range", "nodes", "columns")
+
+# log messages are sent to Harmony in batches, at most this often unless
+# the batch fills up or an error is logged. In milliseconds.
+LOG_FLUSH_INTERVAL = 100
+LOG_BATCH_SIZE = 200
+
+# seconds the cached state of the scene is trusted for. Harmony tells us
+# when it changes, see _on_scene_changed, this only covers missed events.
+SCENE_CACHE_TTL = 5
+
+# cached results invalidated by each scene event
+SCENE_EVENT_TAGS = {
+    "project": ("project", "frame_range"),
+    "saved": ("project",),
+    "frame_range": ("frame_range",),
+}
+
+
+def scene_cached(*tags):
+    """
+    Caches the results of a method that reads the state of the scene, see
+    :func:`memoized`. The first call subscribes to the scene events that
+    invalidate them, see :meth:`Application.invalidate`.
+    """
+
+    def decorator(method):
+        cached = memoized(ttl=SCENE_CACHE_TTL, tags=tags)(method)
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            self._watch_scene()
+            return cached(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 class Application(QTcpSocketClient):
-    def __init__(self, engine, parent=None, host=None, port=None):
-        super(Application, self).__init__(parent=parent, host=host, port=port)
+    def __init__(self, engine, parent=None, host=None, port=None, **kwargs):
+        super(Application, self).__init__(parent=parent, host=host, port=port, **kwargs)
         self.engine = engine
         self.engine.logger.debug("Started Application: %s" % self)
 
-    def connect(self):
-        while not self.is_connected():
-            self.connect_to_host()
-            self.engine.logger.debug("Waiting for server: %s" % self.connection_status())
+        self._subscribers = {}
+        self.register_callback("SCENE_EVENT", self._on_scene_event)
+        self.connection_ready.connect(self._resubscribe)
+
+        self._log_buffer = LogBuffer()
+        self._log_timer = QtCore.QTimer(self)
+        self._log_timer.setSingleShot(True)
+        self._log_timer.timeout.connect(self.flush_log)
+        self.connection_ready.connect(self.flush_log)
+
+        # whatever was cached might belong to a Harmony we are not talking
+        # to anymore
+        self._watching_scene = False
+        self.connection_ready.connect(self._forget_cache)
+
+    def connect_to_harmony(self, timeout=STARTUP_TIMEOUT):
+        """
+        Starts connecting to Harmony without blocking, see
+        :meth:`connect_async`. Listen to :attr:`connection_ready` to know
+        when it is done.
+
+        Note this is not named `connect`, PySide connects the signals of an
+        object through its `connect` method.
+        """
+        self.engine.logger.debug("Waiting for server: %s" % self.connection_status())
+        self.connect_async(timeout=timeout)
+
+    def close(self):
+        # whatever was logged last is often what explains why we are closing
+        self.flush_log()
+        super(Application, self).close()
+
+    def subscribe(self, event, callback):
+        """
+        Calls `callback(event, data)` every time the scene event given
+        happens in Harmony, instead of having to poll for it:
+
+        - dirty: {"dirty"} the scene became dirty or clean.
+        - saved: {"path"} the scene was saved.
+        - project: {"path"} a different project was opened.
+        - frame_range: {"start_frame", "stop_frame"} the frame range changed.
+        - nodes: {"added", "removed"} nodes were added or removed.
+        - columns: {"added", "removed"} columns were added or removed.
+        """
+        if event not in SCENE_EVENTS:
+            raise ValueError("Unknown scene event: %s" % event)
+
+        callbacks = self._subscribers.setdefault(event, [])
+        if callback in callbacks:
+            return
+
+        callbacks.append(callback)
+        if len(callbacks) == 1 and self.is_connected():
+            self.send_command("SUBSCRIBE", events=[event])
+
+    def unsubscribe(self, event, callback):
+        callbacks = self._subscribers.get(event, [])
+        if callback not in callbacks:
+            return
+
+        callbacks.remove(callback)
+        if not callbacks:
+            del self._subscribers[event]
+            if self.is_connected():
+                self.send_command("UNSUBSCRIBE", events=[event])
+
+    def _resubscribe(self):
+        # subscriptions made before connecting, or lost with the connection
+        if self._subscribers:
+            self.send_command("SUBSCRIBE", events=list(self._subscribers))
+
+    def _on_scene_event(self, event=None, data=None, **kwargs):
+        for callback in list(self._subscribers.get(event, [])):
+            try:
+                callback(event, data or {})
+            except Exception:
+                self.engine.logger.exception("Error in scene event callback: %s" % event)
+
+    def _watch_scene(self):
+        # nothing is cached until somebody asks, and nobody has to be told
+        # about changes to the scene until then either
+        if self._watching_scene:
+            return
+
+        self._watching_scene = True
+        for event in SCENE_EVENT_TAGS:
+            self.subscribe(event, self._on_scene_changed)
+
+    def _unwatch_scene(self):
+        if not self._watching_scene:
+            return
+
+        self._watching_scene = False
+        for event in SCENE_EVENT_TAGS:
+            self.unsubscribe(event, self._on_scene_changed)
+
+    def _on_scene_changed(self, event, data):
+        for tag in SCENE_EVENT_TAGS[event]:
+            self.invalidate(tag)
+
+    def _forget_cache(self):
+        # the subscriptions are sent again by _resubscribe, only the results
+        # are forgotten
+        registry_of(self).invalidate()
+
+    def invalidate(self, tag=None):
+        """
+        Forgets the cached results tagged with the tag given, i.e. "project"
+        or "frame_range", or all of them if no tag is given, in which case
+        the scene is not watched anymore until something is cached again.
+
+        :returns: Number of results forgotten.
+        """
+        if tag is None:
+            self._unwatch_scene()
+        return registry_of(self).invalidate(tag)
+
+    def cache_stats(self):
+        return registry_of(self).stats()
 
     def broadcast_event(self, event_name):
         self.send_command(event_name)
 
+    def _log(self, level, message, flush=False):
+        buffered = self._log_buffer.append(level, message)
+
+        if flush or buffered >= LOG_BATCH_SIZE:
+            self.flush_log()
+        elif not self._log_timer.isActive():
+            self._log_timer.start(LOG_FLUSH_INTERVAL)
+
+    def flush_log(self):
+        """
+        Sends the log messages buffered so far to Harmony in a single
+        LOG_BATCH command, together with how many were dropped because the
+        buffer overflowed. Messages are kept until connected.
+        """
+        self._log_timer.stop()
+        if not len(self._log_buffer) or not self.is_connected():
+            return
+
+        records, dropped = self._log_buffer.drain()
+        self.send_command("LOG_BATCH", records=records, dropped=dropped)
+
+    def log_stats(self):
+        return self._log_buffer.stats()
+
     def log_info(self, message):
-        self.send_command("LOG_INFO", message=message)
+        self._log("INFO", message)
 
     def log_warning(self, message):
-        self.send_command("LOG_WARNING", message=message)
+        self._log("WARNING", message)
 
     def log_debug(self, message):
-        self.send_command("LOG_DEBUG", message=message)
+        self._log("DEBUG", message)
 
     def log_error(self, message):
-        self.send_command("LOG_ERROR", message=message)
+        self._log("ERROR", message, flush=True)
 
     def log_exception(self, message):
-        self.send_command("LOG_EXCEPTION", message=message)
+        self._log("EXCEPTION", message, flush=True)
 
     def toggle_debug_logging(self, enabled):
+        self.trace.enabled = enabled
         self.send_command("TOGGLE_DEBUG_LOGGING", enabled=enabled)
 
+    @memoized(tags=("connection",))
+    def _get_application_version(self):
+        return self.send_and_receive_command("GET_VERSION")
+
     def get_application_version(self):
-        version = self.send_and_receive_command("GET_VERSION")
-        self._app_version = str(version)
+        self._app_version = str(self._get_application_version())
         return self._app_version
 
-    get_application_version = Cached(get_application_version)
+    @scene_cached("project")
+    def _get_current_project_path(self):
+        return self.send_and_receive_command("GET_CURRENT_PROJECT_PATH")
 
     def get_current_project_path(self):
-        current_path = self.send_and_receive_command("GET_CURRENT_PROJECT_PATH")
+        current_path = self._get_current_project_path()
         if current_path:
             current_path = normpath(str(current_path))
         else:
@@ -67,14 +261,19 @@ class Application(QTcpSocketClient):
 
     def open_project(self, path):
         path = normpath(path)
-        current_path = self.send_and_receive_command("OPEN_PROJECT", path=path)
+        self.invalidate("project")
+        self.invalidate("frame_range")
+        current_path = self.send_and_receive_command(
+            "OPEN_PROJECT", timeout=LONG_OPERATION_TIMEOUT, path=path
+        )
         if current_path:
             current_path = normpath(str(current_path))
 
         return current_path
 
     def save_project(self):
-        current_path = self.send_and_receive_command("SAVE_PROJECT")
+        self.invalidate("project")
+        current_path = self.send_and_receive_command("SAVE_PROJECT", timeout=LONG_OPERATION_TIMEOUT)
         if current_path:
             current_path = normpath(str(current_path))
 
@@ -85,14 +284,16 @@ class Application(QTcpSocketClient):
         return result
 
     def save_new_version(self, version_name):
+        self.invalidate("project")
         current_path = self.send_and_receive_command(
-            "SAVE_NEW_VERSION", version_name=version_name
+            "SAVE_NEW_VERSION", timeout=LONG_OPERATION_TIMEOUT, version_name=version_name
         )
         if current_path:
             current_path = normpath(str(current_path))
 
         return current_path
 
+    @scene_cached("project")
     def is_startup_project(self):
         result = self.send_and_receive_command("IS_STARTUP_PROJECT")
         return result
@@ -101,9 +302,32 @@ class Application(QTcpSocketClient):
         result = self.send_and_receive_command("EXECUTE_STATEMENT", statement=statement_str)
         return result
 
-    def extract_thumbnail(self, filename):
-        result = self.send_and_receive_command("EXTRACT_THUMBNAIL", path=filename)
-        return result
+    def extract_thumbnail(self, filename=None):
+        """
+        Grabs the current view in Harmony as a png image.
+
+        :param filename: Where to save the image. If not given, the image is
+            left in a temporary file.
+        :returns: The path to the image or None if it could not be grabbed.
+        """
+        payload = self.extract_thumbnail_data()
+        if payload is None:
+            return None
+
+        if not filename:
+            return payload.detach()
+
+        with payload:
+            payload.save(filename)
+        return filename
+
+    def extract_thumbnail_data(self):
+        """
+        Grabs the current view in Harmony as a png image, mapped in memory.
+
+        :returns: :class:`BulkPayload` or None if it could not be grabbed.
+        """
+        return self.send_and_receive_bulk("EXTRACT_THUMBNAIL")
 
     # file management
     def new_file(self, app, context):
@@ -193,7 +417,10 @@ class Application(QTcpSocketClient):
         return True
 
     def save_new_version_action(self):
-        result = self.send_and_receive_command("SAVE_NEW_VERSION_ACTION")
+        self.invalidate("project")
+        result = self.send_and_receive_command(
+            "SAVE_NEW_VERSION_ACTION", timeout=LONG_OPERATION_TIMEOUT
+        )
         return result
 
     def _copy_tree(self, *args, **kwargs):
@@ -274,37 +501,45 @@ class Application(QTcpSocketClient):
             self.open_project(target_file)
 
     # timeline
+    @scene_cached("frame_range")
     def get_start_frame(self):
         result = self.send_and_receive_command("GET_START_FRAME")
         return result
 
     def set_start_frame(self, start_frame):
+        self.invalidate("frame_range")
         result = self.send_and_receive_command("SET_START_FRAME", start_frame=start_frame)
         return result
 
+    @scene_cached("frame_range")
     def get_stop_frame(self):
         result = self.send_and_receive_command("GET_STOP_FRAME")
         return result
 
     def set_stop_frame(self, stop_frame):
+        self.invalidate("frame_range")
         result = self.send_and_receive_command("SET_STOP_FRAME", stop_frame=stop_frame)
         return result
 
+    @scene_cached("frame_range")
     def get_frame_range(self):
         result = self.send_and_receive_command("GET_FRAME_RANGE")
         return result
 
     def set_frame_range(self, start_frame, stop_frame):
+        self.invalidate("frame_range")
         result = self.send_and_receive_command(
             "SET_FRAME_RANGE", start_frame=start_frame, stop_frame=stop_frame
         )
         return result
 
+    @scene_cached("frame_range")
     def get_frame_count(self):
         result = self.send_and_receive_command("GET_FRAME_COUNT")
         return result
 
     def set_frame_count(self, frame_count):
+        self.invalidate("frame_range")
         result = self.send_and_receive_command("SET_FRAME_COUNT", frame_count=frame_count)
         return result
 
@@ -333,20 +568,32 @@ class Application(QTcpSocketClient):
         result = self.send_and_receive_command("GET_NODES_OF_TYPE", node_types=node_types)
         return result
 
+    def get_nodes_of_type_async(self, node_types):
+        return self.send_command_async("GET_NODES_OF_TYPE", node_types=node_types)
+
     def get_node_metadata(self, node, attr_name):
         result = self.send_and_receive_command(
             "GET_NODE_METADATA", node=node, attr_name=attr_name
         )
         return result
 
+    def get_node_metadata_async(self, node, attr_name):
+        return self.send_command_async("GET_NODE_METADATA", node=node, attr_name=attr_name)
+
     def get_scene_metadata(self, attr_name):
         result = self.send_and_receive_command("GET_SCENE_METADATA", attr_name=attr_name)
         return result
 
+    def get_scene_metadata_async(self, attr_name):
+        return self.send_command_async("GET_SCENE_METADATA", attr_name=attr_name)
+
     def get_columns_of_type(self, column_type):
         result = self.send_and_receive_command("GET_COLUMNS_OF_TYPE", column_type=column_type)
         return result
 
+    def get_columns_of_type_async(self, column_type):
+        return self.send_command_async("GET_COLUMNS_OF_TYPE", column_type=column_type)
+
     def get_sound_column_filenames(self, column_name):
         result = self.send_and_receive_command(
             "GET_SOUND_COLUMN_FILENAMES", column_name=column_name
@@ -0,0 +1,152 @@
+"""
+Module responsible for the payloads too big to travel through the socket.
+
+Harmony writes them to a file and replies with a handle to it instead:
+
+    {"bulk": {"path": "/tmp/xxx.png", "size": 1234, "format": "png"}}
+
+The file is then mapped in memory, so the data is never escaped into a
+message nor copied around through the socket.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import os
+import mmap
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+BULK_KEY = "bulk"
+
+
+class BulkError(IOError):
+    pass
+
+
+def is_bulk_handle(value):
+    return isinstance(value, dict) and isinstance(value.get(BULK_KEY), dict)
+
+
+def open_bulk(handle):
+    """
+    Maps the payload the handle given points to.
+
+    :returns: :class:`BulkPayload`
+    :raises BulkError: If the handle is not valid or the file is not there.
+    """
+    if not is_bulk_handle(handle):
+        raise BulkError("Not a bulk payload handle: %s" % handle)
+
+    info = handle[BULK_KEY]
+    path = info.get("path")
+    size = info.get("size")
+
+    if not path or not os.path.isfile(path):
+        raise BulkError("Bulk payload file does not exist: %s" % path)
+
+    if size is None or os.path.getsize(path) < size:
+        raise BulkError("Bulk payload file is incomplete: %s" % path)
+
+    return BulkPayload(path, size, info.get("format"))
+
+
+class BulkPayload(object):
+    """
+    Payload written by Harmony to a file, mapped read only in memory.
+
+    The payload owns the file and removes it when closed unless it is
+    detached. Use it as a context manager::
+
+        with open_bulk(handle) as payload:
+            image = QtGui.QImage.fromData(payload.tobytes())
+
+    Views obtained from :attr:`view` are only valid until the payload is
+    closed.
+    """
+
+    def __init__(self, path, size, format=None):
+        self.path = path
+        self.size = size
+        self.format = format
+
+        self._file = open(path, "rb")
+        self._map = None
+        self._view = None
+
+        # empty files cannot be mapped
+        if size:
+            self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                self._view = memoryview(self._map)
+            except TypeError:
+                # python 2 mmap objects do not support memoryviews
+                self._view = memoryview(self._map[:])
+        else:
+            self._view = memoryview(b"")
+
+    def __repr__(self):
+        return "<BulkPayload %s %s bytes %s>" % (self.path, self.size, self.format)
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    @property
+    def view(self):
+        if self.closed:
+            raise BulkError("Bulk payload already closed: %s" % self.path)
+        return self._view
+
+    def tobytes(self):
+        return self.view.tobytes()
+
+    def save(self, path):
+        """
+        Writes the payload to the path given.
+        """
+        with open(path, "wb") as f:
+            f.write(self.view)
+
+    def detach(self):
+        """
+        Closes the payload leaving the file on disk, which the caller owns
+        from now on.
+
+        :returns: The path to the file.
+        """
+        self.close(remove=False)
+        return self.path
+
+    def close(self, remove=True):
+        if self.closed:
+            return
+
+        # the map cannot be closed while views of it are alive
+        if hasattr(self._view, "release"):
+            self._view.release()
+        self._view = None
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+        self._file.close()
+        self._file = None
+
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
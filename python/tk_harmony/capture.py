@@ -0,0 +1,360 @@
+"""
+Module responsible for recording the traffic between the engine and Harmony
+and for playing it back later, without Harmony.
+
+A capture keeps every frame sent or received through the socket, as it
+travelled, together with the time it did and its direction:
+
+    header: "TKHC", version (uint8), time the capture started (double)
+    record: seconds since the start (double), direction (uint8),
+            size of the payload (uint32), payload
+
+The :class:`Replayer` plays the frames the engine sent against a stand-in
+server, keeping the original timing or as fast as possible, and measures
+the latency of the replies so they can be compared with the ones of the
+original session.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import time
+import zlib
+import struct
+import socket
+import logging
+import threading
+from collections import namedtuple
+
+try:
+    from .codec import JSON_CODEC, CodecError
+    from .compression import Compression
+    from .framing import FrameDecoder, pack_frame
+    from .metrics import MetricsRegistry
+except (ImportError, ValueError):
+    # run from the benchmarks
+    from codec import JSON_CODEC, CodecError
+    from compression import Compression
+    from framing import FrameDecoder, pack_frame
+    from metrics import MetricsRegistry
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"TKHC"
+VERSION = 1
+
+SENT = 0
+RECEIVED = 1
+
+_HEADER = struct.Struct(">4sBd")
+_RECORD = struct.Struct(">dBI")
+
+CaptureRecord = namedtuple("CaptureRecord", "time direction payload")
+
+
+class CaptureError(IOError):
+    pass
+
+
+class CaptureWriter(object):
+    """
+    Appends the frames given to a capture file. Writes are buffered, the
+    file is only complete once the writer is closed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.time()
+        self.frames = 0
+        self.bytes = 0
+
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(MAGIC, VERSION, self.started))
+
+    def __repr__(self):
+        return "<CaptureWriter %s %s frames>" % (self.path, self.frames)
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def record(self, direction, payload):
+        if self._file is None:
+            return
+
+        self._file.write(_RECORD.pack(time.time() - self.started, direction, len(payload)))
+        self._file.write(payload)
+        self.frames += 1
+        self.bytes += len(payload)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CaptureReader(object):
+    """
+    Iterates over the records of a capture file. A capture that was cut
+    short, because the session crashed, is read up to its last complete
+    record.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self._data = f.read()
+
+        if len(self._data) < _HEADER.size:
+            raise CaptureError("Not a capture file: %s" % path)
+
+        magic, version, self.started = _HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            raise CaptureError("Not a capture file: %s" % path)
+        if version != VERSION:
+            raise CaptureError("Unsupported capture version %s: %s" % (version, path))
+
+    def __iter__(self):
+        data = self._data
+        offset = _HEADER.size
+        while offset + _RECORD.size <= len(data):
+            elapsed, direction, size = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            if offset + size > len(data):
+                logger.warning("Capture truncated: %s", self.path)
+                return
+            yield CaptureRecord(elapsed, direction, data[offset : offset + size])
+            offset += size
+
+
+def _decode(payload, compression):
+    data = compression.decompress(payload)
+    message = JSON_CODEC.decode(data)
+    return message if isinstance(message, list) else [message]
+
+
+def _expects_reply(command):
+    return command.get("method") is not None and command.get("request_return") is True
+
+
+class _Frame(object):
+    """
+    Frame the engine sent in the original session, with the requests in it
+    that expect a reply.
+    """
+
+    def __init__(self, time, payload, requests):
+        self.time = time
+        self.payload = payload
+        self.requests = requests
+
+        # id of the last reply that arrived before the engine sent it
+        self.after = None
+
+
+class Replayer(object):
+    """
+    Plays the frames the engine sent in a capture against a server.
+
+    Frames are sent verbatim, negotiation included, so the server needs to
+    support the compression of the original session. A frame is not sent
+    before the replies that arrived before it in the original session have
+    arrived again, as the engine would have been waiting for them. The
+    requests the server makes are answered with the result the engine gave
+    to the same method in the original session.
+
+    :param path: Capture file.
+    :param timing: If True keeps the original time between frames, otherwise
+        frames are sent as soon as the replies they depend on arrive.
+    :param speed: Speeds up (or slows down) the original timing.
+    :param timeout: Milliseconds to wait for each reply.
+    """
+
+    def __init__(self, path, timing=True, speed=1.0, timeout=10000):
+        self.path = path
+        self.timing = timing
+        self.speed = speed
+        self.timeout = timeout
+
+        self.original = MetricsRegistry()
+        self.metrics = MetricsRegistry()
+        self.frames = []
+        self.answers = {}
+        self.missing = 0
+
+        self._pending = {}
+        self._replied = set()
+        self._pending_changed = threading.Condition()
+        self._socket = None
+        self._write_lock = threading.Lock()
+        self._compression = Compression(threshold=0)
+
+        self._load(CaptureReader(path))
+
+    def _load(self, reader):
+        compression = Compression(threshold=0)
+        sent = {}
+        asked = {}
+        last_reply = None
+
+        for record in reader:
+            try:
+                commands = _decode(record.payload, compression)
+            except (CodecError, zlib.error) as e:
+                logger.warning("Skipping frame, not well formed. %s", e)
+                continue
+            commands = [command for command in commands if isinstance(command, dict)]
+
+            if record.direction == SENT:
+                for command in commands:
+                    if command.get("method") is None and command.get("id") in asked:
+                        method = asked.pop(command["id"])
+                        self.answers[method] = command.get("result")
+
+                requests = {}
+                for command in commands:
+                    if _expects_reply(command):
+                        requests[command["id"]] = command["method"]
+                        sent[command["id"]] = (command["method"], record.time)
+
+                # replies to the requests of harmony are made up on replay
+                if not any(command.get("method") is not None for command in commands):
+                    continue
+
+                frame = _Frame(record.time, record.payload, requests)
+                frame.after = last_reply
+                self.frames.append(frame)
+
+            else:
+                for command in commands:
+                    if _expects_reply(command):
+                        asked[command.get("id")] = command["method"]
+                    elif command.get("id") in sent:
+                        method, sent_at = sent.pop(command["id"])
+                        self.original.record_call(method)
+                        self.original.record_latency(method, (record.time - sent_at) * 1000)
+                        if command.get("error") is not None:
+                            self.original.record_error(method)
+                        last_reply = command["id"]
+
+        # requests never replied to in the original session
+        for method, _ in sent.values():
+            self.original.record_call(method)
+            self.original.record_timeout(method)
+
+    def run(self, sock):
+        """
+        Replays the capture through the connected socket given.
+
+        :returns: Dictionary with the metrics of the original session and the
+            ones of the replay.
+        """
+        self._socket = sock
+        receiver = threading.Thread(target=self._receive, name="Replayer")
+        receiver.daemon = True
+        receiver.start()
+
+        st = time.time()
+        first = self.frames[0].time if self.frames else 0
+        for frame in self.frames:
+            if frame.after is not None and frame.after not in self._replied:
+                if not self._wait_for(lambda: frame.after in self._replied):
+                    # do not wait for it again, it is counted as a timeout
+                    self._replied.add(frame.after)
+
+            if self.timing:
+                delay = st + (frame.time - first) / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            with self._pending_changed:
+                for request_id, method in frame.requests.items():
+                    self.metrics.record_call(method)
+                    self._pending[request_id] = (method, time.time())
+            self._write(frame.payload)
+
+        self._wait_for(lambda: not self._pending)
+        elapsed = time.time() - st
+
+        with self._pending_changed:
+            for method, _ in self._pending.values():
+                self.metrics.record_timeout(method)
+            self.missing = len(self._pending)
+            self._pending = {}
+
+        return {
+            "capture": self.path,
+            "frames": len(self.frames),
+            "timing": self.timing,
+            "speed": self.speed,
+            "elapsed": elapsed,
+            "missing_replies": self.missing,
+            "original": self.original.to_dict(),
+            "replay": self.metrics.to_dict(),
+        }
+
+    def _wait_for(self, condition):
+        deadline = time.time() + self.timeout / 1000.0
+        with self._pending_changed:
+            while not condition():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._pending_changed.wait(remaining)
+        return True
+
+    def _write(self, payload):
+        with self._write_lock:
+            self._socket.sendall(pack_frame(payload))
+
+    def _receive(self):
+        decoder = FrameDecoder()
+        while True:
+            try:
+                data = self._socket.recv(1024 * 1024)
+            except socket.error:
+                break
+            if not data:
+                break
+
+            decoder.feed(data)
+            for payload in decoder.frames():
+                try:
+                    commands = _decode(payload, self._compression)
+                except (CodecError, zlib.error) as e:
+                    logger.warning("Ignoring reply, not well formed. %s", e)
+                    continue
+
+                for command in commands:
+                    if isinstance(command, dict):
+                        self._process_command(command)
+
+        with self._pending_changed:
+            self._pending_changed.notify_all()
+
+    def _process_command(self, command):
+        request_id = command.get("id")
+
+        if _expects_reply(command):
+            result = self.answers.get(command["method"], True)
+            reply = {"jsonrpc": "2.0", "result": result, "request_return": False, "id": request_id}
+            self._write(JSON_CODEC.encode(reply))
+            return
+
+        with self._pending_changed:
+            pending = self._pending.pop(request_id, None)
+            if pending is None:
+                return
+
+            method, sent_at = pending
+            self.metrics.record_latency(method, (time.time() - sent_at) * 1000)
+            if command.get("error") is not None:
+                self.metrics.record_error(method)
+            self._replied.add(request_id)
+            self._pending_changed.notify_all()
@@ -29,36 +29,267 @@ from sgtk.platform.qt import QtGui, QtCore, QtNetwork
 
 import sys
 import time
-import json
 import uuid
+import zlib
 
 import logging
+from collections import deque
 from datetime import datetime
-
-
+from contextlib import contextmanager
+
+from .bulk import BulkError, open_bulk
+from .capture import RECEIVED, SENT, CaptureWriter
+from .codec import JSON_CODEC, CodecError
+from .compression import ZLIB, Compression, DEFAULT_THRESHOLD
+from .framing import FrameDecoder, pack_frame
+from .metrics import MetricsRegistry
+from .pending import DEFAULT_CAPACITY, PendingTable
+from .priority import METHOD_PRIORITIES, NORMAL, PRIORITIES, by_priority
+from .timeouts import AdaptiveTimeout
+from .trace import DEFAULT_LIMIT, Tracer
+
+
+# default time to wait for a reply, until the usual latency of a method is
+# known. See :class:`AdaptiveTimeout`.
 MAX_READ_RESPONSE_TIME = 10000
 MAX_WRITE_RESPONSE_TIME = 10000
-INT32_SIZE = 4
+
+# frames sent are queued and written together once per event loop turn. Once
+# this many bytes are waiting to be written, sending blocks until the socket
+# catches up.
+WRITE_HIGH_WATER = 4 * 1024 * 1024
+
+# callbacks Harmony blocks on until they reply, they run even while we are
+# waiting for a reply ourselves, see wait_for
+WAITING_CALLBACKS = ("PING",)
+
+CANCELLED_ERROR = "Request cancelled."
+EXPIRED_ERROR = "Request timed out."
+EVICTED_ERROR = "Too many requests waiting for a reply."
+
+# time given to Harmony to start listening for connections, the delay
+# between attempts doubles up to the maximum. All in milliseconds.
+STARTUP_TIMEOUT = 5 * 60 * 1000
+CONNECT_ATTEMPT_TIMEOUT = 1500
+CONNECT_INITIAL_DELAY = 50
+CONNECT_MAX_DELAY = 2000
+
+# Harmony listens either on a TCP port or on a local socket, which is a unix
+# domain socket or a named pipe depending on the platform.
+TCP_TRANSPORT = "tcp"
+LOCAL_TRANSPORT = "local"
+
+# metrics name for the traffic we cannot tell the method of
+UNKNOWN_METHOD = "<unknown>"
+
+
+class RequestTimeoutError(IOError):
+    """
+    Raised when the reply to a request does not arrive in time.
+    """
+
+
+class RequestFuture(object):
+    """
+    Handle to the reply of a request sent to Harmony.
+
+    Futures are resolved by the client as the replies arrive, so many
+    requests can be in flight on the same socket and waited on at once.
+    """
+
+    def __init__(self, client, request_id, method):
+        self._client = client
+        self.request_id = request_id
+        self.method = method
+        self.sent_at = time.time()
+
+        self._done = False
+        self._cancelled = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def __repr__(self):
+        return "<RequestFuture %s %s done=%s>" % (self.method, self.request_id, self._done)
+
+    def done(self):
+        return self._done
+
+    def error(self):
+        return self._error
+
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        """
+        Stops waiting for the reply of the request, which will be ignored if
+        it ever arrives. Harmony is not told about it, a request that is
+        running there already will finish anyway.
+
+        :returns: False if the request was already resolved.
+        """
+        if self._done:
+            return False
+
+        self._client._forget(self)
+        self._cancelled = True
+        self.set_error(CANCELLED_ERROR)
+        return True
+
+    def set_result(self, result):
+        self._result = result
+        self._resolve()
+
+    def set_error(self, error):
+        self._error = error
+        self._resolve()
+
+    def _resolve(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def result(self, timeout=None):
+        """
+        Returns the result of the request, waiting for it at most `timeout`
+        milliseconds, see :meth:`QTcpSocketClient.wait_for` for the default.
+        Returns None if Harmony reported an error. A request that expired
+        already fails straight away, it is not waited for again.
+
+        :raises RequestTimeoutError: If the reply did not arrive in time.
+        """
+        if not self._done:
+            self._client.wait_for([self], timeout=timeout)
+
+        if not self._done or self._error == EXPIRED_ERROR:
+            raise RequestTimeoutError(
+                "Did not receive a reply for %s in %d ms"
+                % (self.method, (time.time() - self.sent_at) * 1000)
+            )
+
+        if self._cancelled:
+            self._client.trace("Request cancelled: %s", self.method)
+        elif self._error is not None:
+            logger.error("Error occurred when requesting %s. %s" % (self.method, self._error))
+
+        return self._result
 
 
 class QTcpSocketClient(QtCore.QObject):
-    def __init__(self, parent=None, host=None, port=None):
+    # emitted when :meth:`connect_async` succeeds or gives up
+    connection_ready = QtCore.Signal()
+    connection_failed = QtCore.Signal(str)
+
+    def __init__(
+        self,
+        parent=None,
+        host=None,
+        port=None,
+        compression_threshold=DEFAULT_THRESHOLD,
+        transport=TCP_TRANSPORT,
+        socket_name=None,
+        capture_path=None,
+        trace=False,
+        trace_limit=DEFAULT_LIMIT,
+        write_high_water=WRITE_HIGH_WATER,
+        max_pending=DEFAULT_CAPACITY,
+    ):
         super(QTcpSocketClient, self).__init__()
 
         self._parent = parent
         self._host = host
         self._port = port
-        self._block_size = 0
+        self._socket_name = socket_name
+        self._decoder = FrameDecoder()
+
+        # debug messages of every request and reply, only formatted when
+        # tracing is enabled
+        self.trace = Tracer(logger, limit=trace_limit, enabled=trace)
+
+        # payloads bigger than the threshold are compressed if Harmony
+        # supports it, 0 disables compression altogether.
+        self._compression = Compression(threshold=compression_threshold)
 
         self._callbacks = {}
-        self.responses = {}
-        self.awaiting_response = []
+        self._priorities = dict(METHOD_PRIORITIES)
+        self._pending = PendingTable(capacity=max_pending)
+        self._timeouts = AdaptiveTimeout(default=MAX_READ_RESPONSE_TIME)
+        self.metrics = MetricsRegistry()
+        self._batch = None
+        self._batch_depth = 0
+
+        # every frame sent and received is recorded while capturing, see
+        # :mod:`capture`
+        self._capture = None
+        if capture_path:
+            self.start_capture(capture_path)
+
+        # Harmony falls back to TCP if it cannot listen on the local socket,
+        # so we try both until one of them answers.
+        self._transports = [TCP_TRANSPORT]
+        if transport == LOCAL_TRANSPORT and socket_name:
+            self._transports.insert(0, LOCAL_TRANSPORT)
+
+        self._sockets = {}
+        for name in self._transports:
+            if name == LOCAL_TRANSPORT:
+                socket = QtNetwork.QLocalSocket(self)
+            else:
+                socket = QtNetwork.QTcpSocket(self)
+            socket.connected.connect(self._on_connected)
+            socket.readyRead.connect(self._on_ready_read)
+            socket.error.connect(self._on_error)
+            socket.bytesWritten.connect(self._on_bytes_written)
+            socket.stateChanged.connect(self._on_state_changed)
+            self._sockets[name] = socket
+
+        self.transport = None
+        self.connection = None
+        self._use_transport(self._transports[0])
 
-        self.connection = QtNetwork.QTcpSocket(self)
-        self.connection.connected.connect(self._on_connected)
         self._buffer = None
         self._receiving = False
 
+        # frames waiting to be written, see _send
+        self._write_queue = []
+        self._write_queue_bytes = 0
+        self._write_high_water = write_high_water
+        self._write_stats = {
+            "frames": 0,
+            "writes": 0,
+            "max_queue_frames": 0,
+            "max_queue_bytes": 0,
+            "backpressure_waits": 0,
+        }
+        self._write_timer = QtCore.QTimer(self)
+        self._write_timer.setSingleShot(True)
+        self._write_timer.timeout.connect(self._flush_writes)
+
+        # requests from Harmony waiting for their callback to run, by method.
+        # Callbacks run from the event loop, never while reading the socket,
+        # and only one at a time per method so they run in the order sent.
+        self._dispatch_queues = {}
+        self._dispatching = set()
+        self._dispatch_timer = QtCore.QTimer(self)
+        self._dispatch_timer.setSingleShot(True)
+        self._dispatch_timer.timeout.connect(self._dispatch_callbacks)
+
+        # state of the non blocking connector, see connect_async
+        self._connecting = False
+        self._connect_deadline = None
+        self._connect_delay = CONNECT_INITIAL_DELAY
+        self._connect_timer = QtCore.QTimer(self)
+        self._connect_timer.setSingleShot(True)
+        self._connect_timer.timeout.connect(self._on_connect_timer)
+
     def host(self):
         return self._host
 
@@ -68,11 +299,36 @@ class QTcpSocketClient(QtCore.QObject):
     def connection_status(self):
         return self.connection.state()
 
+    def _socket_state(self, name):
+        if self.transport == LOCAL_TRANSPORT:
+            return getattr(QtNetwork.QLocalSocket, name)
+        return getattr(QtNetwork.QAbstractSocket, name)
+
     def is_connected(self):
         return self.connection and (
-            self.connection_status() == QtNetwork.QAbstractSocket.ConnectedState
+            self.connection_status() == self._socket_state("ConnectedState")
         )
 
+    def _is_unconnected(self):
+        return self.connection_status() == self._socket_state("UnconnectedState")
+
+    def _use_transport(self, transport):
+        if self.connection is not None and transport != self.transport:
+            self.connection.abort()
+
+        self.transport = transport
+        self.connection = self._sockets[transport]
+
+    def _next_transport(self):
+        index = self._transports.index(self.transport)
+        self._use_transport(self._transports[(index + 1) % len(self._transports)])
+
+    def _open_connection(self):
+        if self.transport == LOCAL_TRANSPORT:
+            self.connection.connectToServer(self._socket_name)
+        else:
+            self.connection.connectToHost(self._host, self._port)
+
     def connect_to_host(self, host=None, port=None):
         if not host:
             host = self._host
@@ -91,8 +347,14 @@ class QTcpSocketClient(QtCore.QObject):
             )
             self.connection.abort()
 
+        # whatever was left from a previous connection is meaningless now
+        self._decoder.reset()
+        self._clear_writes()
+        self._dispatch_queues.clear()
+        self.cancel_all()
+
         st2 = time.time()
-        self.connection.connectToHost(host, port)
+        self._open_connection()
 
         if not self.connection.waitForConnected(1500):
             et2 = time.time()
@@ -105,193 +367,695 @@ class QTcpSocketClient(QtCore.QObject):
         result = self.connection_status()
         logger.debug("Server status: %s", result)
 
-        commands = self.send_and_receive_command("DIR")
-        logger.debug("commands: %s" % commands)
+        self._negotiate()
 
         return result
 
+    def connect_async(self, host=None, port=None, timeout=STARTUP_TIMEOUT):
+        """
+        Connects to Harmony without blocking the Qt event loop.
+
+        Harmony might still be loading, so connection attempts are retried
+        with an exponential backoff until `timeout` milliseconds have
+        passed. :attr:`connection_ready` is emitted once connected and the
+        compression has been negotiated, :attr:`connection_failed` if Harmony
+        did not come up in time.
+        """
+        self._host = host or self._host
+        self._port = port or self._port
+
+        if self.is_connected():
+            self.connection_ready.emit()
+            return
+
+        logger.debug("Connecting to Server... %s %s " % (self._host, self._port))
+        self._connecting = True
+        self._connect_deadline = time.time() + timeout / 1000.0
+        self._connect_delay = CONNECT_INITIAL_DELAY
+        self._attempt_connection()
+
+    def _attempt_connection(self):
+        # whatever was left from a previous connection is meaningless now
+        self.connection.abort()
+        self._decoder.reset()
+        self._clear_writes()
+        self._dispatch_queues.clear()
+        self.cancel_all()
+
+        self._open_connection()
+
+        # give up on this attempt if we do not hear back in time
+        self._connect_timer.start(CONNECT_ATTEMPT_TIMEOUT)
+
+    def _retry_connection(self):
+        remaining = int((self._connect_deadline - time.time()) * 1000)
+        if remaining <= 0:
+            self._connecting = False
+            self.connection.abort()
+            message = "Could not connect to %s:%s" % (self._host, self._port)
+            if LOCAL_TRANSPORT in self._transports:
+                message += " or %s" % self._socket_name
+            logger.error(message)
+            self.connection_failed.emit(message)
+            return
+
+        # Harmony might be listening on the other transport
+        self._next_transport()
+
+        logger.debug(
+            "Waiting for server: %s | retrying in %s ms"
+            % (self.connection_status(), self._connect_delay)
+        )
+        self._connect_timer.start(min(self._connect_delay, remaining))
+        self._connect_delay = min(self._connect_delay * 2, CONNECT_MAX_DELAY)
+
+    def _on_connect_timer(self):
+        if not self._connecting:
+            return
+
+        # an attempt still going on timed out, otherwise the backoff delay
+        # after a failed attempt is over
+        if not self._is_unconnected():
+            self.connection.abort()
+            self._retry_connection()
+        else:
+            self._attempt_connection()
+
+    def _negotiate(self):
+        """
+        Agrees with Harmony on whether big messages are compressed from now
+        on. Compression is agreed for each direction, Harmony tells us whether it
+        will compress the messages it sends and whether it can decompress
+        the ones we send.
+        """
+        self._compression.enabled = False
+
+        compression = [ZLIB] if self._compression.threshold else []
+        reply = self.send_and_receive_command(
+            "NEGOTIATE",
+            compression=compression,
+            compression_threshold=self._compression.threshold,
+        )
+        if isinstance(reply, dict):
+            compression = reply.get("compression") or {}
+            self._compression.enabled = compression.get("receive") == ZLIB
+
+        logger.debug("Negotiated compression: %s" % self._compression.stats())
+
+    def compression_stats(self):
+        return self._compression.stats()
+
+    def start_capture(self, path):
+        """
+        Starts recording every frame sent and received to the file given, so
+        the session can be replayed later without Harmony.
+        """
+        self.stop_capture()
+        try:
+            self._capture = CaptureWriter(path)
+        except (IOError, OSError) as e:
+            logger.error("Could not start capturing to %s: %s" % (path, e))
+            return
+        logger.debug("Capturing traffic to %s" % path)
+
+    def stop_capture(self):
+        """
+        Stops recording the frames and closes the capture file.
+
+        :returns: The path to the capture file, or None if not capturing.
+        """
+        if self._capture is None:
+            return None
+
+        capture, self._capture = self._capture, None
+        capture.close()
+        logger.debug("Captured %s frames to %s" % (capture.frames, capture.path))
+        return capture.path
+
+    def timeout_for(self, method):
+        """
+        Returns the milliseconds to wait for the reply to the method given
+        when the caller does not ask for a specific timeout.
+        """
+        return self._timeouts.timeout_for(method)
+
+    def timeout_stats(self):
+        return self._timeouts.stats()
+
     def _on_readyRead(self):
         logger.warning("Ready to read")
 
-    def _on_error(self):
+    def _on_error(self, socket_error=None):
         logger.debug("Error occurred: %s" % self.connection.errorString())
 
+        # the server is not up yet, wait a bit before trying again
+        if self._connecting:
+            self._connect_timer.stop()
+            self.connection.abort()
+            self._retry_connection()
+
     def _on_bytes_written(self, bytes):
-        logger.debug("Bytes written: %s" % bytes)
+        self.trace("Bytes written: %s", bytes)
 
     def _on_state_changed(self, state):
-        logger.debug("stateChanged: %s" % state)
+        self.trace("stateChanged: %s", state)
 
     def _on_connected(self):
         logger.debug("On connected to server called.")
         logger.debug("Connection: %s" % self.connection)
 
-        logger.debug("Setting up callbacks...")
-        self.connection.setSocketOption(self.connection.LowDelayOption, 1)
-        self.connection.setSocketOption(self.connection.KeepAliveOption, 1)
-
-        self.connection.readyRead.connect(self._on_ready_read)
-        self.connection.error.connect(self._on_error)
-        self.connection.bytesWritten.connect(self._on_bytes_written)
-        self.connection.stateChanged.connect(self._on_state_changed)
+        logger.debug("Setting up callbacks... | transport: %s" % self.transport)
+        if self.transport == TCP_TRANSPORT:
+            self.connection.setSocketOption(self.connection.LowDelayOption, 1)
+            self.connection.setSocketOption(self.connection.KeepAliveOption, 1)
 
         logger.debug("Setting up callbacks... Done.")
 
-    def _send(self, request):
+        if self._connecting:
+            self._connecting = False
+            self._connect_timer.stop()
+            self._negotiate()
+            self.connection_ready.emit()
+
+    def _send(self, message, method=None):
         # make sure we are connected
-        if self.connection.state() in (
-            QtNetwork.QAbstractSocket.SocketState.UnconnectedState,
-        ):
+        if self._is_unconnected():
             self.connect_to_host()
 
-        block = QtCore.QByteArray()
-
-        outstr = QtCore.QDataStream(block, QtCore.QIODevice.WriteOnly)
-        outstr.setVersion(QtCore.QDataStream.Qt_4_6)
-
-        outstr.writeString(str(request))
-
-        self.connection.write(block)
-
-        if not self.connection.waitForBytesWritten(MAX_WRITE_RESPONSE_TIME):
-            logger.error("Could not write to socket: %s" % self.connection.errorString())
-        else:
-            logger.debug("Sent data ok. %s" % self.connection.state())
+        payload = self._compression.compress(JSON_CODEC.encode(message))
+        self._record_traffic(self.metrics.record_sent, message, len(payload), method)
+        if self._capture is not None:
+            self._capture.record(SENT, payload)
+
+        frame = pack_frame(payload)
+        self._write_queue.append(frame)
+        self._write_queue_bytes += len(frame)
+
+        stats = self._write_stats
+        stats["frames"] += 1
+        stats["max_queue_frames"] = max(stats["max_queue_frames"], len(self._write_queue))
+        stats["max_queue_bytes"] = max(stats["max_queue_bytes"], self._write_queue_bytes)
+
+        # harmony is not keeping up, wait for it instead of piling up data
+        if self.write_queue_depth() >= self._write_high_water:
+            stats["backpressure_waits"] += 1
+            self._flush_writes(wait=True)
+        elif not self._write_timer.isActive():
+            self._write_timer.start(0)
+
+    def _flush_writes(self, wait=False):
+        """
+        Writes all the frames queued in a single block. If `wait` is True,
+        blocks until the socket is below half the high-water mark.
+        """
+        self._write_timer.stop()
+
+        if self._write_queue:
+            frames, self._write_queue = self._write_queue, []
+            self._write_queue_bytes = 0
+            self._write_stats["writes"] += 1
+
+            self.connection.write(QtCore.QByteArray(b"".join(frames)))
+            self.connection.flush()
+            self.trace("Wrote %s frames. %s", len(frames), self.connection.state())
+
+        while wait and self.connection.bytesToWrite() >= self._write_high_water // 2:
+            if not self.connection.waitForBytesWritten(MAX_WRITE_RESPONSE_TIME):
+                logger.error("Could not write to socket: %s" % self.connection.errorString())
+                break
+
+    def _clear_writes(self):
+        # frames meant for a connection that is gone
+        self._write_timer.stop()
+        self._write_queue = []
+        self._write_queue_bytes = 0
+
+    def write_queue_depth(self):
+        """
+        Returns the bytes sent that are not written to the socket yet.
+        """
+        return self._write_queue_bytes + self.connection.bytesToWrite()
+
+    def write_queue_stats(self):
+        stats = dict(self._write_stats)
+        stats["queue_frames"] = len(self._write_queue)
+        stats["queue_bytes"] = self.write_queue_depth()
+        stats["high_water"] = self._write_high_water
+        return stats
 
     def _on_ready_read(self):
         if not self._receiving:
             self._receive()
 
     def _receive(self):
-        logger.debug("Receiving data ... ")
-
-        stream = QtCore.QDataStream(self.connection)
-        stream.setVersion(QtCore.QDataStream.Qt_4_6)
-
-        i = 0
-        while self.connection.bytesAvailable() > 0:
-            if (self._block_size == 0 and self.connection.bytesAvailable() >= INT32_SIZE) or (
-                self._block_size > 0 and self.connection.bytesAvailable() >= self._block_size
-            ):
-                self._block_size = stream.readInt32()
-                # logger.debug(
-                #     "Reading data size for request %s in queue: %s"
-                #     % (i, self._block_size)
-                # )
-
-            if self._block_size > 0 and self.connection.bytesAvailable() >= self._block_size:
-                data = stream.readRawData(self._block_size)
-                request = QtCore.QTextCodec.codecForMib(106).toUnicode(data)
-                # logger.debug("About to process request %s in queue: %s" % (i, request))
-                self._process_request(request)
-                self._block_size = 0
-                i += 1
+        self.trace("Receiving data ... ")
+
+        self._decoder.feed(self.connection.readAll().data())
+
+        commands = []
+        for data in self._decoder.frames():
+            commands.extend(self._decode_request(data))
+        self._process_commands(commands)
+
+        # replies that were going to arrive did so by now
+        self.expire_pending()
 
         return None
 
     def _prepare_request(self, method, request_return=False, **kwargs):
         request_id = uuid.uuid4().hex
 
-        request = json.dumps(
-            {
-                "jsonrpc": "2.0",
-                "method": method,
-                "params": kwargs,
-                "request_return": request_return,
-                "id": request_id,
-            }
-        )
+        request = {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": kwargs,
+            "request_return": request_return,
+            "id": request_id,
+        }
+
+        # the normal lane is the default, no need to send it
+        priority = self._priorities.get(method, NORMAL)
+        if priority != NORMAL:
+            request["priority"] = priority
         return request_id, request
 
+    def set_priority(self, method, priority):
+        """
+        Sets the lane the requests of the method given travel on, see
+        :mod:`priority`.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown priority: %s" % priority)
+        self._priorities[method] = priority
+
     def _prepare_reply(self, request_id, result):
-        reply = json.dumps(
-            {"jsonrpc": "2.0", "result": result, "request_return": False, "id": request_id}
-        )
+        reply = {"jsonrpc": "2.0", "result": result, "request_return": False, "id": request_id}
+        return request_id, reply
+
+    def _prepare_error(self, request_id, error):
+        reply = {"jsonrpc": "2.0", "error": error, "id": request_id}
         return request_id, reply
 
-    def _process_request(self, request):
-        # make sure is a json like request
+    def _method_of(self, command):
+        if not isinstance(command, dict):
+            return UNKNOWN_METHOD
+        if "method" in command:
+            return command["method"]
+
+        future = self._pending.get(command.get("id"))
+        return future.method if future else UNKNOWN_METHOD
+
+    def _record_traffic(self, record, message, size, method=None):
+        # the size of a batch is shared evenly between the methods in it
+        commands = message if isinstance(message, list) else [message]
+        share = size // max(len(commands), 1)
+        for command in commands:
+            record(method or self._method_of(command), share)
+
+    def _decode_request(self, data):
+        """
+        Returns the commands in the frame given, replies to a batch come back
+        together as an array.
+        """
+        size = len(data)
+        if self._capture is not None:
+            self._capture.record(RECEIVED, data)
+
+        # make sure is a well formed request
         try:
-            command = json.loads(request)
-        except ValueError as e:
-            logger.warning("Ignoring request, not well formed. %s", request)
-            return None
+            data = self._compression.decompress(data)
+            command = JSON_CODEC.decode(data)
+        except (CodecError, zlib.error) as e:
+            logger.warning("Ignoring request, not well formed. %s", e)
+            return []
+
+        self._record_traffic(self.metrics.record_received, command, size)
+
+        return command if isinstance(command, list) else [command]
+
+    def _process_request(self, data):
+        self._process_commands(self._decode_request(data))
 
-        request_id = command.get("id")
+    def _process_commands(self, commands):
+        # replies and interactive requests, like showing the menu, go ahead
+        # of whatever else arrived with them
+        if len(commands) > 1:
+            commands = by_priority(commands, self._priorities)
+
+        for command in commands:
+            self._process_command(command)
+
+    def _process_command(self, command):
+        request_id = command.get("id") if isinstance(command, dict) else None
 
         if not request_id:
-            logger.warning("Ignoring request, not well formed. %s", request)
+            logger.warning("Ignoring request, not well formed. %s", command)
             return None
 
-        # if this is a result return it
-        if "result" in command:
-            self.responses[request_id] = command["result"]
-
-        elif "method" in command:
+        if "method" in command:
             method = command.get("method")
-            kwargs = command.get("params")
 
             # check if any callbacks are registered for this request
             if method in self._callbacks:
-                result = self._callbacks[method](**kwargs)
-
-                if result and command.get("request_return"):
-                    self.send_reply(request_id, result)
-                    logger.debug("Sent back result: %s." % result)
+                queue = self._dispatch_queues.get(method)
+                if queue is None:
+                    queue = self._dispatch_queues[method] = deque()
+                queue.append(command)
+                self._schedule_dispatch()
             else:
                 logger.warning("Command not recognized: %s. Skipping." % method)
-        elif "error" in command:
-            logger.error("Error occurred when requesting command. %s" % command["error"])
+
+        # a reply to one of our requests, resolve whoever is waiting for it
+        elif request_id in self._pending:
+            future = self._pending.pop(request_id)
+            latency = (time.time() - future.sent_at) * 1000
+            self._timeouts.record(future.method, latency)
+            self.metrics.record_latency(future.method, latency)
+            if "error" in command:
+                self.metrics.record_error(future.method)
+                future.set_error(command["error"])
+            else:
+                future.set_result(command.get("result"))
+
+        # nobody is waiting for it anymore, it was cancelled or expired
+        elif "result" in command or "error" in command:
+            self._pending.record_unsolicited()
+            self.trace("Dropped reply nobody is waiting for: %s", command)
         else:
             logger.debug(
                 "Not a command, and not a message we were waiting answer for. %s" % request_id
             )
 
-    def send_and_receive_command(self, method, **kwargs):
-        QtGui.QApplication.processEvents()
+    def _dispatch_callbacks(self, methods=None):
+        """
+        Runs the next callback queued of each method, or only of the methods
+        given, unless one of that method is running already, i.e. it opened a
+        menu and is in a nested event loop.
+        """
+        for method in list(methods or self._dispatch_queues):
+            queue = self._dispatch_queues.get(method)
+            if not queue or method in self._dispatching:
+                continue
+
+            self._run_callback(queue.popleft())
+
+        self._schedule_dispatch()
+
+    def _schedule_dispatch(self):
+        """
+        Dispatches the callbacks queued in the next event loop turn, unless
+        all of them wait for one of the same method that is still running,
+        which dispatches them once it finishes.
+        """
+        ready = any(
+            queue and method not in self._dispatching
+            for method, queue in self._dispatch_queues.items()
+        )
+        if ready and not self._dispatch_timer.isActive():
+            self._dispatch_timer.start(0)
 
+    def _run_callback(self, command):
+        method = command["method"]
+        callback = self._callbacks.get(method)
+        if callback is None:
+            return
+
+        self._dispatching.add(method)
+        self.metrics.record_call(method)
+        st = time.time()
+        try:
+            result = callback(**(command.get("params") or {}))
+        except Exception as e:
+            logger.exception("Error running callback for %s." % method)
+            # harmony would be waiting for the reply until it times out
+            if command.get("request_return"):
+                self.send_error(command["id"], "Error running %s: %s" % (method, e), method=method)
+            return
+        finally:
+            self._dispatching.discard(method)
+            self.metrics.record_latency(method, (time.time() - st) * 1000)
+            if self._dispatch_queues.get(method):
+                self._schedule_dispatch()
+
+        if result and command.get("request_return"):
+            self.send_reply(command["id"], result, method=method)
+            self.trace("Sent back result: %s.", result)
+
+    def send_command_async(self, method, **kwargs):
+        """
+        Sends a request to Harmony without waiting for the reply.
+
+        :returns: :class:`RequestFuture` resolved once the reply arrives.
+        """
         st = time.time()
         request_id, request = self._prepare_request(method, request_return=True, **kwargs)
+
+        future = RequestFuture(self, request_id, method)
+        self.expire_pending()
+        deadline = future.sent_at + self.timeout_for(method) / 1000.0
+        for evicted in self._pending.add(request_id, future, deadline):
+            evicted.set_error(EVICTED_ERROR)
+        self.metrics.record_call(method)
+
+        if self._batch is not None:
+            self._batch.append(request)
+            return future
+
         self._send(request)
-        st1 = time.time()
+        self.trace("Sent request in %s secs: %s", time.time() - st, request)
 
-        logger.debug("Sent request in %s secs: %s" % ((st1 - st), request))
+        return future
 
-        # receive
-        logger.debug("Waiting to receive data...")
+    @contextmanager
+    def batch(self):
+        """
+        Gathers all the requests and commands sent within the context and
+        sends them to Harmony in a single frame when the context exits.
+        Harmony runs them all in one go and replies with a single frame.
 
-        result = None
+        Use the asynchronous methods inside the context, their futures are
+        resolved once the batch has been sent::
 
-        if self.connection.waitForReadyRead(MAX_READ_RESPONSE_TIME):
-            st3 = time.time()
-            self._receiving = True
-            self._receive()
+            with app.batch():
+                futures = [app.get_node_metadata_async(n, attr) for n in nodes]
+            app.wait_for(futures)
+
+        """
+        if self._batch is None:
+            self._batch = []
+
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flush_batch()
+                self._batch = None
+
+    def _flush_batch(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        st = time.time()
+        self._send(batch)
+        self.trace("Sent batch of %s requests in %s secs.", len(batch), time.time() - st)
+
+        # the requests of the batch are answered one after the other, so the
+        # later ones need as much time as all those before them
+        methods = []
+        for request in batch:
+            future = self._pending.get(request["id"])
+            if future is None:
+                continue
+            methods.append(future.method)
+            self._pending.extend(
+                future.request_id, st + self._timeouts.timeout_for_many(methods) / 1000.0
+            )
+
+    def wait_for(self, futures, timeout=None):
+        """
+        Processes incoming data until all the futures given are resolved or
+        `timeout` milliseconds have passed. If no timeout is given, waits for
+        as long as the methods requested usually need, along with the ones of
+        all the requests sent before them, which Harmony answers first.
+
+        :returns: True if all the futures were resolved.
+        """
+        # requests still gathered in a batch would never be answered
+        if self._batch:
+            self._flush_batch()
+
+        pending = [future for future in futures if not future.done()]
+        if timeout is None:
+            timeout = self._timeouts.timeout_for_many(self._methods_ahead_of(pending))
+
+        deadline = time.time() + timeout / 1000.0
+        for future in pending:
+            self._pending.extend(future.request_id, deadline)
+
+        self._receiving = True
+        try:
+            while pending:
+                # harmony might be blocked until we reply to it, and replies
+                # cannot wait for the event loop
+                self._dispatch_callbacks(WAITING_CALLBACKS)
+                self._flush_writes()
+
+                remaining = int((deadline - time.time()) * 1000)
+                if remaining <= 0:
+                    break
+
+                if self.connection.bytesAvailable() <= 0:
+                    if not self.connection.waitForReadyRead(remaining):
+                        break
+
+                self._receive()
+                pending = [future for future in pending if not future.done()]
+        finally:
             self._receiving = False
-            et3 = time.time()
-            result = self.responses.get(request_id)
-            logger.debug("Received command. in %s secs | Result: %s" % ((et3 - st3), result))
-        else:
-            logger.warning("Did not receive any data.")
 
-        et = time.time()
-        logger.debug("Done send and receive. %s" % (et - st))
+        # the futures whose deadline passed fail now, so asking for their
+        # result does not wait for them all over again
+        if pending:
+            self.expire_pending()
+            pending = [future for future in pending if not future.done()]
+
+        return not pending
+
+    def _methods_ahead_of(self, futures):
+        """
+        Returns the methods of the requests waiting for a reply, in the order
+        they were sent, up to the last of the futures given.
+        """
+        request_ids = set(future.request_id for future in futures)
+        methods = []
+        for future in self._pending.values():
+            if not request_ids:
+                break
+            methods.append(future.method)
+            request_ids.discard(future.request_id)
+        return methods
+
+    def cancel_all(self):
+        """
+        Cancels all the requests still waiting for a reply.
+
+        :returns: Number of requests cancelled.
+        """
+        futures = list(self._pending.values())
+        for future in futures:
+            future.cancel()
+        return len(futures)
+
+    def _forget(self, future):
+        self._pending.remove(future.request_id)
+
+    def expire_pending(self):
+        """
+        Gives up on the requests whose reply did not arrive in time, their
+        futures fail with a timeout.
+
+        :returns: Number of requests expired.
+        """
+        expired = self._pending.expire(time.time())
+        for future in expired:
+            timeout = (time.time() - future.sent_at) * 1000
+            self._timeouts.record_timeout(future.method, timeout)
+            self.metrics.record_timeout(future.method)
+            future.set_error(EXPIRED_ERROR)
+        return len(expired)
+
+    def pending_stats(self):
+        """
+        Returns the size of the table of requests waiting for a reply and how
+        many were consumed, expired, evicted, and how many replies arrived
+        for requests that were not waiting anymore.
+        """
+        self.expire_pending()
+        return self._pending.stats()
+
+    def send_and_receive_command(self, method, timeout=None, **kwargs):
+        """
+        Sends a request to Harmony and waits for its reply.
+
+        :param timeout: Milliseconds to wait for the reply. By default,
+            derived from how long the method usually takes.
+        :returns: The result of the request, or None if it failed or the
+            reply did not arrive in time.
+        """
+        QtGui.QApplication.processEvents()
+
+        # a blocking call cannot wait for the end of the batch, so whatever
+        # was gathered so far goes out first to keep the order of the calls
+        if self._batch is not None:
+            self._flush_batch()
+
+        st = time.time()
+        future = self.send_command_async(method, **kwargs)
+
+        # receive
+        self.trace("Waiting to receive data...")
+        try:
+            result = future.result(timeout)
+        except RequestTimeoutError as e:
+            logger.warning(str(e))
+            result = None
+
+            # nobody will be waiting for the reply if it arrives later, and
+            # the method gets more time next time if it became slower
+            if not future.done():
+                self._timeouts.record_timeout(method, (time.time() - st) * 1000)
+                self.metrics.record_timeout(method)
+                future.cancel()
+
+        self.trace("Done send and receive. %s | Result: %s", time.time() - st, result)
 
         QtGui.QApplication.processEvents()
         return result
 
+    def send_and_receive_bulk(self, method, timeout=None, **kwargs):
+        """
+        Sends a request whose reply is a handle to a bulk payload Harmony
+        wrote out of band, see :mod:`bulk`.
+
+        :returns: :class:`BulkPayload` mapping the data, or None if the
+            request failed. The caller is responsible for closing it.
+        """
+        handle = self.send_and_receive_command(method, timeout=timeout, **kwargs)
+        if not handle:
+            return None
+
+        try:
+            return open_bulk(handle)
+        except BulkError as e:
+            logger.error("Could not read bulk reply of %s. %s" % (method, e))
+            return None
+
     def send_command(self, method, **kwargs):
+        self.metrics.record_call(method)
+
+        if self._batch is not None:
+            _, request = self._prepare_request(method, **kwargs)
+            self._batch.append(request)
+            return
+
         request_id, request = self._prepare_request(method, **kwargs)
         st = time.time()
         self._send(request)
-        et = time.time()
-        logger.debug("Sent command in %s secs: %s" % ((et - st), request))
+        self.trace("Sent command in %s secs: %s", time.time() - st, request)
 
-    def send_reply(self, request_id, result):
+    def send_reply(self, request_id, result, method=None):
         _, reply = self._prepare_reply(request_id, result)
         st = time.time()
-        self._send(reply)
-        et = time.time()
-        logger.debug("Sent reply in %s secs: %s" % ((et - st), reply))
+        self._send(reply, method=method)
+        self.trace("Sent reply in %s secs: %s", time.time() - st, reply)
+
+    def send_error(self, request_id, error, method=None):
+        _, reply = self._prepare_error(request_id, error)
+        self._send(reply, method=method)
+        self.trace("Sent error: %s", reply)
 
     def error(self, socketError):
         if socketError == QtNetwork.QAbstractSocket.RemoteHostClosedError:
@@ -306,7 +1070,20 @@ class QTcpSocketClient(QtCore.QObject):
             logger.error("The following error occurred: %s." % self.connection.errorString())
 
     def close(self):
+        self._connecting = False
+        self._connect_timer.stop()
+        self._dispatch_timer.stop()
+        self._dispatch_queues.clear()
+        self.cancel_all()
+        # abort would throw away whatever is left to write
+        if self.is_connected():
+            self._flush_writes()
+            while self.connection.bytesToWrite() > 0:
+                if not self.connection.waitForBytesWritten(MAX_WRITE_RESPONSE_TIME):
+                    break
+        self._clear_writes()
         self.connection.abort()
+        self.stop_capture()
 
     def register_callback(self, method, callback):
         self._callbacks[method] = callback
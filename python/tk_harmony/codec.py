@@ -0,0 +1,33 @@
+"""
+Module with the codec used to encode the messages sent through the socket,
+JSON on both ends.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import json
+import codecs
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+class CodecError(ValueError):
+    pass
+
+
+class JsonCodec(object):
+    name = "json"
+
+    def encode(self, message):
+        return json.dumps(message).encode("utf-8")
+
+    def decode(self, data):
+        try:
+            return json.loads(codecs.utf_8_decode(data)[0])
+        except (ValueError, UnicodeDecodeError) as e:
+            raise CodecError("Not a well formed JSON message: %s" % e)
+
+
+JSON_CODEC = JsonCodec()
@@ -0,0 +1,97 @@
+"""
+Module responsible for the optional compression of the messages sent
+through the socket.
+
+Compressed payloads start with a flag byte that JSON messages cannot start
+with, followed by the zlib stream of the encoded message.
+Only payloads bigger than a threshold are compressed, so the small and
+frequent messages do not pay for it.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import zlib
+import struct
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+# 0xc1 is not valid JSON, nor UTF-8 for that matter
+COMPRESSED_FLAG = 0xC1
+ZLIB = "zlib"
+
+# off unless configured. Replies travel over a loopback socket, where the
+# time the pure script deflate takes inside Harmony is not won back.
+DEFAULT_THRESHOLD = 0
+
+_FLAG = struct.pack(">B", COMPRESSED_FLAG)
+
+
+def is_compressed(data):
+    return len(data) > 0 and bytearray(data[:1])[0] == COMPRESSED_FLAG
+
+
+class Compression(object):
+    """
+    Compresses and decompresses payloads keeping count of the bytes that
+    compression saved in each direction.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, level=1):
+        self.threshold = threshold
+        self.level = level
+
+        # set once negotiated with the other end
+        self.enabled = False
+
+        self.frames_compressed = 0
+        self.frames_decompressed = 0
+        self.bytes_saved_sent = 0
+        self.bytes_saved_received = 0
+
+    def compress(self, payload):
+        """
+        Returns the payload given compressed if it is worth it, otherwise the
+        payload as is.
+        """
+        if not self.enabled or not self.threshold or len(payload) < self.threshold:
+            return payload
+
+        compressed = zlib.compress(payload, self.level)
+        if len(compressed) + 1 >= len(payload):
+            return payload
+
+        self.frames_compressed += 1
+        self.bytes_saved_sent += len(payload) - len(compressed) - 1
+        return _FLAG + compressed
+
+    def decompress(self, data):
+        """
+        Returns the payload given decompressed if it was compressed,
+        otherwise the payload as is.
+        """
+        if not is_compressed(data):
+            return data
+
+        compressed = data[1:]
+        try:
+            payload = zlib.decompress(compressed)
+        except TypeError:
+            # python 2 zlib does not take memoryviews
+            payload = zlib.decompress(compressed.tobytes())
+
+        self.frames_decompressed += 1
+        self.bytes_saved_received += len(payload) - len(data)
+        return payload
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "frames_compressed": self.frames_compressed,
+            "frames_decompressed": self.frames_decompressed,
+            "bytes_saved_sent": self.bytes_saved_sent,
+            "bytes_saved_received": self.bytes_saved_received,
+        }
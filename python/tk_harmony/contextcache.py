@@ -0,0 +1,168 @@
+"""
+Module responsible for remembering the context resolved for the folders
+artists open their work files from.
+
+Resolving the context of a path reads the pipeline configuration and the
+path cache, and often asks Shotgun too. Artists go back and forth between
+the same handful of work files, so the contexts resolved are kept in a
+least recently used cache that is saved to disk between sessions.
+
+Every entry records the files it was resolved from, the templates, roots
+and path cache, along with their modification time and size. An entry is
+dropped as soon as any of them changed.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import os
+import json
+from collections import OrderedDict
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+DEFAULT_CAPACITY = 200
+
+# bumped whenever the layout of the file on disk changes
+VERSION = 1
+
+
+def fingerprint(paths):
+    """
+    Returns the modification time and size of the files given, None for
+    the ones missing.
+    """
+    result = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            result.append(None)
+        else:
+            result.append([stat.st_mtime, stat.st_size])
+    return result
+
+
+def cache_key(path, *extra):
+    """
+    Returns the key of the folder of the path given. Files in the same
+    folder resolve to the same context, `extra` is anything else the
+    context resolved depends on.
+    """
+    folder = os.path.normcase(os.path.dirname(os.path.abspath(path)))
+    return json.dumps([folder] + list(extra), sort_keys=True)
+
+
+class ContextCache(object):
+    """
+    Least recently used cache of the contexts resolved, as dictionaries,
+    by key. See :func:`cache_key`.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, path=None):
+        self.capacity = capacity
+        self.path = path
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the context cached for the key given, or None if there is
+        none or the files it was resolved from changed since.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if fingerprint(entry["files"]) != entry["fingerprint"]:
+            self.invalidations += 1
+            self.misses += 1
+            return None
+
+        # most recently used go last
+        self._entries[key] = entry
+        self.hits += 1
+        return entry["context"]
+
+    def put(self, key, context, files):
+        """
+        Caches the context given, resolved from the files given.
+        """
+        self._entries.pop(key, None)
+        while self._entries and len(self._entries) >= self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        self._entries[key] = {
+            "context": context,
+            "files": list(files),
+            "fingerprint": fingerprint(files),
+        }
+
+    def clear(self):
+        self._entries.clear()
+
+    def load(self):
+        """
+        Reads the entries saved by :meth:`save`. A missing, unreadable or
+        outdated file leaves the cache empty.
+
+        :returns: True if the entries could be read.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+
+        if not isinstance(data, dict) or data.get("version") != VERSION:
+            return False
+
+        self._entries.clear()
+        for key, entry in data.get("entries", [])[-self.capacity :]:
+            self._entries[key] = entry
+        return True
+
+    def save(self):
+        """
+        Writes the entries to disk, replacing the previous file only once
+        it has been written completely.
+        """
+        if not self.path:
+            return
+
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        temp_path = "%s.%s.tmp" % (self.path, os.getpid())
+        with open(temp_path, "w") as f:
+            json.dump({"version": VERSION, "entries": list(self._entries.items())}, f)
+
+        # os.rename does not replace an existing file on windows
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,90 @@
+"""
+Module responsible for splitting the socket stream into messages.
+
+Every message travels as a frame: a big endian int32 with the size of the
+payload followed by the payload itself, the same layout QDataStream uses.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import struct
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+INT32_SIZE = 4
+
+_HEADER = struct.Struct(">i")
+
+
+def pack_frame(payload):
+    """
+    Returns the payload given framed and ready to be written to the socket.
+    """
+    return _HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder(object):
+    """
+    Incremental decoder for the frames received through the socket.
+
+    Data is appended to a single growing buffer as it arrives, in as many
+    pieces as the socket delivers it, and complete frames are handed out as
+    memoryview slices of that buffer, so payloads are never copied.
+
+    The payloads yielded are only valid until the next call to :meth:`feed`,
+    consumers need to decode them (or copy them) straight away.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def __len__(self):
+        """
+        Number of bytes buffered that do not belong to a frame handed out yet.
+        """
+        return len(self._buffer) - self._offset
+
+    def feed(self, data):
+        # drop the frames already consumed before growing the buffer
+        if self._offset:
+            try:
+                del self._buffer[: self._offset]
+            except BufferError:
+                # someone is still holding one of the payloads handed out,
+                # so leave the old buffer to them
+                self._buffer = self._buffer[self._offset :]
+            self._offset = 0
+
+        try:
+            self._buffer += data
+        except BufferError:
+            self._buffer = self._buffer + data
+
+    def frames(self):
+        """
+        Generator that yields the payload of every complete frame buffered
+        so far as a memoryview.
+        """
+        buffer = self._buffer
+        view = memoryview(buffer)
+
+        while True:
+            start = self._offset + INT32_SIZE
+            if len(buffer) < start:
+                return
+
+            size = _HEADER.unpack_from(buffer, self._offset)[0]
+            end = start + size
+            if len(buffer) < end:
+                return
+
+            self._offset = end
+            yield view[start:end]
+
+    def reset(self):
+        self._buffer = bytearray()
+        self._offset = 0
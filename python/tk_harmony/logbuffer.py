@@ -0,0 +1,80 @@
+"""
+Module responsible for gathering log messages so they can be handed out in
+batches, instead of one at a time.
+
+Messages are kept in a bounded ring buffer. When it is full the oldest
+messages are dropped to make room, and counted, so a flood of debug logging
+cannot make memory grow nor hold up the engine.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import threading
+from collections import deque
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+DEFAULT_CAPACITY = 5000
+
+
+class LogBuffer(object):
+    """
+    Ring buffer of `(level, message)` entries. It can be appended to from
+    any thread.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._entries = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+        # dropped since the last drain, and totals for the session
+        self._dropped = 0
+        self.total_queued = 0
+        self.total_dropped = 0
+        self.total_batches = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, level, message):
+        """
+        Adds a message, dropping the oldest one if the buffer is full.
+
+        :returns: The number of messages buffered.
+        """
+        with self._lock:
+            if len(self._entries) == self.capacity:
+                self._dropped += 1
+                self.total_dropped += 1
+            self._entries.append((level, message))
+            self.total_queued += 1
+            return len(self._entries)
+
+    def drain(self):
+        """
+        Takes all the messages buffered.
+
+        :returns: Tuple with the list of `(level, message)` entries and the
+            number of messages dropped since the last drain.
+        """
+        with self._lock:
+            entries = list(self._entries)
+            dropped = self._dropped
+            self._entries.clear()
+            self._dropped = 0
+            if entries:
+                self.total_batches += 1
+            return entries, dropped
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "buffered": len(self._entries),
+            "queued": self.total_queued,
+            "dropped": self.total_dropped,
+            "batches": self.total_batches,
+        }
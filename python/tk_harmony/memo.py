@@ -0,0 +1,233 @@
+"""
+Module responsible for remembering the results of calls made to Harmony
+that rarely change, like the version of the application or the path of the
+project open.
+
+Results are cached per instance and per method, in least recently used
+caches that can also expire their results after a while. Every cached
+method has tags, i.e. "project" or "frame_range", and invalidating a tag
+forgets the results of all the methods of an instance tagged with it::
+
+    class Application(object):
+        @memoized(ttl=5, tags=("frame_range",))
+        def get_frame_range(self):
+            ...
+
+        def set_frame_range(self, start_frame, stop_frame):
+            ...
+            registry_of(self).invalidate("frame_range")
+
+Arguments are normalized into a hashable key, so lists and dictionaries
+can be used. Calls whose arguments cannot be normalized are not cached.
+Results are copied in and out of the cache, so callers are free to change
+the lists and dictionaries they get back.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import time
+import threading
+from copy import deepcopy
+from functools import wraps
+from collections import OrderedDict
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+DEFAULT_MAXSIZE = 128
+
+_REGISTRY_ATTRIBUTE = "_memo_registry"
+
+
+def freeze(value):
+    """
+    Returns a hashable version of the value given, lists and tuples become
+    tuples, sets become frozensets and dictionaries sorted tuples of their
+    items.
+
+    :raises TypeError: If the value, or something in it, is not hashable.
+    """
+    if isinstance(value, dict):
+        items = [(freeze(key), freeze(item)) for key, item in value.items()]
+        return (dict, tuple(sorted(items, key=repr)))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+
+    hash(value)
+    return value
+
+
+def make_key(args, kwargs):
+    """
+    Returns the key of a call made with the arguments given.
+    """
+    return freeze(args), freeze(kwargs) if kwargs else ()
+
+
+class MemoCache(object):
+    """
+    Least recently used cache whose results expire after `ttl` seconds, 0
+    means they never expire. It can be used from any thread.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=0, tags=(), clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.tags = frozenset(tags)
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :returns: Tuple with whether the key was cached and its value.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            value, expires = entry
+            if expires is not None and expires <= self._clock():
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+
+            # most recently used go last
+            self._entries[key] = entry
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value):
+        expires = self._clock() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries.pop(key, None)
+            while self._entries and len(self._entries) >= self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._entries[key] = (value, expires)
+
+    def clear(self):
+        """
+        Forgets all the results cached.
+
+        :returns: Number of results forgotten.
+        """
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            if count:
+                self.invalidations += 1
+            return count
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "tags": sorted(self.tags),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class MemoRegistry(object):
+    """
+    Caches of the memoized methods of an instance, by method name.
+    """
+
+    def __init__(self):
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def cache(self, name, maxsize=DEFAULT_MAXSIZE, ttl=0, tags=()):
+        """
+        Returns the cache of the method given, creating it if needed.
+        """
+        with self._lock:
+            cache = self._caches.get(name)
+            if cache is None:
+                cache = self._caches[name] = MemoCache(maxsize=maxsize, ttl=ttl, tags=tags)
+            return cache
+
+    def invalidate(self, tag=None):
+        """
+        Forgets the results of the methods tagged with the tag given, or of
+        all of them if no tag is given.
+
+        :returns: Number of results forgotten.
+        """
+        with self._lock:
+            caches = list(self._caches.values())
+        return sum(cache.clear() for cache in caches if tag is None or tag in cache.tags)
+
+    def stats(self):
+        with self._lock:
+            return dict((name, cache.stats()) for name, cache in self._caches.items())
+
+
+def registry_of(instance):
+    """
+    Returns the registry of the caches of the instance given.
+    """
+    registry = instance.__dict__.get(_REGISTRY_ATTRIBUTE)
+    if registry is None:
+        registry = instance.__dict__.setdefault(_REGISTRY_ATTRIBUTE, MemoRegistry())
+    return registry
+
+
+def memoized(maxsize=DEFAULT_MAXSIZE, ttl=0, tags=(), cache_none=False, copy=True):
+    """
+    Decorator that caches the results of a method per instance, see the
+    module documentation.
+
+    :param maxsize: Results kept, the least recently used are dropped.
+    :param ttl: Seconds the results are kept for, 0 keeps them until they
+        are invalidated.
+    :param tags: Tags the results can be invalidated by.
+    :param cache_none: None usually means the call failed, so it is not
+        cached unless this is True.
+    :param copy: Whether results are copied in and out of the cache. Only
+        turn it off for results that are never changed.
+    """
+
+    def decorator(method):
+        name = method.__name__
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                key = make_key(args, kwargs)
+            except TypeError:
+                return method(self, *args, **kwargs)
+
+            cache = registry_of(self).cache(name, maxsize=maxsize, ttl=ttl, tags=tags)
+            cached, value = cache.get(key)
+            if cached:
+                return deepcopy(value) if copy else value
+
+            value = method(self, *args, **kwargs)
+            if value is not None or cache_none:
+                cache.put(key, deepcopy(value) if copy else value)
+            return value
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,171 @@
+"""
+Module responsible for keeping track of how the RPC calls between the
+engine and Harmony perform.
+
+For every method the registry counts the calls made, the replies, errors and
+timeouts, the bytes sent and received and keeps a histogram of the latency
+of the replies, so we can tell which Harmony operations artists spend their
+time waiting for.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import json
+import time
+import bisect
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+# upper bounds of the latency buckets, in milliseconds. Anything slower
+# falls in an extra last bucket.
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class LatencyHistogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, latency):
+        self.counts[bisect.bisect_left(self.buckets, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.min = latency if self.min is None else min(self.min, latency)
+        self.max = latency if self.max is None else max(self.max, latency)
+
+    def percentile(self, percentile):
+        """
+        Returns the upper bound of the bucket the percentile given falls in,
+        capped to the slowest latency seen, or None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+
+        target = percentile / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        labels = ["<=%s" % bucket for bucket in self.buckets] + [">%s" % self.buckets[-1]]
+        return {
+            "count": self.count,
+            "total_ms": self.total,
+            "mean_ms": self.total / self.count if self.count else None,
+            "min_ms": self.min,
+            "max_ms": self.max,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "buckets": dict((label, count) for label, count in zip(labels, self.counts) if count),
+        }
+
+
+class MethodMetrics(object):
+    def __init__(self, method):
+        self.method = method
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "latency": self.latency.to_dict(),
+        }
+
+
+class MetricsRegistry(object):
+    """
+    Metrics of all the methods called so far, in both directions. Latencies
+    are in milliseconds.
+    """
+
+    def __init__(self):
+        self._methods = {}
+        self.started = time.time()
+
+    def method(self, method):
+        metrics = self._methods.get(method)
+        if metrics is None:
+            metrics = self._methods[method] = MethodMetrics(method)
+        return metrics
+
+    def record_call(self, method):
+        self.method(method).calls += 1
+
+    def record_latency(self, method, latency):
+        self.method(method).latency.record(latency)
+
+    def record_error(self, method):
+        self.method(method).errors += 1
+
+    def record_timeout(self, method):
+        self.method(method).timeouts += 1
+
+    def record_sent(self, method, size):
+        self.method(method).bytes_sent += size
+
+    def record_received(self, method, size):
+        self.method(method).bytes_received += size
+
+    def reset(self):
+        self._methods = {}
+        self.started = time.time()
+
+    def to_dict(self):
+        return {
+            "started": self.started,
+            "elapsed": time.time() - self.started,
+            "methods": dict(
+                (method, metrics.to_dict()) for method, metrics in self._methods.items()
+            ),
+        }
+
+    def summary(self):
+        """
+        Returns a table with the methods sorted by the total time spent
+        waiting for them.
+        """
+        header = ("method", "calls", "errors", "timeouts", "p50 ms", "p99 ms", "total ms")
+        header += ("sent", "received")
+        lines = ["%-32s %8s %8s %8s %10s %10s %10s %12s %12s" % header]
+        methods = sorted(self._methods.values(), key=lambda m: m.latency.total, reverse=True)
+        for metrics in methods:
+            latency = metrics.latency
+            lines.append(
+                "%-32s %8d %8d %8d %10s %10s %10.1f %12d %12d"
+                % (
+                    metrics.method,
+                    metrics.calls,
+                    metrics.errors,
+                    metrics.timeouts,
+                    latency.percentile(50),
+                    latency.percentile(99),
+                    latency.total,
+                    metrics.bytes_sent,
+                    metrics.bytes_received,
+                )
+            )
+        return "\n".join(lines)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
@@ -0,0 +1,153 @@
+"""
+Module responsible for keeping track of the requests waiting for a reply.
+
+Every request sent is added with a deadline and removed as soon as its reply
+is consumed or its deadline passes, so replies that never arrive, or arrive
+too late, do not pile up for the lifetime of the engine. The table is also
+bounded, the oldest requests are evicted when it is full.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import heapq
+import itertools
+from collections import OrderedDict
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+DEFAULT_CAPACITY = 10000
+
+
+class PendingTable(object):
+    """
+    Requests waiting for a reply, by request id. Deadlines are in seconds,
+    as given by `time.time()`.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._deadlines = {}
+
+        # (deadline, sequence, request id), stale items are skipped when
+        # popped, see extend
+        self._heap = []
+        self._sequence = itertools.count()
+
+        self.peak = 0
+        self.total_added = 0
+        self.total_consumed = 0
+        self.total_expired = 0
+        self.total_evicted = 0
+        self.total_unsolicited = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, request_id):
+        return request_id in self._entries
+
+    def get(self, request_id, default=None):
+        return self._entries.get(request_id, default)
+
+    def values(self):
+        return list(self._entries.values())
+
+    def add(self, request_id, entry, deadline):
+        """
+        Adds a request waiting for a reply.
+
+        :returns: List of the entries evicted to make room for it.
+        """
+        evicted = []
+        while self._entries and len(self._entries) >= self.capacity:
+            oldest, oldest_entry = self._entries.popitem(last=False)
+            del self._deadlines[oldest]
+            evicted.append(oldest_entry)
+            self.total_evicted += 1
+
+        self._entries[request_id] = entry
+        self._push(request_id, deadline)
+
+        self.total_added += 1
+        self.peak = max(self.peak, len(self._entries))
+        return evicted
+
+    def extend(self, request_id, deadline):
+        """
+        Moves the deadline of the request given further away, it is never
+        brought forward.
+        """
+        if request_id in self._entries and deadline > self._deadlines[request_id]:
+            self._push(request_id, deadline)
+
+    def pop(self, request_id):
+        """
+        Takes the request given out of the table, once its reply arrived.
+
+        :returns: The entry of the request or None if it is not waiting.
+        """
+        if request_id not in self._entries:
+            return None
+
+        self.total_consumed += 1
+        del self._deadlines[request_id]
+        return self._entries.pop(request_id)
+
+    def remove(self, request_id):
+        """
+        Takes the request given out of the table without counting it as
+        consumed, i.e. when it is cancelled.
+        """
+        if request_id in self._entries:
+            del self._entries[request_id]
+            del self._deadlines[request_id]
+
+    def expire(self, now):
+        """
+        Takes the requests whose deadline passed out of the table.
+
+        :returns: List of the entries expired.
+        """
+        expired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, request_id = heapq.heappop(heap)
+            if self._deadlines.get(request_id) != deadline:
+                continue
+
+            del self._deadlines[request_id]
+            expired.append(self._entries.pop(request_id))
+            self.total_expired += 1
+
+        # nothing is waiting, drop the stale items
+        if not self._entries:
+            self._heap = []
+
+        return expired
+
+    def record_unsolicited(self):
+        """
+        Counts a reply to a request that was not waiting, because it was
+        never sent, it was cancelled or it expired already.
+        """
+        self.total_unsolicited += 1
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "size": len(self._entries),
+            "peak": self.peak,
+            "added": self.total_added,
+            "consumed": self.total_consumed,
+            "expired": self.total_expired,
+            "evicted": self.total_evicted,
+            "unsolicited": self.total_unsolicited,
+        }
+
+    def _push(self, request_id, deadline):
+        self._deadlines[request_id] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._sequence), request_id))
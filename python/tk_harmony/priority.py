@@ -0,0 +1,73 @@
+"""
+Module responsible for the priority of the commands exchanged with Harmony.
+
+Commands travel on one of three lanes:
+
+- interactive: things the artist is waiting for on screen, like showing the
+  menu or checking the other end is alive. They jump ahead of everything.
+- normal: the rest of the calls.
+- bulk: imports and big queries that can take a while. Harmony runs them in
+  chunks, so interactive commands arriving meanwhile are not held up.
+
+Requests carry their lane in the optional "priority" field. When missing,
+the lane is looked up by method, the same table configure.js uses.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+INTERACTIVE = "interactive"
+NORMAL = "normal"
+BULK = "bulk"
+
+PRIORITIES = (INTERACTIVE, NORMAL, BULK)
+
+_RANKS = dict((priority, rank) for rank, priority in enumerate(PRIORITIES))
+
+# methods that are not on the normal lane
+METHOD_PRIORITIES = {
+    "PING": INTERACTIVE,
+    "DIR": INTERACTIVE,
+    "NEGOTIATE": INTERACTIVE,
+    "SHOW_MENU": INTERACTIVE,
+    "TOGGLE_DEBUG_LOGGING": INTERACTIVE,
+    "QUIT": INTERACTIVE,
+    "IMPORT_CLIP": BULK,
+    "IMPORT_DRAWING": BULK,
+    "IMPORT_AUDIO": BULK,
+    "EXTRACT_THUMBNAIL": BULK,
+    "GET_NODES_OF_TYPE": BULK,
+    "GET_COLUMNS_OF_TYPE": BULK,
+    "GET_SOUND_COLUMN_FILENAMES": BULK,
+    "LOG_BATCH": BULK,
+}
+
+
+def priority_of(command, priorities=METHOD_PRIORITIES):
+    """
+    Returns the lane of the command given. Replies are interactive, someone
+    is waiting for them.
+    """
+    if not isinstance(command, dict):
+        return NORMAL
+
+    priority = command.get("priority")
+    if priority in _RANKS:
+        return priority
+
+    method = command.get("method")
+    if method is None:
+        return INTERACTIVE
+    return priorities.get(method, NORMAL)
+
+
+def by_priority(commands, priorities=METHOD_PRIORITIES):
+    """
+    Returns the commands given with the interactive ones first and the bulk
+    ones last, otherwise in the same order.
+    """
+    return sorted(commands, key=lambda command: _RANKS[priority_of(command, priorities)])
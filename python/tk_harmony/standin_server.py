@@ -0,0 +1,706 @@
+"""
+Python stand-in for the ShotgunBridge server that runs inside Harmony.
+
+It speaks the same protocol as the `Server` and `Engine` classes in
+`resources/packages/ShotgunBridge/configure.js`: same framing, codec and
+compression negotiation, batches, `DIR` and the callbacks the engine uses,
+answered from a synthetic scene with as many nodes and columns as needed.
+
+It allows the engine side to be exercised without Harmony, headless, and
+is the load target of the benchmarks. To run it on its own::
+
+    python standin_server.py --port 55893 --nodes 20000 --columns 200
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import os
+import sys
+import time
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+
+try:
+    from .codec import JSON_CODEC, CodecError
+    from .compression import ZLIB, Compression, is_compressed
+    from .framing import FrameDecoder, pack_frame
+except (ImportError, ValueError):
+    # run as a script or imported from the benchmarks
+    from codec import JSON_CODEC, CodecError
+    from compression import ZLIB, Compression, is_compressed
+    from framing import FrameDecoder, pack_frame
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+logger = logging.getLogger(__name__)
+
+
+META_SHOTGUN_PATH = "meta.shotgun.path"
+HARMONY_VERSION = "17.0.0"
+PING_RESPONSE_TIME = 1000
+
+LOG_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "EXCEPTION": logging.ERROR,
+}
+
+# smallest valid png, a single transparent pixel
+THUMBNAIL_PNG = (
+    b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06"
+    b"\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01"
+    b"\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82"
+)
+
+
+class SyntheticScene(object):
+    """
+    Scene with `nodes` READ nodes spread in groups and `columns` columns, one
+    in ten of them SOUND columns. Every node and sound column carries the
+    shotgun path metadata the hooks look for.
+    """
+
+    def __init__(self, nodes=100, columns=10, frames=240, path=None):
+        self.path = path or "/projects/standin/scenes/standin/standin_v001.xstage"
+        self.dirty = False
+        self.start_frame = 1
+        self.stop_frame = frames
+        self.frame_count = frames
+        self.frame_rate = 24.0
+
+        self.nodes = {}
+        self.node_metadata = {}
+        for i in range(nodes):
+            name = "Top/Group_%03d/Drawing_%05d" % (i % 50, i)
+            self.nodes[name] = "READ"
+            self.node_metadata[name] = {
+                META_SHOTGUN_PATH: "/projects/standin/elements/plate_%05d/plate_v%03d.png"
+                % (i, i % 7 + 1)
+            }
+
+        self.columns = {}
+        self.sound_filenames = {}
+        self.metadata = {"Shotgun Toolkit Engine": ""}
+        for i in range(columns):
+            if i % 10 == 9:
+                name = "Sound_%03d" % i
+                self.columns[name] = "SOUND"
+                filename = "/projects/standin/audio/sound_%03d_v001.wav" % i
+                self.sound_filenames[name] = [filename]
+                self.metadata["%s.%s" % (name, META_SHOTGUN_PATH)] = filename
+            else:
+                self.columns["Drawing_%03d" % i] = "DRAWING"
+
+    def add_node(self, path, node_type="READ"):
+        name = "Top/%s_%05d" % (os.path.splitext(os.path.basename(path))[0], len(self.nodes))
+        self.nodes[name] = node_type
+        self.node_metadata[name] = {META_SHOTGUN_PATH: path}
+        self.dirty = True
+        return name
+
+    def add_sound_column(self, path):
+        name = "Sound_%03d" % len(self.columns)
+        self.columns[name] = "SOUND"
+        self.sound_filenames[name] = [path]
+        self.dirty = True
+        return name
+
+
+class StandInEngine(object):
+    """
+    Counterpart of the `Engine` in configure.js. Every callback takes the
+    params of the request as a dictionary and returns the result.
+    """
+
+    def __init__(self, scene=None):
+        self.scene = scene or SyntheticScene()
+        self.server = None
+        self.debug = True
+        self.is_engine_ready = False
+        self.subscriptions = set()
+
+    def callbacks(self):
+        return {
+            "LOG_INFO": self.log(logging.INFO),
+            "LOG_WARNING": self.log(logging.WARNING),
+            "LOG_DEBUG": self.log(logging.DEBUG),
+            "LOG_ERROR": self.log(logging.ERROR),
+            "LOG_EXCEPTION": self.log(logging.ERROR),
+            "LOG_BATCH": self.log_batch,
+            "GET_VERSION": self.get_version,
+            "ENGINE_READY": self.engine_ready,
+            "ENGINE_RESTART": self.engine_restart,
+            "OPEN_PROJECT": self.open_project,
+            "GET_CURRENT_PROJECT_FOLDER": self.current_project_folder,
+            "GET_CURRENT_PROJECT_PATH": self.current_project_path,
+            "SAVE_PROJECT": self.save_project,
+            "SAVE_NEW_VERSION": self.save_new_version,
+            "SAVE_NEW_VERSION_ACTION": self.save_new_version_action,
+            "NEEDS_SAVING": self.needs_saving_project,
+            "CLOSE_PROJECT": self.close_project,
+            "EXECUTE_STATEMENT": self.execute_statement,
+            "EXTRACT_THUMBNAIL": self.extract_thumbnail,
+            "TOGGLE_DEBUG_LOGGING": self.toggle_debug_logging,
+            "IS_STARTUP_PROJECT": self.is_startup_project,
+            "GET_FRAME_RANGE": self.get_frame_range,
+            "SET_FRAME_RANGE": self.set_frame_range,
+            "GET_FRAME_COUNT": self.get_frame_count,
+            "SET_FRAME_COUNT": self.set_frame_count,
+            "GET_START_FRAME": self.get_start_frame,
+            "SET_START_FRAME": self.set_start_frame,
+            "GET_STOP_FRAME": self.get_stop_frame,
+            "SET_STOP_FRAME": self.set_stop_frame,
+            "GET_FRAME_RATE": self.get_frame_rate,
+            "IMPORT_DRAWING": self.import_drawing,
+            "IMPORT_AUDIO": self.import_audio,
+            "IMPORT_CLIP": self.import_drawing,
+            "GET_NODE_METADATA": self.get_node_metadata,
+            "GET_SCENE_METADATA": self.get_scene_metadata,
+            "GET_NODES_OF_TYPE": self.get_nodes_of_type,
+            "GET_COLUMNS_OF_TYPE": self.get_columns_of_type,
+            "GET_SOUND_COLUMN_FILENAMES": self.get_sound_column_filenames,
+            "PING": self.ping,
+            "SUBSCRIBE": self.subscribe,
+            "UNSUBSCRIBE": self.unsubscribe,
+            # not in harmony, used by the benchmarks
+            "ECHO": self.echo,
+        }
+
+    def log(self, level):
+        def log_message(data):
+            logger.log(level, "Engine: %s", data.get("message"))
+
+        return log_message
+
+    def log_batch(self, data):
+        if data.get("dropped"):
+            logger.warning("Engine: %s log messages were dropped.", data["dropped"])
+        for level, message in data.get("records") or []:
+            logger.log(LOG_LEVELS.get(level, logging.INFO), "Engine: %s", message)
+
+    def publish(self, event, data):
+        if event in self.subscriptions and self.server:
+            self.server.send_command("SCENE_EVENT", event=event, data=data)
+
+    def _touch(self):
+        if not self.scene.dirty:
+            self.scene.dirty = True
+            self.publish("dirty", {"dirty": True})
+
+    def get_version(self, data):
+        return HARMONY_VERSION
+
+    def engine_ready(self, data):
+        self.is_engine_ready = True
+
+    def engine_restart(self, data):
+        self.is_engine_ready = False
+        self.subscriptions = set()
+
+    def current_project_path(self, data):
+        return self.scene.path
+
+    def current_project_folder(self, data):
+        return os.path.dirname(self.scene.path)
+
+    def open_project(self, data):
+        self.scene.path = data["path"]
+        self.scene.dirty = False
+        self.publish("project", {"path": self.scene.path})
+        return os.path.dirname(self.scene.path)
+
+    def save_project(self, data):
+        was_dirty = self.scene.dirty
+        self.scene.dirty = False
+        if was_dirty:
+            self.publish("saved", {"path": self.scene.path})
+            self.publish("dirty", {"dirty": False})
+        return os.path.dirname(self.scene.path)
+
+    def save_new_version(self, data):
+        folder = os.path.dirname(self.scene.path)
+        self.scene.path = "%s/%s.xstage" % (folder, data["version_name"])
+        self.scene.dirty = False
+        self.publish("project", {"path": self.scene.path})
+        return folder
+
+    def save_new_version_action(self, data):
+        return None
+
+    def needs_saving_project(self, data):
+        return self.scene.dirty
+
+    def close_project(self, data):
+        return None
+
+    def execute_statement(self, data):
+        # there is no javascript to run here, harmony returns false on errors
+        logger.warning("Cannot execute statements: %s", data.get("statement"))
+        return False
+
+    def extract_thumbnail(self, data):
+        handle, path = tempfile.mkstemp(suffix=".png")
+        os.write(handle, THUMBNAIL_PNG)
+        os.close(handle)
+        return {"bulk": {"path": path, "size": len(THUMBNAIL_PNG), "format": "png"}}
+
+    def toggle_debug_logging(self, data):
+        self.debug = data.get("enabled")
+
+    def is_startup_project(self, data):
+        return self.scene.metadata.get("Shotgun Toolkit Engine") == "Startup template"
+
+    def get_start_frame(self, data):
+        return self.scene.start_frame
+
+    def set_start_frame(self, data):
+        self.scene.start_frame = data["start_frame"]
+        self._touch()
+        self.publish("frame_range", self.get_frame_range(data))
+        return self.scene.start_frame
+
+    def get_stop_frame(self, data):
+        return self.scene.stop_frame
+
+    def set_stop_frame(self, data):
+        self.scene.stop_frame = data["stop_frame"]
+        self._touch()
+        self.publish("frame_range", self.get_frame_range(data))
+        return self.scene.stop_frame
+
+    def get_frame_range(self, data):
+        return {"start_frame": self.scene.start_frame, "stop_frame": self.scene.stop_frame}
+
+    def set_frame_range(self, data):
+        self.set_start_frame(data)
+        self.set_stop_frame(data)
+        return self.get_frame_range(data)
+
+    def get_frame_count(self, data):
+        return self.scene.frame_count
+
+    def set_frame_count(self, data):
+        self.scene.frame_count = data["frame_count"]
+        self._touch()
+        return self.scene.frame_count
+
+    def get_frame_rate(self, data):
+        return self.scene.frame_rate
+
+    def import_drawing(self, data):
+        name = self.scene.add_node(data["path"])
+        self._touch()
+        self.publish("nodes", {"added": [name], "removed": []})
+        return name
+
+    def import_audio(self, data):
+        name = self.scene.add_sound_column(data["path"])
+        self._touch()
+        self.publish("columns", {"added": [name], "removed": []})
+        return True
+
+    def get_node_metadata(self, data):
+        return self.scene.node_metadata.get(data["node"], {}).get(data["attr_name"], "")
+
+    def get_scene_metadata(self, data):
+        return self.scene.metadata.get(data["attr_name"], "")
+
+    def get_nodes_of_type(self, data):
+        node_types = data["node_types"]
+        return [name for name, node_type in self.scene.nodes.items() if node_type in node_types]
+
+    def get_columns_of_type(self, data):
+        column_type = data["column_type"]
+        return [name for name, kind in self.scene.columns.items() if kind == column_type]
+
+    def get_sound_column_filenames(self, data):
+        return self.scene.sound_filenames.get(data["column_name"], [])
+
+    def ping(self, data):
+        return "PONG"
+
+    def echo(self, data):
+        return data.get("payload")
+
+    def subscribe(self, data):
+        self.subscriptions.update(data.get("events") or [])
+        return sorted(self.subscriptions)
+
+    def unsubscribe(self, data):
+        self.subscriptions.difference_update(data.get("events") or [])
+        return sorted(self.subscriptions)
+
+
+class StandInConnection(object):
+    """
+    State of a client connected to the server, as the `Server` in
+    configure.js keeps it: the compression negotiated and the
+    framing of the data received so far.
+    """
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.socket = sock
+        self.decoder = FrameDecoder()
+        self.compression = Compression(threshold=0)
+        self.responses = {}
+        self.closed = False
+        self._write_lock = threading.Lock()
+        self._responses_changed = threading.Condition()
+
+    def negotiate(self, data):
+        data = data or {}
+
+        # like harmony, we can compress but not decompress
+        threshold = data.get("compression_threshold") or 0
+        self.compression.enabled = ZLIB in (data.get("compression") or []) and threshold > 0
+        self.compression.threshold = threshold if self.compression.enabled else 0
+
+        send = ZLIB if self.compression.enabled else None
+        return {"compression": {"send": send, "receive": None}}
+
+    def send(self, message):
+        payload = self.compression.compress(JSON_CODEC.encode(message))
+        with self._write_lock:
+            try:
+                self.socket.sendall(pack_frame(payload))
+            except socket.error as e:
+                logger.warning("Could not send message: %s", e)
+
+    def serve(self):
+        try:
+            while not self.closed:
+                data = self.socket.recv(1024 * 1024)
+                if not data:
+                    break
+
+                self.decoder.feed(data)
+                for payload in self.decoder.frames():
+                    self.process_request(payload)
+        except socket.error as e:
+            logger.debug("Connection error: %s", e)
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+        self.server._forget(self)
+
+    def decode(self, data):
+        if is_compressed(data):
+            raise CodecError(
+                "Received a compressed message, compression was not negotiated that way."
+            )
+        return JSON_CODEC.decode(data)
+
+    def process_request(self, data):
+        try:
+            command = self.decode(data)
+        except CodecError as e:
+            logger.warning("Ignoring request, not well formed. %s", e)
+            return
+
+        # a batch is run in one go and replied to in a single frame
+        if isinstance(command, list):
+            replies = [self.process_command(batch_command) for batch_command in command]
+            replies = [reply for reply in replies if reply is not None]
+            if replies:
+                self.send(replies if len(replies) > 1 else replies[0])
+        else:
+            reply = self.process_command(command)
+            if reply is not None:
+                self.send(reply)
+
+    def process_command(self, command):
+        request_id = command.get("id") if isinstance(command, dict) else None
+        if request_id is None:
+            logger.warning("Ignoring request, not well formed. %s", command)
+            return None
+
+        if command.get("method") is not None:
+            method = command["method"].upper()
+            return_requested = command.get("request_return") is True
+
+            callback = self.server.callback(method, self)
+            if callback is None:
+                logger.warning("Command received was ignored: %s", method)
+                if return_requested:
+                    return self.error_object(request_id, "Unknown method: %s" % method)
+                return None
+
+            try:
+                result = self.server.run(callback, command.get("params") or {})
+            except Exception as e:
+                logger.exception("An error ocurred executing callback for method: %s", method)
+                if return_requested:
+                    return self.error_object(request_id, str(e))
+                return None
+
+            if return_requested:
+                return self.reply_object(request_id, result)
+
+        elif command.get("result") is not None:
+            with self._responses_changed:
+                self.responses[request_id] = command["result"]
+                self._responses_changed.notify_all()
+
+        # whoever is waiting for the reply gets None straight away
+        elif command.get("error") is not None:
+            logger.error("Error occurred when requesting command. %s", command["error"])
+            if request_id is not None:
+                with self._responses_changed:
+                    self.responses[request_id] = None
+                    self._responses_changed.notify_all()
+
+        return None
+
+    def reply_object(self, request_id, result):
+        return {"jsonrpc": "2.0", "result": result, "request_return": False, "id": request_id}
+
+    def error_object(self, request_id, error):
+        return {"jsonrpc": "2.0", "error": error, "request_return": False, "id": request_id}
+
+    def request(self, method, params, request_return=False):
+        request_id = self.server.next_id()
+        self.send(
+            {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": params,
+                "request_return": request_return,
+                "id": request_id,
+            }
+        )
+        return request_id
+
+    def wait_for_response(self, request_id, timeout):
+        deadline = time.time() + timeout / 1000.0
+        with self._responses_changed:
+            while request_id not in self.responses:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self.closed:
+                    logger.warning("Did not receive command result | Request ID: %s", request_id)
+                    return None
+                self._responses_changed.wait(remaining)
+            return self.responses.pop(request_id)
+
+
+class StandInServer(object):
+    """
+    Counterpart of the `Server` in configure.js.
+
+    Listens on a TCP port, or on a unix domain socket if a socket name is
+    given, named as QLocalSocket expects it. Callbacks run one at a time,
+    as they would in the Harmony event loop, optionally delayed by
+    `latency` milliseconds to pretend Harmony is busy.
+
+    Many clients can be connected at once, each one with its own
+    compression, see :attr:`connection`.
+    """
+
+    def __init__(
+        self, host="127.0.0.1", port=0, socket_name=None, engine=None, latency=0, ping=True
+    ):
+        self.host = host
+        self.port = port
+        self.socket_name = socket_name
+        self.engine = engine or StandInEngine()
+        self.engine.server = self
+        self.latency = latency
+        self.ping = ping
+
+        self.socket = None
+        self.connections = []
+        self._callbacks = self.engine.callbacks()
+        self._run_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._m_id = 0
+        self._thread = None
+
+    @property
+    def socket_path(self):
+        # QLocalSocket looks for relative names in the temp folder
+        if os.path.isabs(self.socket_name):
+            return self.socket_name
+        return os.path.join(tempfile.gettempdir(), self.socket_name)
+
+    def start(self):
+        if self.socket_name:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.bind(self.socket_path)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.host, self.port))
+            self.port = self.socket.getsockname()[1]
+
+        self.socket.listen(5)
+        self._thread = threading.Thread(target=self._accept, name="StandInServer")
+        self._thread.daemon = True
+        self._thread.start()
+
+        logger.info("Local Server started: %s", self.address())
+        return self
+
+    def address(self):
+        if self.socket_name:
+            return self.socket_path
+        return "%s:%s" % (self.host, self.port)
+
+    def close(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+            self.socket = None
+
+        for connection in list(self.connections):
+            connection.close()
+
+        if self.socket_name and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _accept(self):
+        while self.socket is not None:
+            try:
+                sock, _ = self.socket.accept()
+            except (socket.error, AttributeError):
+                break
+
+            if not self.socket_name:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            connection = StandInConnection(self, sock)
+            self.connections.append(connection)
+            logger.debug("Client connected: %s", sock)
+
+            thread = threading.Thread(target=connection.serve, name="StandInConnection")
+            thread.daemon = True
+            thread.start()
+
+            # harmony checks the engine is alive as soon as it connects
+            if self.ping:
+                thread = threading.Thread(
+                    target=self.send_and_receive_command,
+                    args=("PING",),
+                    kwargs={"timeout": PING_RESPONSE_TIME, "connection": connection},
+                )
+                thread.daemon = True
+                thread.start()
+
+    def _forget(self, connection):
+        if connection in self.connections:
+            self.connections.remove(connection)
+
+    @property
+    def connection(self):
+        """
+        The primary connection, the oldest one still open, which pushes and
+        requests go to unless told otherwise. Replies go back through the
+        connection the request came from.
+        """
+        return self.connections[0] if self.connections else None
+
+    def next_id(self):
+        with self._id_lock:
+            self._m_id += 1
+            return self._m_id
+
+    def register_command(self, method, callback):
+        self._callbacks[method] = callback
+
+    def callback(self, method, connection):
+        if method == "DIR":
+            return lambda data: sorted(list(self._callbacks) + ["DIR", "NEGOTIATE"])
+        if method == "NEGOTIATE":
+            return connection.negotiate
+        return self._callbacks.get(method)
+
+    def run(self, callback, params):
+        with self._run_lock:
+            if self.latency:
+                time.sleep(self.latency / 1000.0)
+            return callback(params)
+
+    def send_command(self, method, connection=None, **params):
+        connection = connection or self.connection
+        if connection is None:
+            logger.debug("No connection, message lost!: %s", method)
+            return
+        connection.request(method, params)
+
+    def send_and_receive_command(self, method, timeout=5000, connection=None, **params):
+        connection = connection or self.connection
+        if connection is None:
+            logger.debug("No connection, message lost!: %s", method)
+            return None
+        request_id = connection.request(method, params, request_return=True)
+        return connection.wait_for_response(request_id, timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--socket-name", help="Listen on a local socket instead of TCP.")
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=240)
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds per callback.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    scene = SyntheticScene(nodes=args.nodes, columns=args.columns, frames=args.frames)
+    server = StandInServer(
+        host=args.host,
+        port=args.port,
+        socket_name=args.socket_name,
+        engine=StandInEngine(scene),
+        latency=args.latency,
+    )
+
+    with server:
+        # the engine finds the server through the same variables harmony uses
+        if args.socket_name:
+            print("SGTK_HARMONY_ENGINE_TRANSPORT=local")
+            print("SGTK_HARMONY_ENGINE_SOCKET_NAME=%s" % args.socket_name)
+        else:
+            print("SGTK_HARMONY_ENGINE_HOST=%s" % server.host)
+            print("SGTK_HARMONY_ENGINE_PORT=%s" % server.port)
+        sys.stdout.flush()
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Module responsible for working out how long to wait for the reply to a
+request sent to Harmony.
+
+Every method keeps a window with the latency of its most recent replies. Once
+enough of them have been observed the timeout of the method is derived from a
+high percentile of that window, so cheap methods fail fast when Harmony hangs
+while the slow ones still have the time they usually need.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+import math
+from collections import deque
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+class AdaptiveTimeout(object):
+    """
+    Keeps track of the latency of the replies to each method and gives back
+    the timeout, in milliseconds, to use for the next request of a method.
+
+    :param default: Timeout used until enough replies have been observed.
+    :param minimum: Timeout never goes below this, no matter how fast the
+        method usually is.
+    :param maximum: Timeout never goes above this. Callers can still ask
+        for a longer timeout explicitly.
+    :param percentile: Percentile of the observed latencies used as base.
+    :param factor: Multiplier applied to the percentile.
+    :param window: Number of latencies remembered for each method.
+    :param min_samples: Latencies needed before adapting the timeout.
+    :param per_request: Time allowed for each request sent along with
+        others, on top of the timeout of the slowest of them.
+    :param batch_maximum: Timeout of many requests never goes above this.
+    """
+
+    def __init__(
+        self,
+        default,
+        minimum=1000,
+        maximum=None,
+        percentile=99,
+        factor=3.0,
+        window=200,
+        min_samples=20,
+        per_request=20,
+        batch_maximum=60000,
+    ):
+        self.default = default
+        self.minimum = minimum
+        self.maximum = default if maximum is None else maximum
+        self.percentile = percentile
+        self.factor = factor
+        self.window = window
+        self.min_samples = min_samples
+        self.per_request = per_request
+        self.batch_maximum = batch_maximum
+
+        self._latencies = {}
+        self._timeouts = {}
+
+    def record(self, method, latency):
+        """
+        Records how many milliseconds it took to receive a reply for the
+        method given.
+        """
+        latencies = self._latencies.get(method)
+        if latencies is None:
+            latencies = self._latencies[method] = deque(maxlen=self.window)
+        latencies.append(latency)
+
+    def record_timeout(self, method, timeout):
+        """
+        Records a request that timed out. It counts as a reply that took the
+        whole timeout, so a method that became slower gets more time on the
+        following requests instead of failing over and over.
+        """
+        self._timeouts[method] = self._timeouts.get(method, 0) + 1
+        self.record(method, timeout)
+
+    def percentile_of(self, method, percentile):
+        """
+        Returns the percentile given of the latencies observed for the
+        method, or None if no reply has been observed yet.
+        """
+        latencies = self._latencies.get(method)
+        if not latencies:
+            return None
+
+        ordered = sorted(latencies)
+        index = int(math.ceil(percentile / 100.0 * len(ordered))) - 1
+        return ordered[max(0, min(index, len(ordered) - 1))]
+
+    def timeout_for(self, method):
+        latencies = self._latencies.get(method)
+        if not latencies or len(latencies) < self.min_samples:
+            return self.default
+
+        timeout = self.percentile_of(method, self.percentile) * self.factor
+        return int(max(self.minimum, min(timeout, self.maximum)))
+
+    def timeout_for_many(self, methods):
+        """
+        Returns the timeout to wait for the replies to the requests of the
+        methods given, sent one after the other. Harmony runs them in order,
+        so the slowest of them gets its whole timeout and every other one a
+        small allowance, up to `batch_maximum`.
+        """
+        methods = list(methods)
+        if not methods:
+            return 0
+
+        slowest = max(self.timeout_for(method) for method in methods)
+        if len(methods) == 1:
+            return slowest
+
+        timeout = slowest + (len(methods) - 1) * self.per_request
+        return max(slowest, min(timeout, self.batch_maximum))
+
+    def stats(self):
+        stats = {}
+        for method, latencies in self._latencies.items():
+            stats[method] = {
+                "samples": len(latencies),
+                "p50": self.percentile_of(method, 50),
+                "p99": self.percentile_of(method, 99),
+                "timeouts": self._timeouts.get(method, 0),
+                "timeout": self.timeout_for(method),
+            }
+        return stats
@@ -0,0 +1,60 @@
+"""
+Module responsible for tracing the messages exchanged with Harmony.
+
+Tracing every message means formatting whole requests and replies, which
+costs more than sending them. A :class:`Tracer` only formats its arguments
+when it is enabled, so when it is not a trace costs a function call and an
+attribute lookup. Payloads are truncated so a single big reply does not
+flood the log.
+
+Note that this module does not depend on Qt or Toolkit on purpose.
+"""
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+# characters of each argument written to the log, 0 does not truncate
+DEFAULT_LIMIT = 256
+
+_NOT_TRUNCATED = (int, float, bool, type(None))
+
+
+def truncate(value, limit=DEFAULT_LIMIT):
+    """
+    Returns the value given as text, cut down to `limit` characters.
+    """
+    if isinstance(value, _NOT_TRUNCATED):
+        return value
+
+    text = "%s" % (value,)
+    if limit and len(text) > limit:
+        return "%s... (%s chars)" % (text[:limit], len(text))
+    return text
+
+
+class Tracer(object):
+    """
+    Writes debug messages to the logger given, formatting them with the
+    arguments given only when enabled::
+
+        trace = Tracer(logger, enabled=True)
+        trace("Sent request in %s secs: %s", elapsed, request)
+
+    Call sites that need to do some work to get the arguments can check
+    :attr:`enabled` first.
+    """
+
+    def __init__(self, logger, limit=DEFAULT_LIMIT, enabled=False):
+        self.logger = logger
+        self.limit = limit
+        self.enabled = enabled
+
+    def __call__(self, message, *args):
+        if not self.enabled:
+            return
+
+        if args:
+            message = message % tuple(truncate(arg, self.limit) for arg in args)
+        self.logger.debug(message)
@@ -11,45 +11,6 @@ def normpath(path):
     return os.path.abspath(os.path.realpath(path)).replace("\\", "/")
 
 
-class Cached(object):
-    def __init__(self, f, ttl=0, size_limit=0):
-        self.func = f
-        self.cache = {}
-        self.size_limit = size_limit
-        self.ttl = ttl
-        self.ttls = {}
-
-    def __call__(self, *args, **kwargs):
-        import time
-
-        key = str(args) + str(kwargs.items())
-        if self.size_limit > 0 and len(self.cache) > self.size_limit:
-            self.cache = {}
-
-        cache_return = True
-        if key in self.cache:
-            if self.ttl > 0 and (time.time() - self.ttls[key] > self.ttl):
-                del self.ttls[key]
-                del self.cache[key]
-            else:
-                cache_return = False
-
-        if cache_return:
-            ret = self.func(*args, **kwargs)
-            self.cache[key] = ret
-            if self.ttl > 0:
-                self.ttls[key] = time.time()
-        else:
-            ret = self.cache[key]
-
-        return ret
-
-    def __get__(self, instance, owner):
-        from functools import partial
-
-        return partial(self.__call__, instance)
-
-
 def copy_tree(
     source_dir,
     target_dir,
@@ -409,6 +409,387 @@ function renameNodeMetadata(nodeName, oldName, newName)
     removeNodeMetadata(nodeName, oldName);
 }
 
+// -----------------------------------------------------------------------------
+// Wire codec
+//
+// Messages are encoded as JSON on both ends. Compressed messages are handled as arrays of byte values
+// and converted to QByteArray in bulk through their hex representation.
+// -----------------------------------------------------------------------------
+
+var HEX_DIGITS = "0123456789abcdef";
+var UTF8_TEXT_CODEC = null;
+
+// decodes the whole QByteArray given as UTF-8 in a single call
+function byteArrayToString(data)
+{
+    if (UTF8_TEXT_CODEC == null)
+        UTF8_TEXT_CODEC = QTextCodec.codecForMib(106);
+    return UTF8_TEXT_CODEC.toUnicode(data);
+}
+
+function bytesToByteArray(bytes)
+{
+    var hex = [];
+    for (var i = 0; i < bytes.length; i++)
+        hex.push(HEX_DIGITS.charAt(bytes[i] >> 4) + HEX_DIGITS.charAt(bytes[i] & 0x0f));
+
+    var data = new QByteArray();
+    data.append(hex.join(""));
+    return QByteArray.fromHex(data);
+}
+
+function utf8Encode(text, out)
+{
+    for (var i = 0; i < text.length; i++)
+    {
+        var code = text.charCodeAt(i);
+
+        // surrogate pairs
+        if (code >= 0xd800 && code < 0xdc00 && i + 1 < text.length)
+        {
+            var low = text.charCodeAt(i + 1);
+            if (low >= 0xdc00 && low < 0xe000)
+            {
+                code = 0x10000 + ((code - 0xd800) << 10) + (low - 0xdc00);
+                i++;
+            }
+        }
+
+        if (code < 0x80)
+            out.push(code);
+        else if (code < 0x800)
+            out.push(0xc0 | (code >> 6), 0x80 | (code & 0x3f));
+        else if (code < 0x10000)
+            out.push(0xe0 | (code >> 12), 0x80 | ((code >> 6) & 0x3f), 0x80 | (code & 0x3f));
+        else
+            out.push(0xf0 | (code >> 18), 0x80 | ((code >> 12) & 0x3f),
+                     0x80 | ((code >> 6) & 0x3f), 0x80 | (code & 0x3f));
+    }
+    return out;
+}
+
+// Splits the stream of bytes received into frames. Each frame is a big
+// endian int32 with the size of the payload followed by the payload, which
+// is what QDataStream writes. Data is accumulated until a frame is complete,
+// so frames split across several reads are handled.
+function FrameDecoder()
+{
+    var self = this;
+    self.INT32_SIZE = 4;
+    self.buffer = new QByteArray();
+    self.offset = 0;
+
+    self.feed = function(data)
+    {
+        // drop the frames already consumed before growing the buffer
+        if (self.offset > 0)
+        {
+            self.buffer = self.buffer.mid(self.offset);
+            self.offset = 0;
+        }
+        self.buffer.append(data);
+    }
+
+    // returns the payload of the next complete frame or null if more data is
+    // needed for it
+    self.next = function()
+    {
+        var buffer = self.buffer;
+        var offset = self.offset;
+        if (buffer.size() - offset < self.INT32_SIZE)
+            return null;
+
+        var size = (buffer.at(offset) & 0xff) * 0x1000000 + 
+                   (buffer.at(offset + 1) & 0xff) * 0x10000 + 
+                   (buffer.at(offset + 2) & 0xff) * 0x100 + 
+                   (buffer.at(offset + 3) & 0xff);
+
+        if (buffer.size() - offset < self.INT32_SIZE + size)
+            return null;
+
+        self.offset = offset + self.INT32_SIZE + size;
+        return buffer.mid(offset + self.INT32_SIZE, size);
+    }
+
+    self.reset = function()
+    {
+        self.buffer = new QByteArray();
+        self.offset = 0;
+    }
+}
+
+function JsonCodec()
+{
+    var self = this;
+    self.name = "json";
+
+    self.encode = function(message)
+    {
+        return JSON.stringify(message);
+    }
+
+    self.decode = function(text)
+    {
+        return JSON.parse(text);
+    }
+}
+
+var JSON_CODEC = new JsonCodec();
+
+// -----------------------------------------------------------------------------
+// Compression
+//
+// Big messages sent to the engine can be compressed once it has been
+// negotiated. Compressed payloads start with the 0xc1 flag byte, which
+// JSON messages cannot start with, followed by a zlib
+// stream. Harmony does not expose zlib to scripts, so this is a small
+// deflate encoder using LZ77 matching and the fixed Huffman codes. It
+// only compresses; the engine does not send compressed messages to Harmony.
+// -----------------------------------------------------------------------------
+
+var COMPRESSED_FLAG = 0xc1;
+
+var DEFLATE_LENGTH_BASE = [3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31,
+                           35, 43, 51, 59, 67, 83, 99, 115, 131, 163, 195, 227, 258];
+var DEFLATE_LENGTH_EXTRA = [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2,
+                            3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 0];
+var DEFLATE_DIST_BASE = [1, 2, 3, 4, 5, 7, 9, 13, 17, 25, 33, 49, 65, 97, 129, 193,
+                         257, 385, 513, 769, 1025, 1537, 2049, 3073, 4097, 6145,
+                         8193, 12289, 16385, 24577];
+var DEFLATE_DIST_EXTRA = [0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6,
+                          7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 12, 12, 13, 13];
+
+function zlibCompress(bytes)
+{
+    var WINDOW_SIZE = 32768;
+    var HASH_SIZE = 32768;
+    var MIN_MATCH = 3;
+    var MAX_MATCH = 258;
+    var MAX_CHAIN = 16;
+
+    var out = [0x78, 0x01];
+    var bit_buffer = 0;
+    var bit_count = 0;
+
+    function put_bits(value, count)
+    {
+        bit_buffer |= value << bit_count;
+        bit_count += count;
+        while (bit_count >= 8)
+        {
+            out.push(bit_buffer & 0xff);
+            bit_buffer >>>= 8;
+            bit_count -= 8;
+        }
+    }
+
+    // huffman codes are written starting from their most significant bit
+    function put_code(code, length)
+    {
+        var reversed = 0;
+        for (var i = 0; i < length; i++)
+        {
+            reversed = (reversed << 1) | (code & 1);
+            code >>= 1;
+        }
+        put_bits(reversed, length);
+    }
+
+    function put_symbol(symbol)
+    {
+        if (symbol < 144)
+            put_code(0x30 + symbol, 8);
+        else if (symbol < 256)
+            put_code(0x190 + symbol - 144, 9);
+        else if (symbol < 280)
+            put_code(symbol - 256, 7);
+        else
+            put_code(0xc0 + symbol - 280, 8);
+    }
+
+    function find_code(bases, value)
+    {
+        var code = bases.length - 1;
+        while (bases[code] > value)
+            code--;
+        return code;
+    }
+
+    function put_match(length, distance)
+    {
+        var code = find_code(DEFLATE_LENGTH_BASE, length);
+        put_symbol(257 + code);
+        if (DEFLATE_LENGTH_EXTRA[code] > 0)
+            put_bits(length - DEFLATE_LENGTH_BASE[code], DEFLATE_LENGTH_EXTRA[code]);
+
+        code = find_code(DEFLATE_DIST_BASE, distance);
+        put_code(code, 5);
+        if (DEFLATE_DIST_EXTRA[code] > 0)
+            put_bits(distance - DEFLATE_DIST_BASE[code], DEFLATE_DIST_EXTRA[code]);
+    }
+
+    var head = new Array(HASH_SIZE);
+    var previous = new Array(WINDOW_SIZE);
+
+    function hash(position)
+    {
+        return ((bytes[position] << 10) ^ (bytes[position + 1] << 5) ^ bytes[position + 2]) & (HASH_SIZE - 1);
+    }
+
+    function insert(position)
+    {
+        var key = hash(position);
+        var last = head[key];
+        previous[position & (WINDOW_SIZE - 1)] = (typeof(last) === "undefined") ? -1 : last;
+        head[key] = position;
+    }
+
+    // a single final block using the fixed huffman codes
+    put_bits(1, 1);
+    put_bits(1, 2);
+
+    var length = bytes.length;
+    var position = 0;
+    while (position < length)
+    {
+        var best_length = 0;
+        var best_distance = 0;
+
+        if (position + MIN_MATCH <= length)
+        {
+            var candidate = head[hash(position)];
+            var chain = 0;
+            var max_length = Math.min(MAX_MATCH, length - position);
+
+            while (typeof(candidate) !== "undefined" && candidate >= 0 && 
+                   position - candidate <= WINDOW_SIZE && chain < MAX_CHAIN)
+            {
+                if (bytes[candidate + best_length] === bytes[position + best_length])
+                {
+                    var match_length = 0;
+                    while (match_length < max_length && bytes[candidate + match_length] === bytes[position + match_length])
+                        match_length++;
+
+                    if (match_length > best_length)
+                    {
+                        best_length = match_length;
+                        best_distance = position - candidate;
+                        if (match_length == max_length)
+                            break;
+                    }
+                }
+                candidate = previous[candidate & (WINDOW_SIZE - 1)];
+                chain++;
+            }
+        }
+
+        if (best_length >= MIN_MATCH)
+        {
+            put_match(best_length, best_distance);
+            var end = position + best_length;
+            for (; position < end; position++)
+            {
+                if (position + MIN_MATCH <= length)
+                    insert(position);
+            }
+        }
+        else
+        {
+            put_symbol(bytes[position]);
+            if (position + MIN_MATCH <= length)
+                insert(position);
+            position++;
+        }
+    }
+
+    // end of block
+    put_symbol(256);
+    if (bit_count > 0)
+        out.push(bit_buffer & 0xff);
+
+    // adler32 checksum of the uncompressed data
+    var a = 1;
+    var b = 0;
+    for (var i = 0; i < length; )
+    {
+        var chunk_end = Math.min(i + 3800, length);
+        for (; i < chunk_end; i++)
+        {
+            a += bytes[i];
+            b += a;
+        }
+        a %= 65521;
+        b %= 65521;
+    }
+    out.push((b >> 8) & 0xff, b & 0xff, (a >> 8) & 0xff, a & 0xff);
+
+    return out;
+}
+
+// -----------------------------------------------------------------------------
+// Bulk payloads
+//
+// Big binary results do not travel through the socket. They are written to
+// a temporary file and the reply only carries a handle to it, which the
+// engine maps in memory and removes once it is done with it.
+// -----------------------------------------------------------------------------
+
+function bulkPath(format)
+{
+    var f = new TemporaryFile(format);
+    var path = f.path();
+    f.close();
+    return path;
+}
+
+function bulkHandle(path, format)
+{
+    return {"bulk": {"path": path, "size": new QFileInfo(path).size(), "format": format}};
+}
+
+// writes the QByteArray given in a single call and returns its handle
+function bulkWrite(data, format)
+{
+    var path = bulkPath(format);
+    var f = new QFile(path);
+    if (!f.open(QIODevice.WriteOnly))
+        throw new Error("Could not write bulk payload: " + path);
+
+    f.write(data);
+    f.close();
+    return bulkHandle(path, format);
+}
+
+// -----------------------------------------------------------------------------
+// Tracing of the messages exchanged with the engine. Call sites check
+// TRACE.enabled before building any string, so when tracing is off it costs
+// a property lookup. Payloads are truncated to TRACE.limit characters.
+// -----------------------------------------------------------------------------
+
+var TRACE = {
+    enabled: System.getenv("SGTK_HARMONY_ENGINE_TRACE") == "1",
+    limit: parseInt(System.getenv("SGTK_HARMONY_ENGINE_TRACE_LIMIT"), 10) || 256
+};
+
+function trace_payload(payload)
+{
+    var text = typeof(payload) == "string" ? payload : JSON.stringify(payload);
+    if (text && TRACE.limit > 0 && text.length > TRACE.limit)
+        return text.substring(0, TRACE.limit) + "... (" + text.length + " chars)";
+    return text;
+}
+
+// traces the message given followed by the payload, if any
+function trace(message, payload)
+{
+    if (!TRACE.enabled)
+        return;
+
+    if (typeof(payload) != "undefined")
+        message += trace_payload(payload);
+    MessageLog.trace("(TRACE) Shotgun bridge: " + message);
+}
+
 // -----------------------------------------------------------------------------
 // Engine related classes, methods
 // -----------------------------------------------------------------------------
@@ -452,6 +833,30 @@ function log_exception(data)
 }
 
 
+// messages the engine logged, batched: {records: [[level, message], ...],
+// dropped: n}. They are all written to the MessageLog in one go, the debug
+// ones only if debug logging is on.
+function log_batch(data, debug)
+{
+    var records = data.records || [];
+    var lines = [];
+
+    if (data.dropped)
+        lines.push("(WARNING) Shotgun bridge: " + data.dropped + " log messages were dropped.");
+
+    for (var i = 0; i < records.length; i++)
+    {
+        var level = records[i][0];
+        if (level == "DEBUG" && !debug)
+            continue;
+        lines.push("(" + level + ") Shotgun bridge: " + String(records[i][1]));
+    }
+
+    if (lines.length)
+        MessageLog.trace(lines.join("\n"));
+}
+
+
 function find_widgets(node, node_name, node_text, stop_if_found,  level, result)
 {
     if (typeof(level) === typeof(undefined))
@@ -507,41 +912,263 @@ function ask_question(title, message, default_option)
 }
 
 
-function Server(host, port) 
+// Commands run on one of three lanes. Interactive ones, like showing the menu
+// or a PING, run as soon as they arrive. The rest are queued, normal before
+// bulk, and run a time slice at a time, so the event loop gets to deliver
+// interactive commands in between. Requests can ask for a lane with their
+// "priority" field, otherwise it is looked up by method. Keep the table in
+// sync with python/tk_harmony/priority.py.
+var INTERACTIVE = "interactive";
+var NORMAL = "normal";
+var BULK = "bulk";
+
+var METHOD_PRIORITIES = {
+    "PING": INTERACTIVE,
+    "DIR": INTERACTIVE,
+    "NEGOTIATE": INTERACTIVE,
+    "SHOW_MENU": INTERACTIVE,
+    "TOGGLE_DEBUG_LOGGING": INTERACTIVE,
+    "QUIT": INTERACTIVE,
+    "IMPORT_CLIP": BULK,
+    "IMPORT_DRAWING": BULK,
+    "IMPORT_AUDIO": BULK,
+    "EXTRACT_THUMBNAIL": BULK,
+    "GET_NODES_OF_TYPE": BULK,
+    "GET_COLUMNS_OF_TYPE": BULK,
+    "GET_SOUND_COLUMN_FILENAMES": BULK,
+    "LOG_BATCH": BULK
+};
+
+function priorityOf(command)
+{
+    var priority = command.priority;
+    if (priority == INTERACTIVE || priority == NORMAL || priority == BULK)
+        return priority;
+
+    // replies are interactive, someone is waiting for them
+    if (command.method == null)
+        return INTERACTIVE;
+    return METHOD_PRIORITIES[String(command.method).toUpperCase()] || NORMAL;
+}
+
+
+// a client connected to the server. Every connection keeps its own framing
+// state and negotiates its own compression, so many clients can
+// talk to the server at once without getting in the way of each other.
+function Connection(server, socket, id)
+{
+    var self = this;
+    self.server = server;
+    self.socket = socket;
+    self.id = id;
+    self._decoder = new FrameDecoder();
+
+    // compression of the big messages sent to the client, if negotiated
+    self.compress = false;
+    self.compression_threshold = 0;
+    self.frames_compressed = 0;
+    self.bytes_saved_sent = 0;
+
+    self.toString = function()
+    {
+        return "Connection " + self.id;
+    }
+
+    self.is_open = function()
+    {
+        return self.socket != null;
+    }
+
+    // agrees with the client on whether big messages are compressed
+    self.negotiate = function(data)
+    {
+        // we can only compress, there is no zlib here to inflate what the
+        // engine would send us compressed
+        var compression = (data && data.compression) || [];
+        self.compress = compression.indexOf("zlib") >= 0 && data.compression_threshold > 0;
+        self.compression_threshold = self.compress ? data.compression_threshold : 0;
+
+        self.server.log_debug(self + " | negotiated compression: " + self.compress);
+        return {"compression": {"send": self.compress ? "zlib" : null, "receive": null}};
+    }
+
+    // returns the bytes to send for the payload given, compressed if it is
+    // big enough and compression pays off
+    self._compress = function(payload)
+    {
+        // a string is never shorter in characters than in UTF-8 bytes
+        if (!self.compress || payload.length < self.compression_threshold)
+            return null;
+
+        var bytes = utf8Encode(payload, []);
+        if (bytes.length < self.compression_threshold)
+            return null;
+
+        var compressed = zlibCompress(bytes);
+        if (compressed.length + 1 >= bytes.length)
+            return null;
+
+        self.frames_compressed += 1;
+        self.bytes_saved_sent += bytes.length - compressed.length - 1;
+        if (TRACE.enabled)
+            trace(self + " | compressed " + bytes.length + " bytes into " + (compressed.length + 1) +
+                  " | total saved: " + self.bytes_saved_sent);
+
+        compressed.unshift(COMPRESSED_FLAG);
+        return bytesToByteArray(compressed);
+    }
+
+    self.send = function(message)
+    {
+        if (self.socket == null)
+        {
+            self.server.log_debug(self + " is closed, message lost!: " + trace_payload(message));
+            return;
+        }
+
+        if (TRACE.enabled)
+            trace(self + " | status: " + self.socket.state() + " | valid: " + self.socket.isValid());
+
+        var data = new QByteArray();
+
+        var outstr = new QDataStream(data, QIODevice.WriteOnly);
+        outstr.setVersion(QDataStream.Qt_4_6);
+        outstr.writeInt(0);
+
+        var payload = JSON_CODEC.encode(message);
+        var compressed = self._compress(payload);
+        if (compressed != null)
+            data.append(compressed);
+        else
+            data.append(payload);
+
+        outstr.device().seek(0);
+        outstr.writeInt(data.size() - 4);
+
+        var written = self.socket.write(data);
+        if (TRACE.enabled)
+            trace(self + " | written len: " + written);
+    }
+
+    self.receive = function()
+    {
+        if (self.socket == null)
+            return;
+
+        self._decoder.feed(self.socket.readAll());
+
+        var i = 0;
+        var data = self._decoder.next();
+        while (data != null)
+        {
+            if (TRACE.enabled)
+                trace(self + " | request number: " + i + " | block size: " + data.size());
+            self.server._process_request(self, data);
+
+            // the connection might have been closed while processing it
+            if (self.socket == null)
+                return;
+            data = self._decoder.next();
+            i += 1;
+        }
+    }
+
+    self.wait_for_ready_read = function(timeout)
+    {
+        return self.socket != null && self.socket.waitForReadyRead(timeout);
+    }
+
+    self.on_error = function(socket_error)
+    {
+        self.server.log_error(self + " | connection error happened. " + socket_error.toString());
+    }
+
+    self.on_disconnected = function()
+    {
+        self.server.log_debug(self + " | client disconnected.");
+        self.socket = null;
+        self._decoder.reset();
+        self.server._forget(self);
+    }
+
+    self.close = function()
+    {
+        if (self.socket == null)
+            return;
+
+        var socket = self.socket;
+        self.socket = null;
+        self._decoder.reset();
+        socket.abort();
+    }
+
+    socket.readyRead.connect(self, self.receive);
+    socket.error.connect(self, self.on_error);
+    socket.disconnected.connect(self, self.on_disconnected);
+}
+
+
+// listens on a local socket (unix domain socket or named pipe) if a socket
+// name is given, falling back to TCP if that is not possible.
+//
+// Many clients can be connected at once. Replies go back through the
+// connection the request came from, while the events and requests Harmony
+// starts itself go to the primary connection: the oldest one still open,
+// which is the engine's main channel.
+function Server(host, port, socket_name)
 {
     var self = this;
     self.name = "Server"
-    self.socket = new QTcpServer(this);
+    self.socket = null;
     self.host = new QHostAddress(host);
     self.port = port;
+    self.socket_name = socket_name;
+    self.transport = null;
     self.active = false;
+    self.connections = [];
     self.connection = null;
-    self._block_size = 0;
-    self.INT32_SIZE = 4;
     self.MAX_READ_RESPONSE_TIME = 5000;
-    
+    self.PING_RESPONSE_TIME = 1000;
+
+    // queued commands, see priorityOf. Milliseconds of queued work run in
+    // one go before yielding to the event loop.
+    self.TIME_SLICE = 20;
+    self._lanes = {};
+    self._lanes[NORMAL] = [];
+    self._lanes[BULK] = [];
+    self._running = false;
+    self._queue_timer = new QTimer();
+    self._queue_timer.singleShot = true;
+    self._queue_timer.interval = 0;
+
     self.log_debug = log_debug;
     self.log_info = log_info;
     self.log_warning = log_warning;
     self.log_error = log_error;
     self.log_exception = log_exception;
     self.debug = true;
-    
+
     // rpc-ish
     self.m_id = 0;
+    self.m_connection_id = 0;
     self._callbacks = null;
     self._responses = {}
 
     self.start = function()
     {
         self.active = false;
+        self.connections = [];
         self.connection = null;
-        self._block_size = 0;
         self.register_command("DIR", self.list_methods);
 
-        if (self.socket.listen(self.host, self.port))
+        if (self.socket_name && self._listen_local())
+            self.transport = "local";
+        else if (self._listen_tcp())
+            self.transport = "tcp";
+
+        if (self.transport != null)
         {
-            self.log_debug("Local Server started: " + self.host.toString() + ":" + self.port);
+            self.log_debug("Local Server started: " + self.address() + " | transport: " + self.transport);
             self.active  = true;
             self.socket.newConnection.connect(self, self.on_new_connection);
             return true;
@@ -549,20 +1176,69 @@ function Server(host, port)
         else
         {
             self.active = false;
-            self.log_error("Local Server could not start! " + self.host.toString() + ":" + self.port);
+            self.log_error("Local Server could not start! " + self.address());
+            return false;
+        }
+    }
+
+    self._listen_local = function()
+    {
+        if (typeof(QLocalServer) === "undefined")
+        {
+            self.log_warning("Local sockets are not available, using TCP.");
             return false;
         }
+
+        // a socket left behind by a crashed session would make listen fail
+        QLocalServer.removeServer(self.socket_name);
+
+        self.socket = new QLocalServer(this);
+        if (self.socket.listen(self.socket_name))
+            return true;
+
+        self.log_warning("Could not listen on local socket " + self.socket_name + ", using TCP. " + self.socket.errorString());
+        self.socket = null;
+        return false;
+    }
+
+    self._listen_tcp = function()
+    {
+        self.socket = new QTcpServer(this);
+        if (self.socket.listen(self.host, self.port))
+            return true;
+
+        self.socket = null;
+        return false;
+    }
+
+    self.address = function()
+    {
+        if (self.transport == "local")
+            return self.socket_name;
+        return self.host.toString() + ":" + self.port;
     }
 
     self.close = function()
     {
         self.active = false;
-        self.socket.close()
+        if (self.socket != null)
+            self.socket.close();
+        self.transport = null;
+
+        self._queue_timer.stop();
+        self._lanes[NORMAL] = [];
+        self._lanes[BULK] = [];
+
+        var connections = self.connections.slice();
+        for (var i = 0; i < connections.length; i++)
+            connections[i].close();
+        self.connections = [];
+        self.connection = null;
     }
 
     self.list_methods = function()
     {
-        var commands = [];
+        var commands = ["NEGOTIATE"];
 
         for (var command in self._callbacks)
             commands.push(command);
@@ -572,290 +1248,534 @@ function Server(host, port)
 
     self.register_command = function(command, callback)
     {
-      if (self._callbacks === null) 
+      if (self._callbacks === null)
         self._callbacks = {};
 
       //MessageLog.trace("Registered command: " + command)
       self._callbacks[command] = callback;
     }
 
-    self._send = function(command)
+    // sends the message through the connection given, or the primary one
+    self._send = function(message, connection)
     {
-        if (self.socket && self.connection)
-        {
-            self.log_debug("Connection status: " + self.connection.state() );
-            self.log_debug("Connection valid: " + self.connection.isValid() );
-
-
-            command = command.toString();
-
-            var data = new QByteArray();
-
-            outstr = new QDataStream(data, QIODevice.WriteOnly);
-            outstr.setVersion(QDataStream.Qt_4_6);
-            outstr.writeInt(0);
-
-            data.append(command);
-
-            outstr.device().seek(0);
-            outstr.writeInt(data.size() - 4);
-
-            var written = self.connection.write(data);
-            self.log_debug("Written len: " + written );
-        }
+        connection = connection || self.connection;
+        if (connection != null && connection.is_open())
+            connection.send(message);
         else
-        {
-            self.log_debug("No connection, message lost!: " + command );
-        }
+            self.log_debug("No connection, message lost!: " + trace_payload(message));
     }
 
-
-    self._receive = function()
+    // decodes the payload of a frame
+    self._decode = function(data)
     {
-        self.log_debug("Receiving data ... ");
+        if (data.size() > 0 && (data.at(0) & 0xff) == COMPRESSED_FLAG)
+            throw new Error("Received a compressed message, compression was not negotiated that way.");
 
-        var stream = new QDataStream();
-        stream.setDevice(self.connection);
-        stream.setVersion(QDataStream.Qt_4_6);
+        // strings written with QDataStream.writeString carry a trailing '\0'
+        // that is counted in the frame size
+        if (data.size() > 0 && data.at(data.size() - 1) == 0)
+            data = data.left(data.size() - 1);
 
-        self.log_debug("self.connection.bytesAvailable() ... " + self.connection.bytesAvailable());
-        var i = 0;
-        while (self.connection.bytesAvailable() > 0)
-        {
-            self.log_debug("Request number: " + i);
-
-            if ( (self._block_size == 0 && self.connection.bytesAvailable() >= self.INT32_SIZE) || (self._block_size > 0 && self.connection.bytesAvailable() >= self._block_size) )
-            {
-                self._block_size = stream.readInt();
-                self.log_debug("Request number: " + i + " | block size: " + self._block_size);
-            }
-
-            if (self._block_size > 0 && self.connection.bytesAvailable() >= self._block_size)
-            {
-                var data = self.connection.read(self._block_size);
-                
-                // create the request
-                var request = "";
-                for ( var j = 0; j < data.size(); j++)
-                {
-                    if (data.at(j) >0 )
-                    {
-                        request = request.concat(String.fromCharCode(data.at(j)));
-                    }
-                }
-                self.log_debug("Request number: " + i + " | About to process | Request: " + request)
-                self._process_request(request) // #, caller_request_id=request_id)
-                self._block_size = 0; 
-                i+=1;
-            }
-        }
+        return JSON_CODEC.decode(byteArrayToString(data));
     }
 
     self._prepare_request = function(command, data, request_return)
     {
         self.m_id += 1;
-        request_id = self.m_id;
+        var request_id = self.m_id;
         var request = {"jsonrpc": "2.0",
                         "method": command,
                         "params": data,
                         "request_return": request_return,
                         "id": request_id};
-        var request = JSON.stringify(request);
         return request;
     }
 
+    self._reply_object = function(request_id, result)
+    {
+        // undefined values are dropped by JSON.stringify, but the client
+        // still needs the result key to resolve the request
+        if (typeof(result) === "undefined")
+            result = null;
+
+        return {"jsonrpc": "2.0",
+                "result": result,
+                "request_return": false,
+                "id": request_id};
+    }
+
+    self._error_object = function(request_id, error)
+    {
+        return {"jsonrpc": "2.0",
+                "error": error || null,
+                "id": request_id};
+    }
+
     self._prepare_reply = function(request_id, result)
     {
-        var request = {"jsonrpc": "2.0",
-                        "result": result,
-                        "request_return": false,
-                        "id": request_id};
-        var reply = JSON.stringify(request);
-        return reply;
+        return self._reply_object(request_id, result);
     }
 
     self._prepare_error = function(request_id, error)
     {
-        var request = {"jsonrpc": "2.0",
-                        "error": error || null,
-                        "id": request_id};
-        var error_reply = JSON.stringify(request);
-        return error_reply;
+        return self._error_object(request_id, error);
     }
 
-    self._process_request = function(request)
+    self._process_request = function(connection, data)
     {
         var command;
-        self.log_info("_process_request | Request: " + request);
 
-        // check is well formed json request
+        // check is a well formed request
         try
         {
-            command = JSON.parse(request);
+            command = self._decode(data);
         }
         catch(err)
         {
-            self.log_warning("Ignoring request, not well formed.  | Request: " + request);
+            self.log_warning("Ignoring request, not well formed. " + err.message);
             return;
         }
+        if (TRACE.enabled)
+            trace(connection + " | _process_request | Request: ", command);
+
+        // a batch of commands, the replies are sent back together in a
+        // single frame once all of them have run
+        var commands = command instanceof Array ? command : [command];
+
+        // interactive commands run straight away, and are replied to on
+        // their own so they do not wait for the rest of a batch
+        var queued = [];
+        var lane = NORMAL;
+        for (var i = 0; i < commands.length; i++)
+        {
+            var priority = priorityOf(commands[i]);
+            if (priority == INTERACTIVE)
+            {
+                var reply = self._process_command(connection, commands[i]);
+                if (reply != null)
+                    self._send_replies(connection, [reply]);
+            }
+            else
+            {
+                queued.push(commands[i]);
+                if (priority == BULK)
+                    lane = BULK;
+            }
+        }
+
+        if (queued.length > 0)
+        {
+            self._lanes[lane].push({"connection": connection, "commands": queued, "index": 0, "replies": []});
+            self._run_queue();
+        }
+    }
+
+    // runs the queued commands, normal ones before bulk ones, until the queue
+    // is empty or the time slice is over. Whatever is left runs in a later
+    // turn of the event loop, after any interactive command that arrived.
+    self._run_queue = function()
+    {
+        // a callback waiting for the engine lets the event loop run
+        if (self._running)
+            return;
 
+        self._running = true;
+        var st = new QTime();
+        st.start();
+        try
+        {
+            while (true)
+            {
+                var lane = self._lanes[NORMAL].length > 0 ? self._lanes[NORMAL] : self._lanes[BULK];
+                if (lane.length == 0)
+                    break;
+
+                var item = lane[0];
+                var reply = self._process_command(item.connection, item.commands[item.index]);
+                if (reply != null)
+                    item.replies.push(reply);
+
+                item.index += 1;
+                if (item.index >= item.commands.length)
+                {
+                    lane.shift();
+                    if (item.replies.length > 0)
+                        self._send_replies(item.connection, item.replies);
+                }
+
+                if (st.elapsed() >= self.TIME_SLICE)
+                {
+                    if (self._lanes[NORMAL].length > 0 || self._lanes[BULK].length > 0)
+                        self._queue_timer.start();
+                    break;
+                }
+            }
+        }
+        finally
+        {
+            self._running = false;
+        }
+    }
+
+    // runs a single command, returning the reply object to send back if
+    // any was requested
+    self._process_command = function(connection, command)
+    {
         // check there is a request id
         var request_id = command.id
         if (request_id == null)
         {
-            self.log_warning("Ignoring request, not well formed.  | Request: " + request);
-            return;
+            self.log_warning("Ignoring request, not well formed.  | Request: " + trace_payload(command));
+            return null;
         }
 
         // a function call
         if (command.method != null)
         {
-            self.log_debug("A function call. " + request);
-            var method = command.method.toUpperCase(); 
+            var method = command.method.toUpperCase();
             var params = command.params;
             var return_requested = command.request_return;
 
-            self.log_debug("Command method : " + method);
-            self.log_debug("Command return requested : " + (return_requested == true));
-            self.log_debug("Command method recognised: " + (method in self._callbacks));
+            // compression is agreed for each connection
+            var negotiate = method == "NEGOTIATE";
+            var recognised = negotiate || (self._callbacks != null && method in self._callbacks);
+
+            if (TRACE.enabled)
+                trace("Command method: " + method +
+                      " | return requested: " + (return_requested == true) +
+                      " | recognised: " + recognised);
 
-            if (self._callbacks && method in self._callbacks)
+            if (recognised)
             {
-                try 
+                try
                 {
-                   var result = self._callbacks[method](params);
+                   var result = negotiate ? connection.negotiate(params) : self._callbacks[method](params);
                    if (return_requested == true)
-                        self.send_reply(request_id, result);
+                        return self._reply_object(request_id, result);
                 }
                 catch(err)
                 {
                    self.log_error("An error ocurred executing callback for method: " + method + " and params: " + params);
                    self.log_error(err.message);
+                   if (return_requested == true)
+                        return self._error_object(request_id, err.message);
                 }
             }
             else
             {
-                self.log_warning("Command received was ignored: " + command);
+                self.log_warning("Command received was ignored: " + method);
+                if (return_requested == true)
+                    return self._error_object(request_id, "Unknown method: " + method);
             }
         }
-        // a result that we requested
+        // a result that we requested, ids are unique across connections
         else if (command.result != null)
         {
-            self.log_debug("This was a result | Result: " + request);
+            if (TRACE.enabled)
+                trace("This was a result | Result: ", command);
             self._responses[request_id] = command.result;
-            //return command.result;
         }
-        // an error that happened on the client side
+        // an error that happened on the client side, whoever is waiting for
+        // the reply gets null straight away
         else if (command.error != null)
         {
             self.log_error("Error occurred when requesting command. " + command.error);
+            if (request_id != null)
+                self._responses[request_id] = null;
         }
+        return null;
     }
 
-    self.send_and_receive_command = function(method, data)
+    // waits at most timeout milliseconds for the reply, MAX_READ_RESPONSE_TIME
+    // if not given. Returns null if the reply did not arrive in time. The
+    // request goes to the connection given, or the primary one.
+    self.send_and_receive_command = function(method, data, timeout, connection)
     {
+        if (timeout == null)
+            timeout = self.MAX_READ_RESPONSE_TIME;
+
+        connection = connection || self.connection;
+
         // request for a return value
         var request = self._prepare_request(method, data, true);
-        var request_id = request.id; 
+        var request_id = request.id;
 
         var st = new QTime();
         st.start();
 
-        self._send(request);
-        self.log_debug("Sent request in " + st.elapsed() + " secs | Request: " + request);
-
-        // receive
-        self.log_debug("Waiting to receive data...");
+        self._send(request, connection);
+        if (TRACE.enabled)
+            trace("Sent request in " + st.elapsed() + " ms | Request: ", request);
 
+        // receive, replies are processed as they arrive through readyRead
         var result = null;
         var st_response = new QTime();
         st_response.start();
 
-        self.connection.waitForReadyRead(self.MAX_READ_RESPONSE_TIME);
         while (true)
         {
-            System.processOneEvent();
             if (request_id in self._responses)
             {
                 result = self._responses[request_id];
-                self.log_debug("Received command result in " + st_response.elapsed() + " secs | Request ID: " + request_id + " | Result: " + result);
+                delete self._responses[request_id];
+                if (TRACE.enabled)
+                    trace("Received command result in " + st_response.elapsed() + " ms | Request ID: " + request_id + " | Result: ", result);
                 break;
             }
 
-            logger.debug("st_response_elapsed " + st_response.elapsed() + " secs | max : " + (self.MAX_READ_RESPONSE_TIME/1000) + " | responses : " + self._responses);
-            if (st_response_elapsed > self.MAX_READ_RESPONSE_TIME/1000)
+            var remaining = timeout - st_response.elapsed();
+            if (remaining <= 0 || connection == null || !connection.wait_for_ready_read(remaining))
             {
-                self.log_debug("Did not Received command result in " + st_response.elapsed() + " secs | Request ID: " + request_id + " | Responses: " + self._responses);
+                self.log_warning("Did not receive command result in " + st_response.elapsed() + " ms | Method: " + method + " | Request ID: " + request_id);
                 break;
             }
         }
 
-        self.log_debug("Done send and receive in " + st.elapsed() + " secs.");
+        if (TRACE.enabled)
+            trace("Done send and receive in " + st.elapsed() + " ms.");
         return result;
     }
 
-    self.send_command = function(command, data)
+    // sends the command to the connection given, or the primary one
+    self.send_command = function(command, data, connection)
     {
         var request = self._prepare_request(command, data)
-        self.log_debug("Command sent: " + request);
-        self._send(request)
+        if (TRACE.enabled)
+            trace("Command sent: ", request);
+        self._send(request, connection)
     }
 
-    self.send_reply = function(request_id, result)
+    self.send_reply = function(request_id, result, connection)
     {
-        try 
+        self._send_replies(connection, [self._reply_object(request_id, result)]);
+    }
+
+    // replies to a batch are sent as a single JSON array, single replies
+    // as a plain object
+    self._send_replies = function(connection, replies)
+    {
+        try
         {
-            var reply = self._prepare_reply(request_id, result)
-            MessageLog.trace("(DEBUG) Sending Response:" + reply);
-            self._send(reply);
+            var reply = replies.length == 1 ? replies[0] : replies;
+            if (TRACE.enabled)
+                trace("Sending Response: ", reply);
+            self._send(reply, connection);
         }
-        catch(err) 
+        catch(err)
         {
-            var reply = self._prepare_error(request_id, err)
-            self.log_error("Unexpected error while sending " + err.message + " message id: " + message_id);
-            self._send(reply);
+            self.log_error("Unexpected error while sending " + err.message);
+            for (var i = 0; i < replies.length; i++)
+                self._send(self._prepare_error(replies[i].id, err.message), connection);
         }
     }
 
-    self.on_connection_error = function(socket_error)
+    self._forget = function(connection)
     {
-        self.log_error("Connection error happened. " + socket_error.toString());
+        var index = self.connections.indexOf(connection);
+        if (index >= 0)
+            self.connections.splice(index, 1);
+
+        // the oldest connection left takes over as the primary one
+        self.connection = self.connections.length > 0 ? self.connections[0] : null;
     }
 
-    self.on_connection_disconnected = function(socket_error)
+    self._queue_timer.timeout.connect(self, self._run_queue);
+
+    self.on_new_connection = function()
     {
-        self.log_debug("Client disconnected.");
-        self.connection = null;
+        self.log_debug("New connection detected:");
+        while (self.socket.hasPendingConnections())
+        {
+            self.m_connection_id += 1;
+            var connection = new Connection(self, self.socket.nextPendingConnection(), self.m_connection_id);
+            self.connections.push(connection);
+            if (self.connection == null)
+                self.connection = connection;
 
+            self.log_debug("Client connected: " + connection + " | state: " + connection.socket.state() +
+                           " | connections: " + self.connections.length + " | primary: " + self.connection);
+
+            // the client replies straight away if it is alive
+            self.send_and_receive_command("PING", {}, self.PING_RESPONSE_TIME, connection);
+        }
     }
+}
 
-    self.on_new_connection = function()
+
+
+// Watches the scene and pushes an event to the engine every time something
+// the engine subscribed to changes, so it does not need to poll for it.
+// Events and their data:
+//   dirty         {dirty}
+//   saved         {path}
+//   project       {path}
+//   frame_range   {start_frame, stop_frame}
+//   nodes         {added, removed}
+//   columns       {added, removed}
+var SCENE_EVENTS = ["dirty", "saved", "project", "frame_range", "nodes", "columns"];
+
+function listAllNodes(group, nodes)
+{
+    var count = node.numberOfSubNodes(group);
+    for (var i = 0; i < count; i++)
     {
-        self.log_debug("New connection detected:");
-        if (self.socket.hasPendingConnections())
+        var sub_node = node.subNode(group, i);
+        nodes.push(sub_node);
+        if (node.isGroup(sub_node))
+            listAllNodes(sub_node, nodes);
+    }
+    return nodes;
+}
+
+function listAllColumns()
+{
+    var columns = [];
+    var count = column.numberOf();
+    for (var i = 0; i < count; i++)
+        columns.push(column.getName(i));
+    return columns;
+}
+
+// returns the names added to and removed from the list given
+function diffNames(before, after)
+{
+    var before_set = {};
+    var after_set = {};
+    var added = [];
+    var removed = [];
+
+    for (var i = 0; i < before.length; i++)
+        before_set[before[i]] = true;
+    for (var i = 0; i < after.length; i++)
+    {
+        after_set[after[i]] = true;
+        if (!(after[i] in before_set))
+            added.push(after[i]);
+    }
+    for (var i = 0; i < before.length; i++)
+    {
+        if (!(before[i] in after_set))
+            removed.push(before[i]);
+    }
+    return {"added": added, "removed": removed};
+}
+
+function SceneWatcher(publish)
+{
+    var self = this;
+    self.INTERVAL = 500;
+    self.publish = publish;
+    self.subscriptions = {};
+    self.state = null;
+    self.timer = null;
+
+    self.subscribe = function(events)
+    {
+        for (var i = 0; i < events.length; i++)
         {
-            self.connection = self.socket.nextPendingConnection();
+            if (SCENE_EVENTS.indexOf(events[i]) < 0)
+                throw new Error("Unknown scene event: " + events[i]);
+            self.subscriptions[events[i]] = true;
+        }
 
-            var state = self.connection.state();
+        // start from the current state, only changes are published
+        self.state = self.snapshot();
+        self.update_timer();
+        return SCENE_EVENTS.filter(function(event) { return event in self.subscriptions; });
+    }
 
-            self.connection.readyRead.connect(self, self._receive);
-            self.connection.error.connect(self, self.on_connection_error);
-            self.connection.disconnected.connect(self, self.on_connection_disconnected);
+    self.unsubscribe = function(events)
+    {
+        for (var i = 0; i < events.length; i++)
+            delete self.subscriptions[events[i]];
 
-            self.log_debug("Connection state: " + state);
-            self.log_debug("Client connected: " + self.connection.toString());
+        self.update_timer();
+        return SCENE_EVENTS.filter(function(event) { return event in self.subscriptions; });
+    }
 
-            self.send_and_receive_command("PING", {});
+    self.clear = function()
+    {
+        self.subscriptions = {};
+        self.update_timer();
+    }
+
+    self.update_timer = function()
+    {
+        var active = Object.keys(self.subscriptions).length > 0;
+        if (active && self.timer == null)
+        {
+            self.timer = new QTimer();
+            self.timer.interval = self.INTERVAL;
+            self.timer.timeout.connect(self, self.poll);
+            self.timer.start();
         }
-        else
+        else if (!active && self.timer != null)
         {
-            self.log_debug("-----------------------------------------------------------------------------");
-            self.log_debug("No pending connections!: %s" % self.connection.toString());
+            self.timer.stop();
+            self.timer = null;
         }
     }
-}
 
+    // the node and column lists are only gathered if somebody cares
+    self.snapshot = function()
+    {
+        var state = {"path": scene.currentProjectPath() + "/" + scene.currentVersionName() + ".xstage",
+                     "dirty": scene.isDirty(),
+                     "start_frame": scene.getStartFrame(),
+                     "stop_frame": scene.getStopFrame(),
+                     "nodes": null,
+                     "columns": null};
+
+        if ("nodes" in self.subscriptions)
+            state.nodes = listAllNodes("Top", []);
+        if ("columns" in self.subscriptions)
+            state.columns = listAllColumns();
+        return state;
+    }
+
+    self.poll = function()
+    {
+        var before = self.state;
+        var after = self.snapshot();
+        self.state = after;
+
+        if (before == null)
+            return;
+
+        var subscriptions = self.subscriptions;
+
+        if (before.path != after.path)
+        {
+            if ("project" in subscriptions)
+                self.publish("project", {"path": after.path});
+        }
+        else if (before.dirty && !after.dirty && "saved" in subscriptions)
+        {
+            self.publish("saved", {"path": after.path});
+        }
+
+        if (before.dirty != after.dirty && "dirty" in subscriptions)
+            self.publish("dirty", {"dirty": after.dirty});
 
+        if ((before.start_frame != after.start_frame || before.stop_frame != after.stop_frame) &&
+            "frame_range" in subscriptions)
+            self.publish("frame_range", {"start_frame": after.start_frame, "stop_frame": after.stop_frame});
+
+        if (before.nodes != null && after.nodes != null)
+        {
+            var nodes = diffNames(before.nodes, after.nodes);
+            if (nodes.added.length || nodes.removed.length)
+                self.publish("nodes", nodes);
+        }
+
+        if (before.columns != null && after.columns != null)
+        {
+            var columns = diffNames(before.columns, after.columns);
+            if (columns.added.length || columns.removed.length)
+                self.publish("columns", columns);
+        }
+    }
+}
 
 var app = QCoreApplication.instance();
 
@@ -874,6 +1794,7 @@ function Engine()
     self.debug = true;
     self.is_engine_ready = false;
     self.on_engine_ready_callbacks = [];
+    self.scene_watcher = null;
 
     // ------------------------------------------------------------------------
     // Local Engine methods
@@ -939,17 +1860,15 @@ function Engine()
     {
         if (self.window != null)
         {
-            // get a random path for the thumbnail
-            f = new TemporaryFile( "png" );
-            filename = f.path();
-            f.close();
-    
+            // the image is saved straight into the bulk payload file
+            var filename = bulkPath("png");
+
             var result = find_widgets(self.window, "ContainGLWidget", true);
             var p = QPixmap.grabWindow(result[0].winId());
             p.save(filename, "png");
-            return filename;
+            return bulkHandle(filename, "png");
         }
-        return "";
+        return null;
     }
 
     self.get_version = function(data) 
@@ -966,6 +1885,10 @@ function Engine()
         // the python engine is about to be restarted , so make sure the
         // Harmony engine is marked as not finished loading.
         self.is_engine_ready = false;
+
+        // the new engine subscribes to whatever it needs again
+        if (self.scene_watcher != null)
+            self.scene_watcher.clear();
     }
 
     self.engine_ready = function(data)
@@ -993,9 +1916,15 @@ function Engine()
         return false;
     }
     
+    self.log_batch = function(data)
+    {
+        log_batch(data, self.debug);
+    }
+
     self.toggle_debug_logging = function(data)
     {
         self.debug = data.enabled;
+        TRACE.enabled = data.enabled == true;
     }
     
     self.current_project_path = function(data)
@@ -1249,6 +2178,27 @@ function Engine()
         return sound_filenames;
     }
 
+    // Scene events
+    self.publish_scene_event = function(event, data)
+    {
+        if (self.server != null)
+            self.server.send_command("SCENE_EVENT", {"event": event, "data": data});
+    }
+
+    self.subscribe = function(data)
+    {
+        if (self.scene_watcher == null)
+            self.scene_watcher = new SceneWatcher(self.publish_scene_event);
+        return self.scene_watcher.subscribe(data.events);
+    }
+
+    self.unsubscribe = function(data)
+    {
+        if (self.scene_watcher == null)
+            return [];
+        return self.scene_watcher.unsubscribe(data.events);
+    }
+
     // ----
     self.ping = function(data)
     {
@@ -1306,6 +2256,7 @@ function Engine()
         self.registerCallback("LOG_DEBUG",      log_debug);
         self.registerCallback("LOG_ERROR",      log_error);
         self.registerCallback("LOG_EXCEPTION",  log_exception);
+        self.registerCallback("LOG_BATCH",      self.log_batch);
         self.registerCallback("GET_VERSION",    self.get_version);
         self.registerCallback("ENGINE_READY",   self.engine_ready);
         self.registerCallback("ENGINE_RESTART",   self.engine_restart);
@@ -1351,6 +2302,9 @@ function Engine()
 
         self.registerCallback("PING", self.ping);
 
+        self.registerCallback("SUBSCRIBE",   self.subscribe);
+        self.registerCallback("UNSUBSCRIBE", self.unsubscribe);
+
         self.registerCallback("CLOSE",   self.stop);
         self.log_debug("Registered callbacks");
     }
@@ -1369,8 +2323,11 @@ function Engine()
             self.log_debug("New server");
             var host = System.getenv("SGTK_HARMONY_ENGINE_HOST");
             var port = parseInt(System.getenv("SGTK_HARMONY_ENGINE_PORT"));
+            var socket_name = null;
+            if (System.getenv("SGTK_HARMONY_ENGINE_TRANSPORT") == "local")
+                socket_name = System.getenv("SGTK_HARMONY_ENGINE_SOCKET_NAME");
 
-            self.server = new Server(host, port);
+            self.server = new Server(host, port, socket_name);
             self.register_callbacks();
             self.server.start();
         }
@@ -13,6 +13,7 @@ import re
 import sys
 import shutil
 import hashlib
+import uuid
 import socket
 import platform
 import subprocess
@@ -214,9 +215,26 @@ class HarmonyLauncher(SoftwareLauncher):
             "\\", "/"
         )
 
+        # TCP is always set up, Harmony falls back to it if the local socket
+        # transport is not available.
         required_env["SGTK_HARMONY_ENGINE_HOST"] = "127.0.0.1"
         required_env["SGTK_HARMONY_ENGINE_PORT"] = str(get_free_port())
 
+        transport = os.environ.get("SGTK_HARMONY_ENGINE_TRANSPORT") or self.get_setting(
+            "transport", "tcp"
+        )
+        required_env["SGTK_HARMONY_ENGINE_TRANSPORT"] = transport
+        if transport == "local":
+            # unique name, so there is no need to look for a free one
+            required_env["SGTK_HARMONY_ENGINE_SOCKET_NAME"] = "tk-harmony-%s" % uuid.uuid4().hex
+
+        # Harmony traces the messages it exchanges with the engine only if
+        # debug logging is on, see trace_payload_limit
+        required_env["SGTK_HARMONY_ENGINE_TRACE"] = "1" if sgtk.LogManager().global_debug else "0"
+        required_env["SGTK_HARMONY_ENGINE_TRACE_LIMIT"] = str(
+            self.get_setting("trace_payload_limit", 256)
+        )
+
         if file_to_open:
             # Add the file name to open to the launch environment
             required_env["SGTK_FILE_TO_OPEN"] = file_to_open
@@ -0,0 +1,22 @@
+"""
+The modules tested do not depend on Qt or Toolkit, so they are imported
+straight from the package folder, like the benchmarks do.
+"""
+
+import os
+import sys
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+sys.path.insert(0, os.path.join(ROOT, "python", "tk_harmony"))
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
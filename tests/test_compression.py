@@ -0,0 +1,90 @@
+"""
+Tests for the compression of the messages. bridge_reply_deflate.bin is a
+frame compressed by the deflate encoder of configure.js, so the engine is
+known to inflate what Harmony sends.
+"""
+
+import os
+import json
+
+from conftest import read_fixture
+from codec import JSON_CODEC
+from compression import DEFAULT_THRESHOLD, Compression, is_compressed
+from framing import FrameDecoder
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+def nodes_payload(count=2000):
+    nodes = ["Top/Group_%s/Drawing_%s" % (i, i) for i in range(count)]
+    return json.dumps({"result": nodes, "id": "r1"}).encode("utf-8")
+
+
+def enabled(threshold):
+    compression = Compression(threshold=threshold)
+    compression.enabled = True
+    return compression
+
+
+def test_disabled_by_default():
+    assert DEFAULT_THRESHOLD == 0
+
+    compression = Compression()
+    compression.enabled = True
+    payload = nodes_payload()
+    assert compression.compress(payload) is payload
+
+
+def test_not_negotiated():
+    payload = nodes_payload()
+    assert Compression(threshold=1).compress(payload) is payload
+
+
+def test_round_trip():
+    compression = enabled(1024)
+    payload = nodes_payload()
+
+    compressed = compression.compress(payload)
+    assert is_compressed(compressed)
+    assert len(compressed) < len(payload)
+    assert compression.decompress(memoryview(compressed)) == payload
+
+    stats = compression.stats()
+    assert stats["frames_compressed"] == 1
+    assert stats["frames_decompressed"] == 1
+    assert stats["bytes_saved_sent"] == len(payload) - len(compressed)
+
+
+def test_below_threshold():
+    compression = enabled(1024)
+    payload = b'{"id": 1}'
+    assert compression.compress(payload) is payload
+
+
+def test_incompressible_is_sent_as_is():
+    compression = enabled(16)
+    payload = os.urandom(4096)
+    assert compression.compress(payload) is payload
+
+
+def test_uncompressed_passes_through():
+    payload = nodes_payload(10)
+    assert not is_compressed(payload)
+    assert Compression().decompress(payload) is payload
+
+
+def test_inflates_harmony_deflate():
+    decoder = FrameDecoder()
+    decoder.feed(read_fixture("bridge_reply_deflate.bin"))
+    payloads = list(decoder.frames())
+    assert len(payloads) == 1
+    assert is_compressed(payloads[0])
+
+    compression = Compression()
+    message = JSON_CODEC.decode(compression.decompress(payloads[0]))
+    assert message["id"] == "r1"
+    assert len(message["result"]) == 2001
+    assert message["result"][-1] == u"Top/caf\xe9_\u2603"
+    assert compression.stats()["bytes_saved_received"] > 0
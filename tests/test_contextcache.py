@@ -0,0 +1,112 @@
+"""
+Tests for the cache of the contexts resolved for the work file folders.
+"""
+
+import os
+import json
+
+from contextcache import VERSION, ContextCache, cache_key, fingerprint
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+CONTEXT = {"project": {"type": "Project", "id": 1}, "entity": {"type": "Shot", "id": 2}}
+
+
+def write(path, data):
+    with open(path, "w") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_cache_key_is_per_folder():
+    assert cache_key("/work/shot/a.xstage") == cache_key("/work/shot/b.xstage")
+    assert cache_key("/work/shot/a.xstage") != cache_key("/work/other/a.xstage")
+    assert cache_key("/work/shot/a.xstage", "config") != cache_key("/work/shot/a.xstage")
+
+
+def test_fingerprint(tmpdir):
+    path = write(tmpdir.join("templates.yml"), "keys: {}")
+    missing = str(tmpdir.join("missing.yml"))
+
+    (found, none) = fingerprint([path, missing])
+    assert found[1] == len("keys: {}")
+    assert none is None
+
+
+def test_hit(tmpdir):
+    templates = write(tmpdir.join("templates.yml"), "keys: {}")
+    cache = ContextCache()
+    cache.put("key", CONTEXT, [templates])
+
+    assert cache.get("key") == CONTEXT
+    assert cache.get("other") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_changed_files_invalidate(tmpdir):
+    templates = write(tmpdir.join("templates.yml"), "keys: {}")
+    cache = ContextCache()
+    cache.put("key", CONTEXT, [templates])
+
+    write(tmpdir.join("templates.yml"), "keys: {Shot: {type: str}}")
+    assert cache.get("key") is None
+    assert cache.get("key") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_missing_files_invalidate_once_created(tmpdir):
+    path_cache = str(tmpdir.join("path_cache.db"))
+    cache = ContextCache()
+    cache.put("key", CONTEXT, [path_cache])
+    assert cache.get("key") == CONTEXT
+
+    write(path_cache, "")
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_are_evicted():
+    cache = ContextCache(capacity=2)
+    cache.put("a", CONTEXT, [])
+    cache.put("b", CONTEXT, [])
+    cache.get("a")
+    cache.put("c", CONTEXT, [])
+
+    assert cache.get("b") is None
+    assert cache.get("a") == CONTEXT
+    assert cache.stats()["evictions"] == 1
+
+
+def test_save_and_load(tmpdir):
+    templates = write(tmpdir.join("templates.yml"), "keys: {}")
+    path = str(tmpdir.join("cache", "contexts.json"))
+
+    cache = ContextCache(path=path)
+    for key in "abc":
+        cache.put(key, CONTEXT, [templates])
+    cache.save()
+    cache.save()
+
+    loaded = ContextCache(capacity=2, path=path)
+    assert loaded.load()
+    assert len(loaded) == 2
+    assert loaded.get("a") is None
+    assert loaded.get("c") == CONTEXT
+    assert os.listdir(os.path.dirname(path)) == ["contexts.json"]
+
+
+def test_load_ignores_bad_files(tmpdir):
+    cache = ContextCache(path=str(tmpdir.join("missing.json")))
+    assert not cache.load()
+
+    cache.path = write(tmpdir.join("broken.json"), "{")
+    assert not cache.load()
+
+    cache.path = write(
+        tmpdir.join("outdated.json"), json.dumps({"version": VERSION + 1, "entries": []})
+    )
+    assert not cache.load()
+    assert len(cache) == 0
@@ -0,0 +1,126 @@
+"""
+Tests for the frame decoder and the codec, fed with the byte stream the
+stand-in server sent to a client: a PING pushed on connect, the NEGOTIATE
+reply, a node list, the reply to a batch and an empty result.
+"""
+
+import struct
+
+import pytest
+
+from conftest import read_fixture
+from codec import JSON_CODEC, CodecError
+from framing import INT32_SIZE, FrameDecoder, pack_frame
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+STREAM = read_fixture("bridge_replies.bin")
+
+
+def decode_all(decoder):
+    return [JSON_CODEC.decode(payload) for payload in decoder.frames()]
+
+
+def expected_messages():
+    messages = []
+    offset = 0
+    while offset < len(STREAM):
+        size = struct.unpack_from(">i", STREAM, offset)[0]
+        start = offset + INT32_SIZE
+        messages.append(JSON_CODEC.decode(STREAM[start : start + size]))
+        offset = start + size
+    return messages
+
+
+def test_whole_stream_in_one_read():
+    decoder = FrameDecoder()
+    decoder.feed(STREAM)
+
+    messages = decode_all(decoder)
+    assert [message["id"] for message in messages[:3]] == [1, "n1", "r1"]
+    assert [reply["id"] for reply in messages[3]] == ["b1", "b2"]
+    assert messages[4]["id"] == "m1"
+    assert len(decoder) == 0
+
+
+@pytest.mark.parametrize("split", range(1, 2 * INT32_SIZE + 1))
+def test_split_prefix(split):
+    # the size of the first frame arrives in two reads
+    decoder = FrameDecoder()
+    decoder.feed(STREAM[:split])
+    assert decode_all(decoder) == []
+
+    decoder.feed(STREAM[split:])
+    assert decode_all(decoder) == expected_messages()
+
+
+def test_one_byte_at_a_time():
+    decoder = FrameDecoder()
+    messages = []
+    for i in range(len(STREAM)):
+        decoder.feed(STREAM[i : i + 1])
+        messages.extend(decode_all(decoder))
+    assert messages == expected_messages()
+    assert len(decoder) == 0
+
+
+@pytest.mark.parametrize("size", [7, 64, 100, 333])
+def test_arbitrary_reads(size):
+    decoder = FrameDecoder()
+    messages = []
+    for offset in range(0, len(STREAM), size):
+        decoder.feed(STREAM[offset : offset + size])
+        messages.extend(decode_all(decoder))
+    assert messages == expected_messages()
+
+
+def test_truncated_payload_waits_for_the_rest():
+    decoder = FrameDecoder()
+    decoder.feed(STREAM[:-10])
+
+    messages = decode_all(decoder)
+    assert messages == expected_messages()[:-1]
+    # the last frame stays buffered until it is complete
+    assert 0 < len(decoder) < len(STREAM)
+    assert decode_all(decoder) == []
+
+    decoder.feed(STREAM[-10:])
+    assert decode_all(decoder) == expected_messages()[-1:]
+
+
+def test_reset_drops_partial_frames():
+    decoder = FrameDecoder()
+    decoder.feed(STREAM[:INT32_SIZE + 3])
+    decoder.reset()
+    assert len(decoder) == 0
+
+    decoder.feed(STREAM)
+    assert decode_all(decoder) == expected_messages()
+
+
+def test_payloads_held_while_feeding():
+    decoder = FrameDecoder()
+    decoder.feed(STREAM)
+    payloads = list(decoder.frames())
+
+    # the views handed out are still alive, the buffer cannot shrink in place
+    decoder.feed(pack_frame(b'{"id": "late"}'))
+    assert JSON_CODEC.decode(payloads[0]) == expected_messages()[0]
+    assert decode_all(decoder) == [{"id": "late"}]
+
+
+def test_codec_round_trip():
+    message = {"method": "LOG_INFO", "params": {"message": u"caf\xe9 \u2603"}, "id": 1}
+    payload = JSON_CODEC.encode(message)
+
+    assert JSON_CODEC.decode(payload) == message
+    assert JSON_CODEC.decode(memoryview(payload)) == message
+
+
+@pytest.mark.parametrize("payload", [b'{"id": 1', b"\xff\xfe", b""])
+def test_codec_rejects_malformed(payload):
+    with pytest.raises(CodecError):
+        JSON_CODEC.decode(payload)
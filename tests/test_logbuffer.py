@@ -0,0 +1,30 @@
+"""
+Tests for the buffer the log messages are gathered in.
+"""
+
+from logbuffer import LogBuffer
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+def test_append_and_drain():
+    buffer = LogBuffer()
+    assert buffer.append("INFO", "first") == 1
+    assert buffer.append("DEBUG", "second") == 2
+
+    assert buffer.drain() == ([("INFO", "first"), ("DEBUG", "second")], 0)
+    assert buffer.drain() == ([], 0)
+    assert buffer.append("INFO", "third") == 1
+
+
+def test_oldest_are_dropped_when_full():
+    buffer = LogBuffer(capacity=2)
+    for i in range(5):
+        buffer.append("INFO", i)
+
+    assert buffer.drain() == ([("INFO", 3), ("INFO", 4)], 3)
+    assert buffer.drain() == ([], 0)
+    assert buffer.stats()["dropped"] == 3
+    assert buffer.stats()["batches"] == 1
@@ -0,0 +1,133 @@
+"""
+Tests for the memoization of the calls made to Harmony.
+"""
+
+from memo import MemoCache, freeze, make_key, memoized, registry_of
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Scene(object):
+    def __init__(self):
+        self.calls = 0
+        self.frame_range = [1, 24]
+        self.path = "/projects/scene.xstage"
+
+    @memoized(tags=("frame_range",))
+    def get_frame_range(self):
+        self.calls += 1
+        return self.frame_range
+
+    @memoized(tags=("project",))
+    def get_path(self):
+        self.calls += 1
+        return self.path
+
+    @memoized(maxsize=2)
+    def get_metadata(self, node, attr_name=None):
+        self.calls += 1
+        return "%s.%s" % (node, attr_name)
+
+    @memoized()
+    def get_nothing(self):
+        self.calls += 1
+        return None
+
+
+def test_freeze():
+    assert freeze([1, [2, 3]]) == (1, (2, 3))
+    assert freeze({"b": 1, "a": [2]}) == freeze({"a": [2], "b": 1})
+    assert freeze(set([1, 2])) == frozenset([1, 2])
+    assert make_key((["READ"],), {}) == make_key((["READ"],), {})
+
+
+def test_cached_per_instance():
+    first, second = Scene(), Scene()
+    assert first.get_path() == first.get_path()
+    assert first.calls == 1
+
+    second.get_path()
+    assert second.calls == 1
+
+
+def test_arguments_are_part_of_the_key():
+    scene = Scene()
+    assert scene.get_metadata("Top/Read", attr_name="path") == "Top/Read.path"
+    assert scene.get_metadata("Top/Read", attr_name="path") == "Top/Read.path"
+    assert scene.get_metadata("Top/Read", attr_name="name") == "Top/Read.name"
+    assert scene.calls == 2
+
+
+def test_unhashable_arguments_are_not_cached():
+    scene = Scene()
+    scene.get_metadata(bytearray(b"Top/Read"))
+    scene.get_metadata(bytearray(b"Top/Read"))
+    assert scene.calls == 2
+
+
+def test_none_is_not_cached():
+    scene = Scene()
+    scene.get_nothing()
+    scene.get_nothing()
+    assert scene.calls == 2
+
+
+def test_results_are_copied():
+    scene = Scene()
+    scene.get_frame_range().append(48)
+    assert scene.get_frame_range() == [1, 24]
+
+    scene.frame_range.append(48)
+    assert scene.get_frame_range() == [1, 24]
+    assert scene.calls == 1
+
+
+def test_invalidate_by_tag():
+    scene = Scene()
+    scene.get_frame_range()
+    scene.get_path()
+
+    assert registry_of(scene).invalidate("frame_range") == 1
+    scene.get_frame_range()
+    scene.get_path()
+    assert scene.calls == 3
+
+    assert registry_of(scene).invalidate() == 2
+    scene.get_path()
+    assert scene.calls == 4
+
+
+def test_least_recently_used_are_evicted():
+    scene = Scene()
+    scene.get_metadata("a")
+    scene.get_metadata("b")
+    scene.get_metadata("a")
+    scene.get_metadata("c")
+    scene.get_metadata("a")
+    assert scene.calls == 3
+
+    scene.get_metadata("b")
+    assert scene.calls == 4
+    assert registry_of(scene).stats()["get_metadata"]["evictions"] == 2
+
+
+def test_expiration():
+    clock = Clock()
+    cache = MemoCache(ttl=5, clock=clock)
+    cache.put("key", "value")
+    assert cache.get("key") == (True, "value")
+
+    clock.now += 5
+    assert cache.get("key") == (False, None)
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["hits"] == 1
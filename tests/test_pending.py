@@ -0,0 +1,89 @@
+"""
+Tests for the table of requests waiting for a reply.
+"""
+
+from pending import PendingTable
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+def test_pop_consumes():
+    table = PendingTable()
+    table.add("r1", "GET_VERSION", 10)
+
+    assert "r1" in table
+    assert table.pop("r1") == "GET_VERSION"
+    assert table.pop("r1") is None
+    assert len(table) == 0
+    assert table.stats()["consumed"] == 1
+
+
+def test_expire():
+    table = PendingTable()
+    table.add("r1", "first", 10)
+    table.add("r2", "second", 20)
+    table.add("r3", "third", 30)
+
+    assert table.expire(5) == []
+    assert table.expire(20) == ["first", "second"]
+    assert list(table.values()) == ["third"]
+    assert table.stats()["expired"] == 2
+
+
+def test_extend_moves_the_deadline_away():
+    table = PendingTable()
+    table.add("r1", "first", 10)
+    table.add("r2", "second", 10)
+
+    table.extend("r1", 50)
+    table.extend("r2", 5)
+    assert table.expire(20) == ["second"]
+    assert table.expire(49) == []
+    assert table.expire(50) == ["first"]
+
+
+def test_removed_and_consumed_do_not_expire():
+    table = PendingTable()
+    table.add("r1", "first", 10)
+    table.add("r2", "second", 10)
+    table.remove("r1")
+    table.pop("r2")
+
+    assert table.expire(100) == []
+    assert table.stats()["consumed"] == 1
+    assert table.stats()["expired"] == 0
+
+
+def test_readded_request_keeps_its_new_deadline():
+    table = PendingTable()
+    table.add("r1", "first", 10)
+    table.pop("r1")
+    table.add("r1", "again", 50)
+
+    assert table.expire(20) == []
+    assert table.expire(50) == ["again"]
+
+
+def test_oldest_are_evicted_when_full():
+    table = PendingTable(capacity=2)
+    assert table.add("r1", "first", 10) == []
+    assert table.add("r2", "second", 10) == []
+    assert table.add("r3", "third", 10) == ["first"]
+
+    assert "r1" not in table
+    assert table.expire(10) == ["second", "third"]
+    assert table.stats()["evicted"] == 1
+    assert table.stats()["peak"] == 2
+
+
+def test_stale_heap_items_are_dropped_once_empty():
+    table = PendingTable()
+    for i in range(100):
+        table.add(i, i, 10)
+        table.extend(i, 20)
+        table.pop(i)
+
+    table.expire(0)
+    assert table._heap == []
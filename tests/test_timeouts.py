@@ -0,0 +1,69 @@
+"""
+Tests for the timeouts derived from the latency of the replies.
+"""
+
+from timeouts import AdaptiveTimeout
+
+
+__author__ = "Diego Garcia Huerta"
+__contact__ = "https://www.linkedin.com/in/diegogh/"
+
+
+def observed(method, latencies, **kwargs):
+    timeouts = AdaptiveTimeout(default=10000, min_samples=5, **kwargs)
+    for latency in latencies:
+        timeouts.record(method, latency)
+    return timeouts
+
+
+def test_default_until_enough_samples():
+    timeouts = observed("GET_VERSION", [10, 10, 10, 10])
+    assert timeouts.timeout_for("GET_VERSION") == 10000
+    assert timeouts.timeout_for("NEVER_SENT") == 10000
+
+
+def test_adapts_to_latency():
+    timeouts = observed("GET_NODES", [400] * 5, minimum=100)
+    assert timeouts.timeout_for("GET_NODES") == 1200
+
+
+def test_clamped():
+    assert observed("GET_VERSION", [1] * 5).timeout_for("GET_VERSION") == 1000
+    assert observed("RENDER", [60000] * 5).timeout_for("RENDER") == 10000
+
+
+def test_timeouts_give_more_time():
+    timeouts = observed("GET_NODES", [400] * 5, minimum=100, percentile=50)
+    for _ in range(6):
+        timeouts.record_timeout("GET_NODES", 3000)
+    assert timeouts.timeout_for("GET_NODES") == 9000
+    assert timeouts.stats()["GET_NODES"]["timeouts"] == 6
+
+
+def test_window_forgets_old_latencies():
+    timeouts = observed("GET_NODES", [3000] * 5 + [400] * 5, minimum=100, window=5)
+    assert timeouts.timeout_for("GET_NODES") == 1200
+
+
+def test_percentile_of():
+    timeouts = observed("GET_NODES", range(1, 101))
+    assert timeouts.percentile_of("GET_NODES", 50) == 50
+    assert timeouts.percentile_of("GET_NODES", 99) == 99
+    assert timeouts.percentile_of("GET_NODES", 100) == 100
+    assert timeouts.percentile_of("NEVER_SENT", 50) is None
+
+
+def test_timeout_for_many_scales_with_the_requests():
+    timeouts = observed("GET_NODE_METADATA", [400] * 5, minimum=100)
+    assert timeouts.timeout_for_many([]) == 0
+    assert timeouts.timeout_for_many(["GET_NODE_METADATA"]) == 1200
+    assert timeouts.timeout_for_many(["GET_NODE_METADATA"] * 500) == 1200 + 499 * 20
+    assert timeouts.timeout_for_many(["GET_NODE_METADATA", "NEVER_SENT"]) == 10020
+
+
+def test_timeout_for_many_is_capped():
+    timeouts = observed("GET_NODE_METADATA", [400] * 5, minimum=100, batch_maximum=5000)
+    assert timeouts.timeout_for_many(["GET_NODE_METADATA"] * 10000) == 5000
+
+    # never less than what the slowest request alone would get
+    assert timeouts.timeout_for_many(["GET_NODE_METADATA", "RENDER"] * 1000) == 10000